@@ -6,6 +6,7 @@ from fastapi import (
     WebSocket,
     WebSocketDisconnect,
 )
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
@@ -14,10 +15,24 @@ import datetime
 import json
 from backend.global_methods import check_if_file_exists
 from backend.simulation_manager import SimulationManager
+from backend.persona.prompt_template.rate_limiter import rate_limits
+from backend.persona.prompt_template.single_flight import single_flight
+from backend.persona.prompt_template.retry_policy import circuit_breakers
+from backend.persona.prompt_template.endpoint_pool import endpoint_pools
+from backend.persona.prompt_template.prompt_dag import prompt_dag_stats
+from backend.persona.prompt_template.prompt_templates import prompt_templates
+from backend.persona.prompt_template.prompt_metrics import prompt_metrics
+from backend.persona.prompt_template.model_router import model_router
+from backend.persona.prompt_template.context_builder import prompt_context
+from backend.persona.cognitive_modules.poignancy_scorer import poignancy_scorers
+from backend.persona.cognitive_modules.semantic_memo import semantic_memo
 
 # Create simulation manager instance
 sim_manager = SimulationManager()
 
+# Compile every prompt template up front instead of on the first step
+prompt_templates.preload()
+
 # FastAPI app and CORS setup
 app = FastAPI()
 
@@ -104,6 +119,63 @@ def get_persona_schedule():
     return {"schedule": sim_manager.get_persona_schedule()}
 
 
+@router.get("/persona/memory-index")
+def get_persona_memory_index():
+    if not sim_manager.persona or sim_manager.persona.a_mem.ann_index is None:
+        return {}
+    return sim_manager.persona.a_mem.ann_index.stats()
+
+
+@router.get("/llm/rate-limits")
+def get_llm_rate_limits():
+    return rate_limits.stats()
+
+
+@router.get("/llm/single-flight")
+def get_llm_single_flight():
+    return single_flight.stats()
+
+
+@router.get("/llm/circuit-breakers")
+def get_llm_circuit_breakers():
+    return circuit_breakers.stats()
+
+
+@router.get("/llm/prompt-dag")
+def get_llm_prompt_dag():
+    return prompt_dag_stats.stats()
+
+
+@router.get("/llm/prompt-metrics")
+def get_llm_prompt_metrics():
+    return prompt_metrics.stats()
+
+
+@router.get("/llm/routes")
+def get_llm_routes():
+    return model_router.stats()
+
+
+@router.get("/llm/poignancy-scorer")
+def get_llm_poignancy_scorer():
+    return poignancy_scorers.stats()
+
+
+@router.get("/llm/semantic-memo")
+def get_llm_semantic_memo():
+    return semantic_memo.stats()
+
+
+@router.get("/llm/endpoints")
+def get_llm_endpoints():
+    return endpoint_pools.stats()
+
+
+@router.get("/llm/prompt-context")
+def get_llm_prompt_context():
+    return prompt_context.stats()
+
+
 app.include_router(router)
 
 # --- WebSocket endpoint for step-based simulation ---
@@ -128,12 +200,17 @@ async def websocket_endpoint(websocket: WebSocket):
             if request.get("action") == "next_step":
                 # Process next simulation step
                 start_time = datetime.datetime.now()
+                metrics_before = prompt_metrics.snapshot()
                 
                 # Get environment state from request
                 env_data = request.get("environment", {})
                 
-                # Process agent decision using the cognitive loop
-                agent_decision = sim_manager.process_agent_decision(env_data)
+                # Process agent decision using the cognitive loop. The loop
+                # blocks on LLM calls, so it runs in a worker thread to keep
+                # the server's event loop free.
+                agent_decision = await run_in_threadpool(
+                    sim_manager.process_agent_decision, env_data
+                )
                 
                 # Calculate processing time
                 end_time = datetime.datetime.now()
@@ -148,7 +225,8 @@ async def websocket_endpoint(websocket: WebSocket):
                         "curr_time": datetime.datetime.now().strftime("%B %d, %Y, %H:%M:%S"),
                         "status": "complete",
                         "step_id": request.get("step_id", 0),
-                        "processing_time": f"{processing_time:.1f}s"
+                        "processing_time": f"{processing_time:.1f}s",
+                        "prompt_metrics": prompt_metrics.step_summary(metrics_before),
                     },
                 }
                 await websocket.send_text(json.dumps(response))
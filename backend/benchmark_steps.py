@@ -0,0 +1,242 @@
+"""
+File: benchmark_steps.py
+Description: Measures simulation steps/sec by driving the cognitive loop
+directly through SimulationManager.process_agent_decision, the same entry
+point the websocket handler uses. Meant to run against llm_stub_server.py so
+the numbers do not depend on the network.
+
+The bundled office map and bootstrap memory do not get through a step yet:
+some tiles have an arena but no sector (or an object but no arena), which
+perceive() cannot store, and the spatial memory names arenas that are not on
+the map. The benchmark therefore runs on a consistent copy of both, written
+to a temporary folder: every tile's arena is moved into the arena's sector,
+tiles of a sector that have no arena get one named after the sector, objects
+outside any sector are dropped, and the persona's spatial memory and living
+area are taken from that map.
+
+Usage (from the repository root, with the stand-in server running):
+  OPENROUTER_BASE_URL=http://127.0.0.1:8001/v1 \
+  OPENAI_BASE_URL=http://127.0.0.1:8001/v1 \
+  python -m backend.benchmark_steps --steps 50
+"""
+
+import argparse
+import csv
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import urllib.request
+
+from backend.global_methods import read_file_to_list
+from backend.maze import Maze
+from backend.persona.persona import Persona
+from backend.persona.prompt_template.prompt_dag import prompt_dag_stats
+from backend.simulation_manager import SimulationManager
+
+MAZE_DIR = "backend/office_map"
+PERSONA_NAME = "Michael Scott"
+PERSONA_DIR = f"backend/simulation/init/personas/{PERSONA_NAME}"
+LIVING_AREA_SECTOR = "Regional Manager Office"
+# Simulated time of the first step; each step advances it by --sec-per-step.
+START_TIME = datetime.datetime(2023, 2, 13, 9, 0)
+
+
+def fetch_stub_stats(base_url):
+    """Request counters of the stand-in server, or None if it is not reachable."""
+    try:
+        url = base_url.rstrip("/").rsplit("/v1", 1)[0] + "/stats"
+        with urllib.request.urlopen(url, timeout=2) as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def _write_rows(path, rows):
+    with open(path, "w", newline="") as f:
+        csv.writer(f).writerows(rows)
+
+
+def write_benchmark_maze(src_dir, dst_dir):
+    """
+    Copies the map in <src_dir> to <dst_dir> with a consistent tile hierarchy
+    (see the module docstring).
+    """
+    shutil.copytree(src_dir, dst_dir)
+    blocks = os.path.join(dst_dir, "special_blocks")
+    maze = os.path.join(dst_dir, "maze")
+
+    world = read_file_to_list(os.path.join(blocks, "world_blocks.csv"))[0][-1]
+    sector_rows = [row for row in read_file_to_list(os.path.join(blocks, "sector_blocks.csv")) if row]
+    arena_rows = [row for row in read_file_to_list(os.path.join(blocks, "arena_blocks.csv")) if row]
+    object_ids = {row[0] for row in read_file_to_list(os.path.join(blocks, "game_object_blocks.csv")) if row}
+    sector_ids = {row[-1]: row[0] for row in sector_rows}
+    arena_sectors = {row[0]: sector_ids[row[-2]] for row in arena_rows if row[-2] in sector_ids}
+
+    # One new arena per sector, for the sector's tiles that have none.
+    next_id = max(int(row[0]) for row in sector_rows + arena_rows) + 1
+    sector_arenas = dict()
+    for name, sector_id in sector_ids.items():
+        sector_arenas[sector_id] = str(next_id)
+        arena_rows += [[str(next_id), world, name, name]]
+        next_id += 1
+
+    sectors = read_file_to_list(os.path.join(maze, "sector_maze.csv"))
+    arenas = read_file_to_list(os.path.join(maze, "arena_maze.csv"))
+    objects = read_file_to_list(os.path.join(maze, "game_object_maze.csv"))
+    for y, row in enumerate(sectors):
+        for x in range(len(row)):
+            arena = arenas[y][x] if arenas[y][x] in arena_sectors else "0"
+            sector = arena_sectors.get(arena, sectors[y][x])
+            if sector not in sector_arenas:
+                sector, arena = "0", "0"
+            elif arena == "0":
+                arena = sector_arenas[sector]
+            sectors[y][x], arenas[y][x] = sector, arena
+            if sector == "0" or objects[y][x] not in object_ids:
+                objects[y][x] = "0"
+
+    _write_rows(os.path.join(blocks, "arena_blocks.csv"), arena_rows)
+    _write_rows(os.path.join(maze, "sector_maze.csv"), sectors)
+    _write_rows(os.path.join(maze, "arena_maze.csv"), arenas)
+    _write_rows(os.path.join(maze, "game_object_maze.csv"), objects)
+
+
+def spatial_tree(maze):
+    """The spatial memory tree (world > sector > arena > objects) of <maze>."""
+    tree = dict()
+    for row in maze.tiles:
+        for tile in row:
+            if not tile["arena"]:
+                continue
+            arena = (
+                tree.setdefault(tile["world"], dict())
+                .setdefault(tile["sector"], dict())
+                .setdefault(tile["arena"], [])
+            )
+            if tile["game_object"] and tile["game_object"] not in arena:
+                arena += [tile["game_object"]]
+    return tree
+
+
+def write_benchmark_persona(src_dir, dst_dir, maze):
+    """
+    Copies the persona in <src_dir> to <dst_dir>, with a spatial memory of
+    <maze> and a living area on it. Returns the living area.
+    """
+    shutil.copytree(src_dir, dst_dir)
+    memory = os.path.join(dst_dir, "bootstrap_memory")
+    tree = spatial_tree(maze)
+    with open(os.path.join(memory, "spatial_memory.json"), "w") as f:
+        json.dump(tree, f, indent=2)
+
+    world = next(iter(tree))
+    sector = LIVING_AREA_SECTOR if LIVING_AREA_SECTOR in tree[world] else next(iter(tree[world]))
+    living_area = f"{world}:{sector}:{next(iter(tree[world][sector]))}"
+    with open(os.path.join(memory, "scratch.json"), "r") as f:
+        scratch = json.load(f)
+    scratch["living_area"] = living_area
+    with open(os.path.join(memory, "scratch.json"), "w") as f:
+        json.dump(scratch, f, indent=2)
+    return living_area
+
+
+def start_tile(maze, living_area):
+    """A walkable tile of <living_area>."""
+    tiles = sorted(maze.address_tiles[living_area])
+    walkable = [tile for tile in tiles if not maze.access_tile(tile)["collision"]]
+    return list((walkable or tiles)[0])
+
+
+def run_benchmark(n_steps, tile=None, work_dir=None, sec_per_step=10):
+    """
+    Runs <n_steps> steps on the benchmark copy of the map and persona,
+    written to <work_dir>, starting at <tile> (by default a walkable tile of
+    the persona's living area). Simulated time starts at START_TIME and
+    advances <sec_per_step> seconds per step.
+    """
+    sim_manager = SimulationManager()
+    write_benchmark_maze(MAZE_DIR, os.path.join(work_dir, "office_map"))
+    sim_manager.maze = Maze(os.path.join(work_dir, "office_map"))
+    persona_dir = os.path.join(work_dir, PERSONA_NAME)
+    living_area = write_benchmark_persona(PERSONA_DIR, persona_dir, sim_manager.maze)
+    sim_manager.persona = Persona(PERSONA_NAME, persona_dir)
+
+    tile = list(tile or start_tile(sim_manager.maze, living_area))
+    sim_manager.persona_state["position"] = tile
+    step_times = []
+    n_failed = 0
+
+    start = time.perf_counter()
+    for step in range(n_steps):
+        step_start = time.perf_counter()
+        decision = sim_manager.process_agent_decision(
+            {PERSONA_NAME: {"x": tile[0], "y": tile[1]}},
+            START_TIME + datetime.timedelta(seconds=step * sec_per_step),
+        )
+        step_times += [time.perf_counter() - step_start]
+        # process_agent_decision swallows errors and reports them in the
+        # description; count those steps separately.
+        if "(error:" in decision["description"]:
+            n_failed += 1
+        tile = decision["movement"]
+    total = time.perf_counter() - start
+
+    step_times = sorted(step_times)
+    return {
+        "steps": n_steps,
+        "failed_steps": n_failed,
+        "total_sec": round(total, 3),
+        "steps_per_sec": round(n_steps / total, 3) if total else None,
+        "step_sec_p50": round(step_times[len(step_times) // 2], 3),
+        "step_sec_max": round(step_times[-1], 3),
+        # Wall, summed and critical-path prompt time of the prompt DAGs.
+        "prompt_dag": {
+            name: {key: value for key, value in entry.items() if key != "last"}
+            for name, entry in prompt_dag_stats.stats().items()
+        },
+    }
+
+
+if __name__ == "__main__":
+    from backend.utils import openrouter_base_url
+
+    parser = argparse.ArgumentParser(description="Measure simulation steps/sec.")
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument(
+        "--tile", default=None, help="Start tile as x,y (default: in the living area)"
+    )
+    parser.add_argument(
+        "--sec-per-step",
+        type=int,
+        default=10,
+        help="Simulated seconds per step",
+    )
+    parser.add_argument(
+        "--max-failed",
+        type=int,
+        default=0,
+        help="Exit with an error if more steps than this fail",
+    )
+    args = parser.parse_args()
+
+    tile = [int(i) for i in args.tile.split(",")] if args.tile else None
+    before = fetch_stub_stats(openrouter_base_url)
+    with tempfile.TemporaryDirectory() as work_dir:
+        result = run_benchmark(args.steps, tile, work_dir, args.sec_per_step)
+    after = fetch_stub_stats(openrouter_base_url)
+    if before is not None and after is not None:
+        result["llm_requests"] = {
+            key: count - before["requests"].get(key, 0)
+            for key, count in after["requests"].items()
+            if count - before["requests"].get(key, 0)
+        }
+    print(json.dumps(result, indent=2))
+    if result["failed_steps"] > args.max_failed:
+        sys.exit(
+            f"{result['failed_steps']} of {result['steps']} steps failed "
+            f"(--max-failed {args.max_failed}); steps/sec is not meaningful."
+        )
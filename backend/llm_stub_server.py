@@ -0,0 +1,490 @@
+"""
+File: llm_stub_server.py
+Description: Local OpenAI-compatible stand-in for OpenRouter and OpenAI, for
+load-testing the cognitive loop without a network. It serves
+/v1/chat/completions, /v1/completions and /v1/embeddings with configurable
+latency distributions and error rates. Prompts are matched back to the prompt
+template that rendered them and answered with a deterministic canned response
+that passes that template's validator.
+
+Usage (from the repository root):
+  python -m backend.llm_stub_server --port 8001 [--config stub.json]
+and then run the backend with
+  OPENROUTER_BASE_URL=http://127.0.0.1:8001/v1
+  OPENAI_BASE_URL=http://127.0.0.1:8001/v1
+
+Config file (all keys optional):
+  {
+    "seed": 0,
+    "latency": {
+      "default": {"dist": "lognormal", "median": 0.6, "sigma": 0.5},
+      "embeddings": {"dist": "uniform", "low": 0.05, "high": 0.15},
+      "v2/task_decomp_v3.txt": {"dist": "fixed", "value": 2.0}
+    },
+    "error_rate": {"429": 0.02, "500": 0.01},
+    "responses": {"v3_ChatGPT/poignancy_event_v1.txt": "7"}
+  }
+Latency and response keys are template paths relative to
+persona/prompt_template/, "default", or "embeddings".
+"""
+
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import time
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+PROMPT_TEMPLATE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "persona", "prompt_template"
+)
+EMBEDDING_DIM = 1536
+COMMENT_BLOCK_MARKER = "<commentblockmarker>###</commentblockmarker>"
+
+
+# ============================================================================
+# Template matching
+# ============================================================================
+
+
+def load_template_signatures(template_dir=PROMPT_TEMPLATE_DIR):
+    """
+    Returns [(template path relative to <template_dir>, [literal segments])].
+    The literal segments are the parts of a template between its !<INPUT n>!
+    slots; every one of them appears verbatim in a prompt rendered from it.
+    """
+    signatures = []
+    for path in sorted(glob.glob(os.path.join(template_dir, "**", "*.txt"), recursive=True)):
+        with open(path, "r") as f:
+            text = f.read()
+        if COMMENT_BLOCK_MARKER in text:
+            text = text.split(COMMENT_BLOCK_MARKER)[1]
+        segments = [i.strip() for i in re.split(r"!<INPUT \d+>!", text)]
+        segments = [i for i in segments if len(i) >= 8]
+        if segments:
+            rel_path = os.path.relpath(path, template_dir).replace(os.sep, "/")
+            signatures += [(rel_path, segments)]
+    return signatures
+
+
+def match_template(prompt, signatures, prefer=()):
+    """
+    Returns the template whose literal segments all occur in <prompt>,
+    preferring the one that explains the most prompt text, and on a tie (the
+    v2 and v3_ChatGPT copies of a template are often identical) one listed in
+    <prefer>. None if no template matches.
+    """
+    best, best_score = None, (0, False)
+    for rel_path, segments in signatures:
+        if all(segment in prompt for segment in segments):
+            score = (sum(len(segment) for segment in segments), rel_path in prefer)
+            if score > best_score:
+                best, best_score = rel_path, score
+    return best
+
+
+# ============================================================================
+# Canned responses
+# ============================================================================
+# Each generator takes the rendered prompt and a Random seeded from it, and
+# returns text that passes the validator of the matching run_gpt_prompt_*
+# function. Chat prompts wrapped by ChatGPT_safe_generate_response get the
+# value wrapped in {"output": ...} automatically.
+
+
+def _last_braced_options(prompt, marker):
+    """The comma-separated options inside the last "<marker>{...}" of the prompt."""
+    start = prompt.rfind(marker)
+    if start < 0:
+        return []
+    body = prompt[start + len(marker) :].split("}")[0]
+    return [i.strip() for i in body.split(",") if i.strip()]
+
+
+def _pick(options, rng, fallback):
+    return rng.choice(options) if options else fallback
+
+
+def _sector(prompt, rng):
+    options = _last_braced_options(prompt, "Area options: {")
+    current = re.findall(r"is currently in \{([^}]*)\}", prompt)
+    if current and current[-1] in options:
+        return f"{current[-1]}}}"
+    return f"{_pick(options, rng, 'kitchen')}}}"
+
+
+def _arena(prompt, rng):
+    options = _last_braced_options(prompt, "(MUST pick one of {")
+    return f"{_pick(options, rng, 'kitchen')}}}"
+
+
+def _game_object(prompt, rng):
+    options = _last_braced_options(prompt, "Objects available: {")
+    return _pick(options, rng, "desk")
+
+
+def _hourly_activity(prompt, rng):
+    hours = re.findall(r"-- (\d\d):00 (AM|PM)\] Activity:", prompt)
+    hour = 9
+    if hours:
+        hh, ampm = hours[-1]
+        hour = int(hh) % 12 + (12 if ampm == "PM" else 0)
+    if hour < 7 or hour >= 22:
+        return "sleeping"
+    if hour < 9:
+        return "getting ready and commuting to the office"
+    if hour == 12:
+        return "having lunch"
+    if hour < 17:
+        return rng.choice(
+            ["working at his desk", "in a meeting with the staff", "making sales calls"]
+        )
+    return "relaxing at home"
+
+
+def _task_decomp(prompt, rng):
+    total = int(prompt.split("(total duration in minutes")[-1].split(")")[0].strip(" :"))
+    name = prompt.rstrip().rsplit("\n", 1)[-1].split(")")[-1].replace(" is", "").strip()
+    steps = ["getting set up", "working through the main task", "wrapping up"]
+    durations = [max(5, total // 4 // 5 * 5)] * 2
+    durations += [total - sum(durations)]
+    if durations[-1] <= 0:
+        steps, durations = steps[1:2], [total]
+    lines = []
+    left = total
+    for count, (step, duration) in enumerate(zip(steps, durations)):
+        left -= duration
+        line = f"{step} (duration in minutes: {duration}, minutes left: {left})"
+        if count:
+            line = f"{count + 1}) {name} is {line}"
+        lines += [line]
+    return " " + "\n".join(lines)
+
+
+def _new_decomp_schedule(prompt, rng):
+    end = prompt.split("it has to end by")[-1].split(")")[0].strip()
+    end = end.split(" ")[0]
+    activity = prompt.split("unexpectedly ended up")[-1].split(" for ")[0].strip()
+    original_plan = prompt.split("unexpectedly ended up")[0]
+    originals = re.findall(r"\d\d:\d\d ~ \d\d:\d\d -- (.*)", original_plan)
+    if originals:
+        activity = originals[-1].strip()
+    return f" {end} -- {activity}"
+
+
+def _poignancy(prompt, rng):
+    return str(rng.randint(1, 10))
+
+
+def _focal_points_json(prompt, rng):
+    return json.dumps(
+        [
+            "What is the most important task at the office today",
+            "How does the team feel about the manager",
+            "What should happen next",
+        ]
+    )
+
+
+def _iterative_convo(prompt, rng):
+    return json.dumps(
+        {
+            "utterance": rng.choice(
+                ["Hey, how is it going?", "That sounds great.", "Let's catch up later."]
+            ),
+            "Did the conversation end with this utterance?": rng.random() < 0.5,
+        }
+    )
+
+
+def _action_fused(prompt, rng):
+    """Picks a location from the "area: room [objects]; ..." listing."""
+    block = prompt.split("[objects in the room]\":")[-1].split("\n\n")[0]
+    locations = dict()
+    for line in block.strip().split("\n"):
+        sector, arenas = line.split(": ", 1)
+        locations[sector] = dict()
+        for arena in arenas.split("; "):
+            name, objects = arena.split(" [", 1)
+            objects = [i.strip() for i in objects.rstrip("]").split(",") if i.strip()]
+            locations[sector][name] = objects
+    current = re.findall(r"is currently in \{([^}]*)\}", prompt)
+    if current and current[-1] in locations:
+        sector = current[-1]
+    else:
+        sector = rng.choice(sorted(locations))
+    arena = rng.choice(sorted(locations[sector]))
+    return json.dumps(
+        {
+            "sector": sector,
+            "arena": arena,
+            "game_object": _pick(locations[sector][arena], rng, ""),
+            "pronunciatio": rng.choice(["💼", "📞", "☕", "📝", "💻"]),
+            "event": ["is", "working"],
+            "object_state": "being used",
+            "object_pronunciatio": "💻",
+            "object_event": ["is", "used"],
+        }
+    )
+
+
+CANNED_RESPONSES = {
+    "v2/wake_up_hour_v1.txt": "7am",
+    "v2/daily_planning_v6.txt": (
+        " arrive at the office at 9:00 am, 3) hold the morning meeting at 10:00 am,"
+        " 4) have lunch at 12:00 pm, 5) work at the desk from 1:00 pm to 5:00 pm,"
+        " 6) go home at 6:00 pm, 7) go to bed at 11:00 pm."
+    ),
+    "v2/generate_hourly_schedule_v2.txt": _hourly_activity,
+    "v2/task_decomp_v3.txt": _task_decomp,
+    "v1/action_location_sector_v1.txt": _sector,
+    "v1/action_location_object_vMar11.txt": _arena,
+    "v1/action_object_v2.txt": _game_object,
+    "v3_ChatGPT/action_fused_v1.txt": _action_fused,
+    "v3_ChatGPT/generate_pronunciatio_v1.txt": lambda prompt, rng: rng.choice(
+        ["💼", "📞", "☕", "📝", "💻"]
+    ),
+    "v2/generate_event_triple_v1.txt": " is, working)",
+    "v3_ChatGPT/generate_obj_event_v1.txt": "being used",
+    "v2/new_decomp_schedule_v1.txt": _new_decomp_schedule,
+    "v2/decide_to_talk_v2.txt": "no",
+    "v2/decide_to_react_v1.txt": "3",
+    "v2/create_conversation_v2.txt": ' "Hi there!"',
+    "v3_ChatGPT/agent_chat_v1.txt": lambda prompt, rng: [
+        ["Michael Scott", "Hey, how is it going?"],
+        ["Dwight Schrute", "Fine. Busy."],
+    ],
+    "v3_ChatGPT/summarize_conversation_v1.txt": "the work they have to finish today",
+    "v2/get_keywords_v1.txt": "office, work\nEmotive keywords: busy",
+    "v2/keyword_to_thoughts_v1.txt": "There is a lot of work to get done.",
+    "v2/convo_to_thoughts_v1.txt": "the conversation went well.",
+    "v3_ChatGPT/poignancy_event_v1.txt": _poignancy,
+    "v3_ChatGPT/poignancy_thought_v1.txt": _poignancy,
+    "v3_ChatGPT/poignancy_chat_v1.txt": _poignancy,
+    "v3_ChatGPT/generate_focal_pt_v1.txt": _focal_points_json,
+    "v2/generate_focal_pt_v1.txt": (
+        "What is the most important task at the office today\n"
+        "2) How does the team feel about the manager\n"
+        "3) What should happen next"
+    ),
+    "v2/insight_and_evidence_v1.txt": (
+        "The office relies on a steady routine (because of 0)\n"
+        "2. Work keeps everyone busy during the day (because of 0)"
+    ),
+    "v3_ChatGPT/summarize_chat_ideas_v1.txt": "They have been working together for years.",
+    "v3_ChatGPT/summarize_chat_relationship_v2.txt": "They are coworkers who get along.",
+    "v3_ChatGPT/summarize_ideas_v1.txt": "He has been busy with work today.",
+    "v2/generate_next_convo_line_v1.txt": "Sounds good to me.",
+    "v2/whisper_inner_thought_v1.txt": "I should keep that in mind.",
+    "v2/planning_thought_on_convo_v1.txt": "should follow up on the conversation later.",
+    "v3_ChatGPT/memo_on_convo_v1.txt": "The conversation was about work.",
+    "v2/memo_on_convo_v1.txt": "The conversation was about work.",
+    "safety/anthromorphosization_v1.txt": '{"output": "1"}',
+    "v3_ChatGPT/iterative_convo_v1.txt": _iterative_convo,
+}
+DEFAULT_RESPONSE = "ok"
+
+
+# ============================================================================
+# Server
+# ============================================================================
+
+
+class StubLLM:
+    """
+    State of the stand-in server: template signatures, canned responses,
+    latency and error settings, and request counters.
+    """
+
+    def __init__(self, config=None):
+        config = config or {}
+        self.rng = random.Random(config.get("seed", 0))
+        self.latency = {"default": {"dist": "fixed", "value": 0.0}}
+        self.latency.update(config.get("latency", {}))
+        self.error_rate = {
+            int(status): rate for status, rate in config.get("error_rate", {}).items()
+        }
+        self.responses = dict(CANNED_RESPONSES)
+        self.responses.update(config.get("responses", {}))
+        self.signatures = load_template_signatures()
+
+        self.counts = dict()
+        self.errors = dict()
+
+    def sample_latency(self, key):
+        spec = self.latency.get(key, self.latency["default"])
+        dist = spec.get("dist", "fixed")
+        if dist == "fixed":
+            return spec.get("value", 0.0)
+        if dist == "uniform":
+            return self.rng.uniform(spec["low"], spec["high"])
+        if dist == "normal":
+            return max(0.0, self.rng.gauss(spec["mean"], spec["std"]))
+        if dist == "lognormal":
+            return self.rng.lognormvariate(math.log(spec["median"]), spec["sigma"])
+        raise ValueError(f"Unknown latency distribution: {dist}")
+
+    def sample_error(self):
+        """An HTTP status to fail with, or None to answer normally."""
+        roll = self.rng.random()
+        for status, rate in self.error_rate.items():
+            if roll < rate:
+                return status
+            roll -= rate
+        return None
+
+    def respond(self, prompt):
+        """Returns (template, response text) for a rendered prompt."""
+        template = match_template(prompt, self.signatures, self.responses)
+        response = self.responses.get(template, DEFAULT_RESPONSE)
+        if callable(response):
+            seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16], 16)
+            response = response(prompt, random.Random(seed))
+        # Prompts wrapped by ChatGPT_safe_generate_response ask for
+        # {"output": ...} JSON.
+        if "Example output json:" in prompt:
+            response = json.dumps({"output": response}, ensure_ascii=False)
+        return template, response
+
+    def count(self, key):
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def stats(self):
+        return {"requests": dict(self.counts), "errors": dict(self.errors)}
+
+
+def embed_text(text, dim=EMBEDDING_DIM):
+    """Deterministic unit-length pseudo-embedding of <text>."""
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    vector = [rng.gauss(0, 1) for _ in range(dim)]
+    norm = math.sqrt(sum(i * i for i in vector))
+    return [i / norm for i in vector]
+
+
+def apply_stop(text, stop):
+    if not stop:
+        return text
+    if isinstance(stop, str):
+        stop = [stop]
+    for i in stop:
+        if i and i in text:
+            text = text[: text.index(i)]
+    return text
+
+
+def create_app(config=None):
+    stub = StubLLM(config)
+    app = FastAPI()
+    app.state.stub = stub
+
+    def usage(prompt_tokens, completion_tokens=0):
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    async def simulate(key):
+        """Sleeps for the sampled latency; returns an error response or None."""
+        stub.count(key)
+        await asyncio.sleep(stub.sample_latency(key))
+        status = stub.sample_error()
+        if status is None:
+            return None
+        stub.errors[str(status)] = stub.errors.get(str(status), 0) + 1
+        headers = {"retry-after": "1"} if status == 429 else {}
+        return JSONResponse(
+            {"error": {"message": f"stub error {status}", "code": status}},
+            status_code=status,
+            headers=headers,
+        )
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(body: dict):
+        prompt = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+        template, text = stub.respond(prompt)
+        error = await simulate(template or "default")
+        if error:
+            return error
+        return {
+            "id": f"chatcmpl-stub-{int(time.time() * 1000)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": usage(len(prompt) // 4, len(text) // 4),
+        }
+
+    @app.post("/v1/completions")
+    async def completions(body: dict):
+        prompt = body.get("prompt", "")
+        if isinstance(prompt, list):
+            prompt = prompt[0] if prompt else ""
+        template, text = stub.respond(prompt)
+        text = apply_stop(text, body.get("stop"))
+        error = await simulate(template or "default")
+        if error:
+            return error
+        return {
+            "id": f"cmpl-stub-{int(time.time() * 1000)}",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [
+                {"index": 0, "text": text, "logprobs": None, "finish_reason": "stop"}
+            ],
+            "usage": usage(len(prompt) // 4, len(text) // 4),
+        }
+
+    @app.post("/v1/embeddings")
+    async def embeddings(body: dict):
+        texts = body.get("input", [])
+        if isinstance(texts, str):
+            texts = [texts]
+        error = await simulate("embeddings")
+        if error:
+            return error
+        return {
+            "object": "list",
+            "model": body.get("model", "stub"),
+            "data": [
+                {"object": "embedding", "index": count, "embedding": embed_text(text)}
+                for count, text in enumerate(texts)
+            ],
+            "usage": usage(sum(len(i) for i in texts) // 4),
+        }
+
+    @app.get("/stats")
+    def stats():
+        return stub.stats()
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--config", help="JSON file with latency/error/response settings")
+    args = parser.parse_args()
+
+    config = None
+    if args.config:
+        with open(args.config, "r") as f:
+            config = json.load(f)
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
@@ -19,6 +19,7 @@ from backend.persona.memory_structures.associative_memory import *
 from backend.persona.memory_structures.scratch import *
 from backend.persona.cognitive_modules.retrieve import *
 from backend.persona.prompt_template.run_gpt_prompt import *
+from backend.persona.cognitive_modules.poignancy_scorer import *
 
 
 def generate_agent_chat_summarize_ideas(
@@ -113,7 +114,9 @@ def agent_chat_v1(maze, init_persona, target_persona):
     )
 
 
-def generate_one_utterance(maze, init_persona, target_persona, retrieved, curr_chat):
+def generate_one_utterance(
+    maze, init_persona, target_persona, retrieved, curr_chat, scores=None
+):
     # Chat version optimized for speed via batch generation
     curr_context = (
         f"{init_persona.scratch.name} "
@@ -130,7 +133,13 @@ def generate_one_utterance(maze, init_persona, target_persona, retrieved, curr_c
 
     print("July 23 5")
     x = run_gpt_generate_iterative_chat_utt(
-        maze, init_persona, target_persona, retrieved, curr_context, curr_chat
+        maze,
+        init_persona,
+        target_persona,
+        retrieved,
+        curr_context,
+        curr_chat,
+        scores=scores,
     )[0]
 
     print("July 23 6")
@@ -165,9 +174,10 @@ def agent_chat_v2(maze, init_persona, target_persona):
                 f"{relationship}",
                 f"{target_persona.scratch.name} is {target_persona.scratch.act_description}",
             ]
-        retrieved = new_retrieve(init_persona, focal_points, 15)
+        scores = dict()
+        retrieved = new_retrieve(init_persona, focal_points, 15, scores=scores)
         utt, end = generate_one_utterance(
-            maze, init_persona, target_persona, retrieved, curr_chat
+            maze, init_persona, target_persona, retrieved, curr_chat, scores
         )
 
         curr_chat += [[init_persona.scratch.name, utt]]
@@ -194,9 +204,10 @@ def agent_chat_v2(maze, init_persona, target_persona):
                 f"{relationship}",
                 f"{init_persona.scratch.name} is {init_persona.scratch.act_description}",
             ]
-        retrieved = new_retrieve(target_persona, focal_points, 15)
+        scores = dict()
+        retrieved = new_retrieve(target_persona, focal_points, 15, scores=scores)
         utt, end = generate_one_utterance(
-            maze, target_persona, init_persona, retrieved, curr_chat
+            maze, target_persona, init_persona, retrieved, curr_chat, scores
         )
 
         curr_chat += [[target_persona.scratch.name, utt]]
@@ -252,19 +263,11 @@ def generate_action_event_triple(act_desp, persona):
     return run_gpt_prompt_event_triple(act_desp, persona)[0]
 
 
-def generate_poig_score(persona, event_type, description):
+def generate_poig_score(persona, event_type, description, embedding=None):
     if debug:
         print("GNS FUNCTION: <generate_poig_score>")
 
-    if "is idle" in description:
-        return 1
-
-    if event_type == "event" or event_type == "thought":
-        return run_gpt_prompt_event_poignancy(persona, description)[0]
-    elif event_type == "chat":
-        return run_gpt_prompt_chat_poignancy(persona, persona.scratch.act_description)[
-            0
-        ]
+    return score_poignancy(persona, event_type, description, embedding)
 
 
 def load_history_via_whisper(personas, whispers):
@@ -279,7 +282,10 @@ def load_history_via_whisper(personas, whispers):
         s, p, o = generate_action_event_triple(thought, persona)
         keywords = set([s, p, o])
         thought_poignancy = generate_poig_score(persona, "event", whisper)
-        thought_embedding_pair = (thought, get_embedding(thought))
+        thought_embedding_pair = (
+            thought,
+            get_embedding(thought, known=persona.a_mem.embeddings),
+        )
         persona.a_mem.add_thought(
             created,
             expiration,
@@ -328,7 +334,10 @@ def open_convo_session(persona, convo_mode):
         s, p, o = generate_action_event_triple(thought, persona)
         keywords = set([s, p, o])
         thought_poignancy = generate_poig_score(persona, "event", whisper)
-        thought_embedding_pair = (thought, get_embedding(thought))
+        thought_embedding_pair = (
+            thought,
+            get_embedding(thought, known=persona.a_mem.embeddings),
+        )
         persona.a_mem.add_thought(
             created,
             expiration,
@@ -11,16 +11,19 @@ from operator import itemgetter
 from backend.global_methods import *
 from backend.persona.prompt_template.gpt_structure import *
 from backend.persona.prompt_template.run_gpt_prompt import *
+from backend.persona.cognitive_modules.poignancy_scorer import *
 
-def generate_poig_score(persona, event_type, description): 
-  if "is idle" in description: 
-    return 1
+def generate_poig_score(persona, event_type, description, embedding=None): 
+  return score_poignancy(persona, event_type, description, embedding)
 
-  if event_type == "event": 
-    return run_gpt_prompt_event_poignancy(persona, description)[0]
-  elif event_type == "chat": 
-    return run_gpt_prompt_chat_poignancy(persona, 
-                           persona.scratch.act_description)[0]
+def get_event_embedding_input(desc): 
+  """
+  The text we embed for an event description: the part in parentheses if 
+  there is one, otherwise the whole description. 
+  """
+  if "(" in desc: 
+    return desc.split("(")[1].split(")")[0].strip()
+  return desc
 
 def perceive(persona, maze): 
   """
@@ -102,10 +105,8 @@ def perceive(persona, maze):
   for dist, event in percept_events_list[:persona.scratch.att_bandwidth]: 
     perceived_events += [event]
 
-  # Storing events. 
-  # <ret_events> is a list of <ConceptNode> instances from the persona's 
-  # associative memory. 
-  ret_events = []
+  # Normalizing events. 
+  normalized_events = []
   for p_event in perceived_events: 
     s, p, o, desc = p_event
     if not p: 
@@ -114,12 +115,30 @@ def perceive(persona, maze):
       o = "idle"
       desc = "idle"
     desc = f"{s.split(':')[-1]} is {desc}"
+    normalized_events += [(s, p, o, desc)]
+
+  # We embed every event that looks new in one batched request instead of
+  # one request per event. Descriptions already in the a_mem are not sent. 
+  latest_events = persona.a_mem.latest_event_summaries(
+                                  persona.scratch.retention)
+  new_descs = [get_event_embedding_input(desc) 
+               for s, p, o, desc in normalized_events 
+               if (s, p, o) not in latest_events]
+  prefetched_embeddings = dict(zip(new_descs, 
+                                   get_embeddings(new_descs, 
+                                     known=persona.a_mem.embeddings)))
+
+  # Storing events. 
+  # <ret_events> is a list of <ConceptNode> instances from the persona's 
+  # associative memory. 
+  ret_events = []
+  for s, p, o, desc in normalized_events: 
     p_event = (s, p, o)
 
     # We retrieve the latest persona.scratch.retention events. If there is  
     # something new that is happening (that is, p_event not in latest_events),
     # then we add that event to the a_mem and return it. 
-    latest_events = persona.a_mem.get_summarized_latest_events(
+    latest_events = persona.a_mem.latest_event_summaries(
                                     persona.scratch.retention)
     if p_event not in latest_events:
       # We start by managing keywords. 
@@ -133,13 +152,11 @@ def perceive(persona, maze):
       keywords.update([sub, obj])
 
       # Get event embedding
-      desc_embedding_in = desc
-      if "(" in desc: 
-        desc_embedding_in = (desc_embedding_in.split("(")[1]
-                                              .split(")")[0]
-                                              .strip())
+      desc_embedding_in = get_event_embedding_input(desc)
       if desc_embedding_in in persona.a_mem.embeddings: 
         event_embedding = persona.a_mem.embeddings[desc_embedding_in]
+      elif desc_embedding_in in prefetched_embeddings: 
+        event_embedding = prefetched_embeddings[desc_embedding_in]
       else: 
         event_embedding = get_embedding(desc_embedding_in)
       event_embedding_pair = (desc_embedding_in, event_embedding)
@@ -147,7 +164,8 @@ def perceive(persona, maze):
       # Get event poignancy. 
       event_poignancy = generate_poig_score(persona, 
                                             "event", 
-                                            desc_embedding_in)
+                                            desc_embedding_in, 
+                                            event_embedding)
 
       # If we observe the persona's self chat, we include that in the memory
       # of the persona here. 
@@ -163,7 +181,8 @@ def perceive(persona, maze):
         chat_embedding_pair = (persona.scratch.act_description, 
                                chat_embedding)
         chat_poignancy = generate_poig_score(persona, "chat", 
-                                             persona.scratch.act_description)
+                                             persona.scratch.act_description, 
+                                             chat_embedding)
         chat_node = persona.a_mem.add_chat(persona.scratch.curr_time, None,
                       curr_event[0], curr_event[1], curr_event[2], 
                       persona.scratch.act_description, keywords, 
@@ -13,6 +13,9 @@ sys.path.append('../../')
 
 from backend.global_methods import *
 from backend.persona.prompt_template.run_gpt_prompt import *
+from backend.persona.prompt_template.prompt_dag import *
+from backend.persona.prompt_template.context_builder import *
+from backend.persona.cognitive_modules.semantic_memo import *
 from backend.persona.cognitive_modules.retrieve import *
 from backend.persona.cognitive_modules.converse import *
 
@@ -223,6 +226,22 @@ def generate_action_game_object(act_desp, act_address, persona, maze):
   return run_gpt_prompt_action_game_object(act_desp, persona, maze, act_address)[0]
 
 
+def _memo_world(persona): 
+  """The world whose semantic memo the persona's actions are looked up in."""
+  return (persona.scratch.living_area or "").split(":")[0]
+
+
+def _memo_text(act_desp): 
+  """The part of an action description its emoji/triple prompts look at."""
+  if "(" in act_desp: 
+    act_desp = act_desp.split("(")[-1].split(")")[0]
+  return act_desp
+
+
+def _memo_embed(persona): 
+  return lambda text: get_embedding(text, known=persona.a_mem.embeddings)
+
+
 def generate_action_pronunciatio(act_desp, persona): 
   """TODO 
   Given an action description, creates an emoji string description via a few
@@ -240,7 +259,11 @@ def generate_action_pronunciatio(act_desp, persona):
   """
   if debug: print ("GNS FUNCTION: <generate_action_pronunciatio>")
   try: 
-    x = run_gpt_prompt_pronunciatio(act_desp, persona)[0]
+    # The prompt's fail-safe is returned but not worth remembering. 
+    x = semantic_memo.get_or_compute(
+      _memo_world(persona), "pronunciatio", _memo_text(act_desp), 
+      lambda: run_gpt_prompt_pronunciatio(act_desp, persona)[0], 
+      _memo_embed(persona), should_store=lambda x: x != "😋")
   except: 
     x = "🙂"
 
@@ -261,7 +284,14 @@ def generate_action_event_triple(act_desp, persona):
     "🧈🍞"
   """
   if debug: print ("GNS FUNCTION: <generate_action_event_triple>")
-  return run_gpt_prompt_event_triple(act_desp, persona)[0]
+  # The fail-safe comes back as (name, name, "is") and is not remembered. 
+  # A remembered triple may come from another persona, so its subject is 
+  # replaced with this one. 
+  output = semantic_memo.get_or_compute(
+    _memo_world(persona), "event", _memo_text(act_desp), 
+    lambda: run_gpt_prompt_event_triple(act_desp, persona)[0], 
+    _memo_embed(persona), should_store=lambda x: x[1] != persona.name)
+  return (persona.name, output[1], output[2])
 
 
 def generate_act_obj_desc(act_game_object, act_desp, persona): 
@@ -271,7 +301,32 @@ def generate_act_obj_desc(act_game_object, act_desp, persona):
 
 def generate_act_obj_event_triple(act_game_object, act_obj_desc, persona): 
   if debug: print ("GNS FUNCTION: <generate_act_obj_event_triple>")
-  return run_gpt_prompt_act_obj_event_triple(act_game_object, act_obj_desc, persona)[0]
+  # The fail-safe comes back as (object, object, "is") and is not 
+  # remembered. A remembered triple may be about another object, so its 
+  # subject is replaced with this one. 
+  output = semantic_memo.get_or_compute(
+    _memo_world(persona), "object_event", _memo_text(act_obj_desc), 
+    lambda: run_gpt_prompt_act_obj_event_triple(act_game_object, act_obj_desc, 
+                                                persona)[0], 
+    _memo_embed(persona), should_store=lambda x: x[1] != act_game_object)
+  return (act_game_object, output[1], output[2])
+
+
+def generate_action_fused(act_desp, persona, maze): 
+  """
+  Resolves every field of a new action (location, emoji, event triple and 
+  object state) with a single prompt. 
+
+  INPUT: 
+    act_desp: the description of the action (e.g., "sleeping")
+    persona: The Persona class instance 
+    maze: Current <Maze> instance. 
+  OUTPUT: 
+    a dictionary of the validated fields; fields that failed validation are
+    None. 
+  """
+  if debug: print ("GNS FUNCTION: <generate_action_fused>")
+  return run_gpt_prompt_action_fused(act_desp, persona, maze)[0]
 
 
 def generate_convo(maze, init_persona, target_persona): 
@@ -410,12 +465,19 @@ def revise_identity(persona):
 
   focal_points = [f"{p_name}'s plan for {persona.scratch.get_str_curr_date_str()}.",
                   f"Important recent events for {p_name}'s life."]
-  retrieved = new_retrieve(persona, focal_points)
+  scores = dict()
+  retrieved = new_retrieve(persona, focal_points, scores=scores)
 
-  statements = "[Statements]\n"
+  lines = []
+  line_scores = []
   for key, val in retrieved.items():
     for i in val: 
-      statements += f"{i.created.strftime('%A %B %d -- %H:%M %p')}: {i.embedding_key}\n"
+      lines += [f"{i.created.strftime('%A %B %d -- %H:%M %p')}: {i.embedding_key}\n"]
+      line_scores += [scores[key][i.node_id]]
+  # Only the highest scoring statements that fit the prompt's token budget 
+  # are kept. 
+  kept = prompt_context.select("revise_identity", lines, line_scores)
+  statements = "[Statements]\n" + "".join(lines[i] for i in kept)
 
   # print (";adjhfno;asdjao;idfjo;af", p_name)
   plan_prompt = statements + "\n"
@@ -423,13 +485,17 @@ def revise_identity(persona):
   plan_prompt += f" *{persona.scratch.curr_time.strftime('%A %B %d')}*? "
   plan_prompt += f"If there is any scheduling information, be as specific as possible (include date, time, and location if stated in the statement)\n\n"
   plan_prompt += f"Write the response from {p_name}'s perspective."
-  plan_note = ChatGPT_single_request(plan_prompt)
-  # print (plan_note)
 
   thought_prompt = statements + "\n"
   thought_prompt += f"Given the statements above, how might we summarize {p_name}'s feelings about their days up to now?\n\n"
   thought_prompt += f"Write the response from {p_name}'s perspective."
-  thought_note = ChatGPT_single_request(thought_prompt)
+
+  # The plan and thought notes do not depend on each other, so we send both
+  # requests at once.
+  plan_note, thought_note = run_llm_concurrently(
+    ChatGPT_single_request_async(plan_prompt),
+    ChatGPT_single_request_async(thought_prompt))
+  # print (plan_note)
   # print (thought_note)
 
   currently_prompt = f"{p_name}'s status from {(persona.scratch.curr_time - datetime.timedelta(days=1)).strftime('%A %B %d')}:\n"
@@ -507,7 +573,8 @@ def _long_term_planning(persona, new_day):
   s, p, o = (persona.scratch.name, "plan", persona.scratch.curr_time.strftime('%A %B %d'))
   keywords = set(["plan"])
   thought_poignancy = 5
-  thought_embedding_pair = (thought, get_embedding(thought))
+  thought_embedding_pair = (thought, get_embedding(thought, 
+                              known=persona.a_mem.embeddings))
   persona.a_mem.add_thought(created, expiration, s, p, o, 
                             thought, keywords, thought_poignancy, 
                             thought_embedding_pair, None)
@@ -621,20 +688,50 @@ def _determine_action(persona, maze):
   # Finding the target location of the action and creating action-related
   # variables.
   act_world = maze.access_tile(persona.scratch.curr_tile)["world"]
+  # With fused action resolution, one prompt proposes every field below; 
+  # only the fields that fail validation go through their own prompt. 
+  fused = dict()
+  if fused_action_resolution: 
+    fused = generate_action_fused(act_desp, persona, maze)
+
+  # The remaining prompts form a small dependency graph: the location chain
+  # (sector -> arena -> game object -> object state) runs alongside the 
+  # prompts that only need <act_desp>. 
+  dag = PromptDAG("determine_action")
   # act_sector = maze.access_tile(persona.scratch.curr_tile)["sector"]
-  act_sector = generate_action_sector(act_desp, persona, maze)
-  act_arena = generate_action_arena(act_desp, persona, maze, act_world, act_sector)
-  act_address = f"{act_world}:{act_sector}:{act_arena}"
-  act_game_object = generate_action_game_object(act_desp, act_address,
-                                                persona, maze)
-  new_address = f"{act_world}:{act_sector}:{act_arena}:{act_game_object}"
-  act_pron = generate_action_pronunciatio(act_desp, persona)
-  act_event = generate_action_event_triple(act_desp, persona)
+  dag.add("sector", lambda: fused.get("sector") 
+          or generate_action_sector(act_desp, persona, maze))
+  dag.add("arena", lambda act_sector: fused.get("arena") 
+          or generate_action_arena(act_desp, persona, maze, act_world, act_sector),
+          deps=["sector"])
+  dag.add("game_object", lambda act_sector, act_arena: fused.get("game_object") 
+          or generate_action_game_object(
+               act_desp, f"{act_world}:{act_sector}:{act_arena}", persona, maze),
+          deps=["sector", "arena"])
+  dag.add("pronunciatio", lambda: fused.get("pronunciatio") 
+          or generate_action_pronunciatio(act_desp, persona))
+  dag.add("event", lambda: fused.get("event") 
+          or generate_action_event_triple(act_desp, persona))
   # Persona's actions also influence the object states. We set those up here. 
-  act_obj_desp = generate_act_obj_desc(act_game_object, act_desp, persona)
-  act_obj_pron = generate_action_pronunciatio(act_obj_desp, persona)
-  act_obj_event = generate_act_obj_event_triple(act_game_object, 
-                                                act_obj_desp, persona)
+  dag.add("act_obj_desc", lambda act_game_object: fused.get("act_obj_desc") 
+          or generate_act_obj_desc(act_game_object, act_desp, persona),
+          deps=["game_object"])
+  dag.add("act_obj_pronunciatio", lambda act_obj_desp: 
+          fused.get("act_obj_pronunciatio") 
+          or generate_action_pronunciatio(act_obj_desp, persona),
+          deps=["act_obj_desc"])
+  dag.add("act_obj_event", lambda act_game_object, act_obj_desp: 
+          fused.get("act_obj_event") 
+          or generate_act_obj_event_triple(act_game_object, act_obj_desp, persona),
+          deps=["game_object", "act_obj_desc"])
+  x = dag.run()
+
+  new_address = f"{act_world}:{x['sector']}:{x['arena']}:{x['game_object']}"
+  act_pron = x["pronunciatio"]
+  act_event = x["event"]
+  act_obj_desp = x["act_obj_desc"]
+  act_obj_pron = x["act_obj_pronunciatio"]
+  act_obj_event = x["act_obj_event"]
 
   # Adding the action to persona's queue. 
   persona.scratch.add_new_action(new_address, 
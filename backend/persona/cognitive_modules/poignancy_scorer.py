@@ -0,0 +1,191 @@
+"""
+File: poignancy_scorer.py
+Description: Local kNN poignancy scorer. New events, thoughts and chats are
+scored from the poignancy of their nearest neighbours (by embedding) in the
+persona's associative memory; only cases the neighbours do not agree on
+confidently go to the poignancy prompt. A sample of the confident cases is
+also sent to the prompt to measure how often the local score agrees.
+"""
+
+import random
+import threading
+
+import numpy as np
+
+from backend.utils import *
+from backend.persona.prompt_template.run_gpt_prompt import *
+
+
+def is_poignancy(score):
+    """Whether <score> is a poignancy the prompt can give (an int in 1..10)."""
+    return isinstance(score, int) and not isinstance(score, bool) and 1 <= score <= 10
+
+
+class LocalPoignancyScorer:
+    """
+    kNN regression over labelled (embedding, poignancy) samples of one
+    persona, kept separately for events/thoughts (scored by the same prompt)
+    and chats. A prediction is confident when the <k> nearest samples have a
+    mean cosine similarity of at least <min_similarity> and their scores lie
+    within <max_spread> of each other.
+    """
+
+    def __init__(
+        self,
+        a_mem,
+        k=poignancy_local_k,
+        min_similarity=poignancy_local_min_similarity,
+        max_spread=poignancy_local_max_spread,
+        audit_rate=poignancy_local_audit_rate,
+    ):
+        self.a_mem = a_mem
+        self.k = k
+        self.min_similarity = min_similarity
+        self.max_spread = max_spread
+        self.audit_rate = audit_rate
+
+        self._lock = threading.Lock()
+        self._vectors = {"event": [], "chat": []}
+        self._scores = {"event": [], "chat": []}
+        self._matrix = dict()
+
+        self.local = 0
+        self.llm = 0
+        self.audited = 0
+        self.agreed = 0
+        self.abs_error = 0
+
+        # Seed with the memories the persona already has.
+        for node in a_mem.id_to_node.values():
+            kind = "chat" if node.type == "chat" else "event"
+            if "is idle" in node.description:
+                continue
+            embedding = a_mem.embeddings.get(node.embedding_key)
+            if embedding is not None:
+                self.add(kind, embedding, node.poignancy)
+
+    def add(self, kind, embedding, score):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if not norm:
+            return
+        with self._lock:
+            self._vectors[kind] += [vector / norm]
+            self._scores[kind] += [int(score)]
+            self._matrix.pop(kind, None)
+
+    def predict(self, kind, embedding):
+        """
+        RETURNS:
+          (score, confident). score is None when there are fewer than <k>
+          samples to compare against.
+        """
+        with self._lock:
+            if len(self._scores[kind]) < self.k:
+                return None, False
+            if kind not in self._matrix:
+                self._matrix[kind] = (
+                    np.vstack(self._vectors[kind]),
+                    np.asarray(self._scores[kind]),
+                )
+            matrix, scores = self._matrix[kind]
+
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if not norm:
+            return None, False
+        similarities = matrix @ (query / norm)
+        nearest = np.argpartition(-similarities, self.k - 1)[: self.k]
+        weights = np.clip(similarities[nearest], 1e-6, None)
+        score = int(round(float(np.average(scores[nearest], weights=weights))))
+        confident = (
+            similarities[nearest].mean() >= self.min_similarity
+            and np.ptp(scores[nearest]) <= self.max_spread
+        )
+        return score, bool(confident)
+
+    def score(self, event_type, embedding, ask_llm):
+        """
+        Scores a new memory of <event_type> ("event", "thought" or "chat").
+        <ask_llm> is a zero-argument function that runs the poignancy prompt.
+        """
+        kind = "chat" if event_type == "chat" else "event"
+        if embedding is None:
+            return ask_llm()
+
+        local_score, confident = self.predict(kind, embedding)
+        if confident:
+            if random.random() >= self.audit_rate:
+                self.local += 1
+                return local_score
+            llm_score = ask_llm()
+            if is_poignancy(llm_score):
+                self.audited += 1
+                self.abs_error += abs(llm_score - local_score)
+                if abs(llm_score - local_score) <= 1:
+                    self.agreed += 1
+        else:
+            llm_score = ask_llm()
+        self.llm += 1
+        # Only prompt scores are added as samples, so the local scores of a
+        # run never feed back into the scorer. A prompt that failed (False or
+        # an out-of-range value) is not a sample either.
+        if is_poignancy(llm_score):
+            self.add(kind, embedding, llm_score)
+        return llm_score
+
+    def stats(self):
+        return {
+            "local": self.local,
+            "llm": self.llm,
+            "samples": {kind: len(scores) for kind, scores in self._scores.items()},
+            "audited": self.audited,
+            "agreement_rate": round(self.agreed / self.audited, 3) if self.audited else None,
+            "mean_abs_error": round(self.abs_error / self.audited, 3) if self.audited else None,
+        }
+
+
+class PoignancyScorerRegistry:
+    """One LocalPoignancyScorer per persona, rebuilt if its memory is replaced."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.scorers = dict()
+
+    def get(self, persona):
+        with self._lock:
+            scorer = self.scorers.get(persona.name)
+            if scorer is None or scorer.a_mem is not persona.a_mem:
+                scorer = self.scorers[persona.name] = LocalPoignancyScorer(persona.a_mem)
+            return scorer
+
+    def score(self, persona, event_type, embedding, ask_llm):
+        if not poignancy_local_scorer:
+            return ask_llm()
+        return self.get(persona).score(event_type, embedding, ask_llm)
+
+    def stats(self):
+        with self._lock:
+            return {name: scorer.stats() for name, scorer in self.scorers.items()}
+
+
+poignancy_scorers = PoignancyScorerRegistry()
+
+
+def score_poignancy(persona, event_type, description, embedding=None):
+    """
+    The poignancy of a new memory of <event_type> ("event", "thought" or
+    "chat") with <description>, from the local scorer when it is enabled and
+    confident (which needs the memory's <embedding>), otherwise from the
+    poignancy prompt. Idle events always score 1.
+    """
+    if "is idle" in description:
+        return 1
+
+    if event_type == "chat":
+        ask_llm = lambda: run_gpt_prompt_chat_poignancy(
+            persona, persona.scratch.act_description
+        )[0]
+    else:
+        ask_llm = lambda: run_gpt_prompt_event_poignancy(persona, description)[0]
+    return poignancy_scorers.score(persona, event_type, embedding, ask_llm)
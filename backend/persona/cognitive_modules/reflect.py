@@ -16,7 +16,9 @@ from numpy.linalg import norm
 from backend.global_methods import *
 from backend.persona.prompt_template.run_gpt_prompt import *
 from backend.persona.prompt_template.gpt_structure import *
+from backend.persona.prompt_template.context_builder import *
 from backend.persona.cognitive_modules.retrieve import *
+from backend.persona.cognitive_modules.poignancy_scorer import *
 
 def generate_focal_points(persona, n=3): 
   if debug: print ("GNS FUNCTION: <generate_focal_points>")
@@ -35,9 +37,23 @@ def generate_focal_points(persona, n=3):
   return run_gpt_prompt_focal_pt(persona, statements, n)[0]
 
 
-def generate_insights_and_evidence(persona, nodes, n=5): 
+def generate_insights_and_evidence(persona, nodes, n=5, scores=None): 
+  """
+  <scores> maps node_id to retrieval score. Only the highest scoring nodes
+  that fit the prompt's token budget are shown (and can be cited as
+  evidence); without scores, the order of <nodes> is taken as the ranking.
+  """
   if debug: print ("GNS FUNCTION: <generate_insights_and_evidence>")
 
+  if scores is None: 
+    line_scores = [-rank for rank in range(len(nodes))]
+  else: 
+    line_scores = [scores[node.node_id] for node in nodes]
+  kept = prompt_context.select("insight_and_evidence_v1.txt", 
+                               [f'{node.embedding_key}\n' for node in nodes], 
+                               line_scores)
+  nodes = [nodes[i] for i in kept]
+
   statements = ""
   for count, node in enumerate(nodes): 
     statements += f'{str(count)}. {node.embedding_key}\n'
@@ -70,17 +86,10 @@ def generate_action_event_triple(act_desp, persona):
   return run_gpt_prompt_event_triple(act_desp, persona)[0]
 
 
-def generate_poig_score(persona, event_type, description): 
+def generate_poig_score(persona, event_type, description, embedding=None): 
   if debug: print ("GNS FUNCTION: <generate_poig_score>")
 
-  if "is idle" in description: 
-    return 1
-
-  if event_type == "event" or event_type == "thought": 
-    return run_gpt_prompt_event_poignancy(persona, description)[0]
-  elif event_type == "chat": 
-    return run_gpt_prompt_chat_poignancy(persona, 
-                           persona.scratch.act_description)[0]
+  return score_poignancy(persona, event_type, description, embedding)
 
 
 def generate_planning_thought_on_convo(persona, all_utt):
@@ -107,7 +116,8 @@ def run_reflect(persona):
   focal_points = generate_focal_points(persona, 3)
   # Retrieve the relevant Nodes object for each of the focal points. 
   # <retrieved> has keys of focal points, and values of the associated Nodes. 
-  retrieved = new_retrieve(persona, focal_points)
+  scores = dict()
+  retrieved = new_retrieve(persona, focal_points, scores=scores)
 
   # For each of the focal points, generate thoughts and save it in the 
   # agent's memory. 
@@ -115,14 +125,20 @@ def run_reflect(persona):
     xx = [i.embedding_key for i in nodes]
     for xxx in xx: print (xxx)
 
-    thoughts = generate_insights_and_evidence(persona, nodes, 5)
+    thoughts = generate_insights_and_evidence(persona, nodes, 5, 
+                                              scores[focal_pt])
+    # All thoughts of this focal point are embedded in one request. 
+    thought_embeddings = dict(zip(thoughts.keys(), 
+                                  get_embeddings(list(thoughts.keys()), 
+                                    known=persona.a_mem.embeddings)))
     for thought, evidence in thoughts.items(): 
       created = persona.scratch.curr_time
       expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
       s, p, o = generate_action_event_triple(thought, persona)
       keywords = set([s, p, o])
-      thought_poignancy = generate_poig_score(persona, "thought", thought)
-      thought_embedding_pair = (thought, get_embedding(thought))
+      thought_poignancy = generate_poig_score(persona, "thought", thought, 
+                                              thought_embeddings[thought])
+      thought_embedding_pair = (thought, thought_embeddings[thought])
 
       persona.a_mem.add_thought(created, expiration, s, p, o, 
                                 thought, keywords, thought_poignancy, 
@@ -147,7 +163,7 @@ def reflection_trigger(persona):
   print (persona.scratch.importance_trigger_max)
 
   if (persona.scratch.importance_trigger_curr <= 0 and 
-      [] != persona.a_mem.seq_event + persona.a_mem.seq_thought): 
+      (persona.a_mem.seq_event or persona.a_mem.seq_thought)): 
     return True 
   return False
 
@@ -217,8 +233,11 @@ def reflect(persona):
       expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
       s, p, o = generate_action_event_triple(planning_thought, persona)
       keywords = set([s, p, o])
-      thought_poignancy = generate_poig_score(persona, "thought", planning_thought)
-      thought_embedding_pair = (planning_thought, get_embedding(planning_thought))
+      thought_embedding_pair = (planning_thought, 
+                                get_embedding(planning_thought, 
+                                  known=persona.a_mem.embeddings))
+      thought_poignancy = generate_poig_score(persona, "thought", planning_thought, 
+                                              thought_embedding_pair[1])
 
       persona.a_mem.add_thought(created, expiration, s, p, o, 
                                 planning_thought, keywords, thought_poignancy, 
@@ -233,8 +252,11 @@ def reflect(persona):
       expiration = persona.scratch.curr_time + datetime.timedelta(days=30)
       s, p, o = generate_action_event_triple(memo_thought, persona)
       keywords = set([s, p, o])
-      thought_poignancy = generate_poig_score(persona, "thought", memo_thought)
-      thought_embedding_pair = (memo_thought, get_embedding(memo_thought))
+      thought_embedding_pair = (memo_thought, 
+                                get_embedding(memo_thought, 
+                                  known=persona.a_mem.embeddings))
+      thought_poignancy = generate_poig_score(persona, "thought", memo_thought, 
+                                              thought_embedding_pair[1])
 
       persona.a_mem.add_thought(created, expiration, s, p, o, 
                                 memo_thought, keywords, thought_poignancy, 
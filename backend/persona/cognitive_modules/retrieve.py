@@ -5,11 +5,13 @@ File: retrieve.py
 Description: This defines the "Retrieve" module for generative agents. 
 """
 import sys
+import time
 sys.path.append('../../')
 
 from backend.global_methods import *
 from backend.persona.prompt_template.gpt_structure import *
 
+import numpy as np
 from numpy import dot
 from numpy.linalg import norm
 
@@ -172,7 +174,7 @@ def extract_importance(persona, nodes):
   return importance_out
 
 
-def extract_relevance(persona, nodes, focal_pt): 
+def extract_relevance(persona, nodes, focal_pt, focal_embedding=None): 
   """
   Gets the current Persona object, a list of nodes that are in a 
   chronological order, and the focal_pt string and outputs a dictionary 
@@ -182,21 +184,82 @@ def extract_relevance(persona, nodes, focal_pt):
     persona: Current persona whose memory we are retrieving. 
     nodes: A list of Node object in a chronological order. 
     focal_pt: A string describing the current thought of revent of focus.  
+    focal_embedding: The embedding of focal_pt, if the caller already has it. 
   OUTPUT: 
     relevance_out: A dictionary whose keys are the node.node_id and whose values
                  are the float that represents the relevance score. 
   """
-  focal_embedding = get_embedding(focal_pt)
+  if focal_embedding is None: 
+    focal_embedding = get_embedding(focal_pt, known=persona.a_mem.embeddings)
 
+  # One matrix-vector product over the memory's embedding matrix. 
+  similarities = persona.a_mem.relevance(nodes, focal_embedding)
   relevance_out = dict()
-  for count, node in enumerate(nodes): 
-    node_embedding = persona.a_mem.embeddings[node.embedding_key]
-    relevance_out[node.node_id] = cos_sim(node_embedding, focal_embedding)
+  for node, similarity in zip(nodes, similarities.tolist()): 
+    relevance_out[node.node_id] = similarity
 
   return relevance_out
 
 
-def new_retrieve(persona, focal_points, n_count=30): 
+_recency_powers = dict()
+
+
+def recency_powers(recency_decay, n): 
+  """
+  [recency_decay**1, ..., recency_decay**n] as a float64 array (the recency
+  score of extract_recency). The powers are cached per decay and computed
+  with Python floats, so they match extract_recency exactly. 
+  """
+  powers = _recency_powers.get(recency_decay)
+  if powers is None or len(powers) < n: 
+    powers = np.array([recency_decay ** i for i in range(1, max(n, 64) + 1)])
+    _recency_powers[recency_decay] = powers
+  return powers[:n]
+
+
+def normalize_floats(a, target_min, target_max): 
+  """The array version of normalize_dict_floats."""
+  min_val = a.min()
+  max_val = a.max()
+  range_val = max_val - min_val
+
+  if range_val == 0: 
+    return np.full(len(a), (target_max - target_min)/2)
+  return ((a - min_val) * (target_max - target_min) 
+          / range_val + target_min)
+
+
+def top_k_indices(a, k): 
+  """
+  Indices of the <k> highest values of <a>, highest first; equal values 
+  keep their index order, like top_highest_x_values. Only the top <k> are
+  sorted. 
+  """
+  if k >= len(a): 
+    return np.argsort(-a, kind="stable")
+  if k <= 0: 
+    return np.empty(0, dtype=np.int64)
+  kth = a[np.argpartition(-a, k - 1)[:k]].min()
+  above = np.flatnonzero(a > kth)
+  ties = np.flatnonzero(a == kth)[:k - len(above)]
+  top = np.concatenate([above, ties])
+  return top[np.lexsort((top, -a[top]))]
+
+
+def combine_scores(persona, recency, relevance, importance): 
+  """The retrieval score of new_retrieve from its normalized components."""
+  # Note to self: test out different weights. [1, 1, 1] tends to work
+  # decently, but in the future, these weights should likely be learned, 
+  # perhaps through an RL-like process.
+  # gw = [1, 1, 1]
+  # gw = [1, 2, 1]
+  gw = [0.5, 3, 2]
+  return (persona.scratch.recency_w*recency*gw[0] 
+          + persona.scratch.relevance_w*relevance*gw[1] 
+          + persona.scratch.importance_w*importance*gw[2])
+
+
+def new_retrieve(persona, focal_points, n_count=30, scores=None): 
   """
   Given the current persona and focal points (focal points are events or 
   thoughts for which we are retrieving), we retrieve a set of nodes for each
@@ -206,6 +269,8 @@ def new_retrieve(persona, focal_points, n_count=30):
     persona: The current persona object whose memory we are retrieving. 
     focal_points: A list of focal points (string description of the events or
                   thoughts that is the focus of current retrieval).
+    scores: If a dictionary is given, it is filled with focal point -> 
+            {node_id: retrieval score} of the returned nodes. 
   OUTPUT: 
     retrieved: A dictionary whose keys are a string focal point, and whose 
                values are a list of Node object in the agent's associative 
@@ -217,55 +282,69 @@ def new_retrieve(persona, focal_points, n_count=30):
   """
   # <retrieved> is the main dictionary that we are returning
   retrieved = dict() 
-  for focal_pt in focal_points: 
+  # All focal points are embedded up front in one batched request. 
+  focal_embeddings = get_embeddings(focal_points, 
+                                    known=persona.a_mem.embeddings)
+  a_mem = persona.a_mem
+  for focal_pt, focal_embedding in zip(focal_points, focal_embeddings): 
     # Getting all nodes from the agent's memory (both thoughts and events) and
-    # sorting them by the datetime of creation.
+    # sorting them by the datetime of last access, as rows of the memory's
+    # parallel arrays. The sort is stable, so ties keep the order of 
+    # seq_event + seq_thought. 
     # You could also imagine getting the raw conversation, but for now. 
-    nodes = [[i.last_accessed, i]
-              for i in persona.a_mem.seq_event + persona.a_mem.seq_thought
-              if "idle" not in i.embedding_key]
-    nodes = sorted(nodes, key=lambda x: x[0])
-    nodes = [i for created, i in nodes]
-
-    # Calculating the component dictionaries and normalizing them.
-    recency_out = extract_recency(persona, nodes)
-    recency_out = normalize_dict_floats(recency_out, 0, 1)
-    importance_out = extract_importance(persona, nodes)
-    importance_out = normalize_dict_floats(importance_out, 0, 1)  
-    relevance_out = extract_relevance(persona, nodes, focal_pt)
-    relevance_out = normalize_dict_floats(relevance_out, 0, 1)
-
-    # Computing the final scores that combines the component values. 
-    # Note to self: test out different weights. [1, 1, 1] tends to work
-    # decently, but in the future, these weights should likely be learned, 
-    # perhaps through an RL-like process.
-    # gw = [1, 1, 1]
-    # gw = [1, 2, 1]
-    gw = [0.5, 3, 2]
-    master_out = dict()
-    for key in recency_out.keys(): 
-      master_out[key] = (persona.scratch.recency_w*recency_out[key]*gw[0] 
-                     + persona.scratch.relevance_w*relevance_out[key]*gw[1] 
-                     + persona.scratch.importance_w*importance_out[key]*gw[2])
-
-    master_out = top_highest_x_values(master_out, len(master_out.keys()))
-    for key, val in master_out.items(): 
-      print (persona.a_mem.id_to_node[key].embedding_key, val)
-      print (persona.scratch.recency_w*recency_out[key]*1, 
-             persona.scratch.relevance_w*relevance_out[key]*1, 
-             persona.scratch.importance_w*importance_out[key]*1)
-
-    # Extracting the highest x values.
-    # <master_out> has the key of node.id and value of float. Once we get the 
-    # highest x values, we want to translate the node.id into nodes and return
-    # the list of nodes.
-    master_out = top_highest_x_values(master_out, n_count)
-    master_nodes = [persona.a_mem.id_to_node[key] 
-                    for key in list(master_out.keys())]
-
-    for n in master_nodes: 
-      n.last_accessed = persona.scratch.curr_time
+    rows = a_mem.retrieval_rows()
+    if not len(rows): 
+      retrieved[focal_pt] = []
+      if scores is not None: 
+        scores[focal_pt] = dict()
+      continue
+    rows = rows[np.argsort(a_mem.node_last_accessed[rows], kind="stable")]
+
+    # Calculating the component arrays and normalizing them.
+    recency = normalize_floats(recency_powers(persona.scratch.recency_decay, 
+                                              len(rows)), 0, 1)
+    importance = normalize_floats(a_mem.node_poignancy[rows], 0, 1)
+    # Relevance is exact unless the memory has a trained ANN index, in which 
+    # case only the nodes near the focal point are compared with it. 
+    ann_index = a_mem.ann_index
+    use_ann = ann_index is not None and ann_index.ready
+    if use_ann: 
+      start = time.perf_counter()
+      raw_relevance = ann_index.relevance(rows, focal_embedding, 
+                                          a_mem.embedding_matrix, 
+                                          a_mem.embedding_norms)
+      ann_sec = time.perf_counter() - start
+    else: 
+      raw_relevance = a_mem.row_relevance(rows, focal_embedding)
+    relevance = normalize_floats(raw_relevance.astype(np.float64), 0, 1)
+    master = combine_scores(persona, recency, relevance, importance)
+
+    # Extracting the highest x values and translating their rows into nodes.
+    top = top_k_indices(master, n_count)
+    if debug: 
+      for i in top: 
+        print (a_mem.row_nodes[rows[i]].embedding_key, master[i])
+        print (persona.scratch.recency_w*recency[i]*1, 
+               persona.scratch.relevance_w*relevance[i]*1, 
+               persona.scratch.importance_w*importance[i]*1)
+    if use_ann and ann_index.should_audit(): 
+      start = time.perf_counter()
+      exact_relevance = a_mem.row_relevance(rows, focal_embedding)
+      exact_sec = time.perf_counter() - start
+      exact_top = top_k_indices(
+        combine_scores(persona, recency, 
+                       normalize_floats(exact_relevance.astype(np.float64), 
+                                        0, 1), 
+                       importance), 
+        n_count)
+      recall = len(set(top.tolist()) & set(exact_top.tolist())) / max(1, len(exact_top))
+      ann_index.record_audit(recall, ann_sec, exact_sec)
+    master_nodes = [a_mem.row_nodes[rows[i]] for i in top]
+    a_mem.touch(master_nodes, persona.scratch.curr_time)
       
     retrieved[focal_pt] = master_nodes
+    if scores is not None: 
+      scores[focal_pt] = {node.node_id: score for node, score 
+                          in zip(master_nodes, master[top].tolist())}
 
   return retrieved
@@ -0,0 +1,117 @@
+"""
+File: semantic_memo.py
+Description: Per-world semantic memo of short, subject-independent prompt
+outputs (pronunciatio emojis and event-triple predicates/objects). A lookup
+tries the exact description first and then its embedding nearest neighbour
+above a similarity threshold, so recurring descriptions such as "working at
+his desk" / "working on paperwork at his desk" reuse one prompt result.
+"""
+
+import threading
+
+import numpy as np
+
+from backend.utils import *
+
+
+class SemanticMemo:
+    """Description -> value memo of one kind of output in one world."""
+
+    def __init__(self, threshold=semantic_memo_threshold):
+        self.threshold = threshold
+        self.exact = dict()
+        self._vectors = []
+        self._values = []
+        self._matrix = None
+
+    @staticmethod
+    def normalize(text):
+        return " ".join(text.lower().split())
+
+    def get_exact(self, text):
+        return self.exact.get(self.normalize(text))
+
+    def get_nearest(self, embedding):
+        """The value of the most similar stored description, if similar enough."""
+        if not self._values:
+            return None
+        if self._matrix is None:
+            self._matrix = np.vstack(self._vectors)
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if not norm:
+            return None
+        similarities = self._matrix @ (query / norm)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+        return self._values[best]
+
+    def put(self, text, embedding, value):
+        self.exact[self.normalize(text)] = value
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm:
+            self._vectors += [vector / norm]
+            self._values += [value]
+            self._matrix = None
+
+
+class SemanticMemoStore:
+    """One SemanticMemo per (world, kind), with hit counters per kind."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.memos = dict()
+        self.counts = dict()
+
+    def _count(self, kind, outcome):
+        counts = self.counts.setdefault(kind, {"exact": 0, "semantic": 0, "miss": 0})
+        counts[outcome] += 1
+
+    def get_or_compute(self, world, kind, text, compute, embed, should_store=None):
+        """
+        Returns the memoized value for <text>, or computes it with <compute>
+        (a zero-argument function running the prompt) and stores it.
+        <embed> maps a text to its embedding. A computed value is returned
+        as is, but only stored if it is not None and <should_store> (if
+        given) accepts it, so prompt fail-safes are not reused.
+        """
+        if not semantic_memo_enabled:
+            return compute()
+
+        with self._lock:
+            memo = self.memos.setdefault((world, kind), SemanticMemo())
+            value = memo.get_exact(text)
+            if value is not None:
+                self._count(kind, "exact")
+                return value
+
+        embedding = embed(text)
+        with self._lock:
+            value = memo.get_nearest(embedding)
+            if value is not None:
+                self._count(kind, "semantic")
+                # Later lookups of this exact text skip the embedding.
+                memo.exact[memo.normalize(text)] = value
+                return value
+            self._count(kind, "miss")
+
+        value = compute()
+        if value is not None and (should_store is None or should_store(value)):
+            with self._lock:
+                memo.put(text, embedding, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {
+                "counts": {kind: dict(counts) for kind, counts in self.counts.items()},
+                "entries": {
+                    f"{world}:{kind}": len(memo.exact)
+                    for (world, kind), memo in self.memos.items()
+                },
+            }
+
+
+semantic_memo = SemanticMemoStore()
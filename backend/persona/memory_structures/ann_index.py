@@ -0,0 +1,145 @@
+"""
+File: ann_index.py
+Description: Optional inverted-file (IVF) approximate nearest-neighbour index
+over the node embeddings of an AssociativeMemory. Embeddings are clustered
+with spherical k-means; a retrieval computes exact cosine similarity only for
+the nodes in the clusters nearest the focal point, and every other node gets
+a floor relevance. Nodes are assigned to their cluster as they are added, and
+the clusters are retrained whenever the memory has doubled since the last
+training.
+"""
+
+import random
+
+import numpy as np
+
+from backend.utils import *
+
+# At most this many embeddings are sampled to train the clusters.
+TRAIN_SAMPLE = 8192
+KMEANS_ITERATIONS = 8
+
+
+class IVFIndex:
+    def __init__(
+        self,
+        min_rows=memory_ann_min_rows,
+        n_probe=memory_ann_probes,
+        audit_rate=memory_ann_audit_rate,
+    ):
+        self.min_rows = min_rows
+        self.n_probe = n_probe
+        self.audit_rate = audit_rate
+
+        self.centroids = None
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.trained_rows = 0
+        self.rng = np.random.default_rng(0)
+
+        self.searches = 0
+        self.candidates = 0
+        self.audits = 0
+        self.recall_total = 0.0
+        self.ann_sec_total = 0.0
+        self.exact_sec_total = 0.0
+
+    @property
+    def ready(self):
+        return self.centroids is not None
+
+    def add(self, row, matrix, norms):
+        """
+        Indexes row <row> of <matrix> (norms in <norms>). Trains the clusters
+        once there are <min_rows> rows and retrains them when the row count
+        has doubled since.
+        """
+        n_rows = row + 1
+        if n_rows >= max(self.min_rows, 2 * self.trained_rows):
+            self.train(matrix[:n_rows], norms[:n_rows])
+            return
+        if not self.ready:
+            return
+        if row >= len(self.assignments):
+            grown = np.empty(max(2 * len(self.assignments), row + 1), dtype=np.int32)
+            grown[: len(self.assignments)] = self.assignments
+            self.assignments = grown
+        self.assignments[row] = int(np.argmax(self.centroids @ (matrix[row] / norms[row])))
+
+    def train(self, matrix, norms):
+        """Spherical k-means over (a sample of) the rows; reassigns every row."""
+        n_rows = len(matrix)
+        unit = matrix / np.maximum(norms, 1e-12)[:, None]
+        n_lists = int(min(1024, n_rows, max(16, np.sqrt(n_rows))))
+        sample = unit
+        if n_rows > TRAIN_SAMPLE:
+            sample = unit[self.rng.choice(n_rows, TRAIN_SAMPLE, replace=False)]
+        centroids = sample[self.rng.choice(len(sample), n_lists, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=n_lists)
+            # Empty clusters keep their previous centroid.
+            filled = counts > 0
+            centroids[filled] = sums[filled]
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1), 1e-12)[:, None]
+
+        self.centroids = centroids.astype(np.float32)
+        self.assignments = np.empty(2 * n_rows, dtype=np.int32)
+        for start in range(0, n_rows, TRAIN_SAMPLE):
+            block = unit[start : start + TRAIN_SAMPLE]
+            self.assignments[start : start + len(block)] = np.argmax(
+                block @ self.centroids.T, axis=1
+            )
+        self.trained_rows = n_rows
+
+    def relevance(self, rows, focal_embedding, matrix, norms):
+        """
+        Approximate cosine similarity of <focal_embedding> to each of <rows>:
+        exact for the rows in the <n_probe> nearest clusters, and the lowest
+        similarity seen (to any centroid or candidate) for the rest.
+        """
+        focal = np.asarray(focal_embedding, dtype=np.float32)
+        focal_norm = np.linalg.norm(focal)
+        centroid_similarities = self.centroids @ (focal / focal_norm)
+        n_probe = min(self.n_probe, len(self.centroids))
+        probe = np.argpartition(-centroid_similarities, n_probe - 1)[:n_probe]
+        candidates = np.isin(self.assignments[rows], probe)
+
+        candidate_rows = rows[candidates]
+        similarities = matrix[candidate_rows] @ focal / (norms[candidate_rows] * focal_norm)
+        floor = centroid_similarities.min()
+        if len(similarities):
+            floor = min(floor, similarities.min())
+        relevance = np.full(len(rows), floor, dtype=np.float32)
+        relevance[candidates] = similarities
+
+        self.searches += 1
+        self.candidates += len(candidate_rows)
+        return relevance
+
+    def should_audit(self):
+        return random.random() < self.audit_rate
+
+    def record_audit(self, recall, ann_sec, exact_sec):
+        """Records one comparison of an ANN retrieval against the exact one."""
+        self.audits += 1
+        self.recall_total += recall
+        self.ann_sec_total += ann_sec
+        self.exact_sec_total += exact_sec
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "lists": len(self.centroids) if self.ready else 0,
+            "trained_rows": self.trained_rows,
+            "searches": self.searches,
+            "mean_candidates": round(self.candidates / self.searches, 1) if self.searches else None,
+            "audits": self.audits,
+            "recall": round(self.recall_total / self.audits, 4) if self.audits else None,
+            "speedup": (
+                round(self.exact_sec_total / self.ann_sec_total, 2)
+                if self.audits and self.ann_sec_total
+                else None
+            ),
+        }
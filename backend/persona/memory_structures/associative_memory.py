@@ -10,13 +10,59 @@ agents paper.
 import sys
 sys.path.append('../../')
 
+import os
 import json
 import datetime
+import collections
 
+import numpy as np
+
+from backend.utils import *
 from backend.global_methods import *
+from backend.persona.memory_structures.ann_index import *
+from backend.persona.memory_structures.embedding_store import *
+
+# Rows added at a time when the embedding matrix runs out of room (the
+# matrix also at least doubles, so appends stay amortized O(1)).
+EMBEDDING_CHUNK_ROWS = 256
+
+NODE_TYPES = ["event", "thought", "chat"]
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_microseconds(dt): 
+  """A naive datetime as integer microseconds since EPOCH."""
+  return (dt - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def from_microseconds(us): 
+  """Inverse of to_microseconds."""
+  return EPOCH + datetime.timedelta(microseconds=us)
+
+
+def intern_str(value): 
+  """<value> interned if it is a string, so repeats share one object."""
+  if isinstance(value, str): 
+    return sys.intern(value)
+  return value
 
 
 class ConceptNode: 
+  # Nodes are the bulk of a long simulation's memory, so they have no 
+  # __dict__: repeated strings (subject, predicate, object, description, 
+  # keywords) are interned, keywords are kept as a tuple and times as 
+  # integer microseconds since EPOCH. created, expiration and last_accessed
+  # still read as datetimes, but each read builds a new datetime from the 
+  # stored microseconds; code that compares or sorts many nodes by time 
+  # should use the underscored integers. keywords reads as a frozenset, so 
+  # changing a node's keywords means assigning a new set. 
+  __slots__ = ("node_id", "node_count", "type_count", "type", "depth", 
+               "_created", "_expiration", "_last_accessed", 
+               "subject", "predicate", "object", 
+               "description", "embedding_key", "poignancy", "_keywords", 
+               "filling")
+
   def __init__(self,
                node_id, node_count, type_count, node_type, depth,
                created, expiration, 
@@ -25,35 +71,117 @@ class ConceptNode:
     self.node_id = node_id
     self.node_count = node_count
     self.type_count = type_count
-    self.type = node_type # thought / event / chat
+    self.type = sys.intern(node_type) # thought / event / chat
     self.depth = depth
 
     self.created = created
     self.expiration = expiration
-    self.last_accessed = self.created
+    self._last_accessed = self._created
 
-    self.subject = s
-    self.predicate = p
-    self.object = o
+    self.subject = intern_str(s)
+    self.predicate = intern_str(p)
+    self.object = intern_str(o)
 
-    self.description = description
-    self.embedding_key = embedding_key
+    self.description = intern_str(description)
+    self.embedding_key = intern_str(embedding_key)
     self.poignancy = poignancy
     self.keywords = keywords
     self.filling = filling
 
 
+  @property
+  def created(self): 
+    return from_microseconds(self._created)
+
+  @created.setter
+  def created(self, value): 
+    self._created = to_microseconds(value)
+
+  @property
+  def expiration(self): 
+    if self._expiration is None: 
+      return None
+    return from_microseconds(self._expiration)
+
+  @expiration.setter
+  def expiration(self, value): 
+    self._expiration = None if value is None else to_microseconds(value)
+
+  @property
+  def last_accessed(self): 
+    return from_microseconds(self._last_accessed)
+
+  @last_accessed.setter
+  def last_accessed(self, value): 
+    self._last_accessed = to_microseconds(value)
+
+  @property
+  def keywords(self): 
+    return frozenset(self._keywords)
+
+  @keywords.setter
+  def keywords(self, value): 
+    self._keywords = tuple(intern_str(kw) for kw in value)
+
+
   def spo_summary(self): 
     return (self.subject, self.predicate, self.object)
 
 
+class NewestFirst: 
+  """
+  Append-only sequence that reads newest-first, like a list that every item
+  is inserted at the front of: index 0 is the item appended last, and 
+  iteration and slicing run from newest to oldest. Appending is O(1), where
+  inserting at the front of a list is O(n). 
+  """
+  __slots__ = ("items",)
+
+  def __init__(self): 
+    # Oldest first, in the order appended. 
+    self.items = []
+
+  def append(self, item): 
+    self.items.append(item)
+
+  def latest(self, n=None): 
+    """The <n> newest items (all of them if <n> is None), newest first."""
+    if n is None: 
+      return self.items[::-1]
+    if n <= 0: 
+      return []
+    return self.items[:-n-1:-1]
+
+  def __len__(self): 
+    return len(self.items)
+
+  def __iter__(self): 
+    return reversed(self.items)
+
+  def __getitem__(self, i): 
+    if isinstance(i, slice): 
+      return [self.items[-1-j] for j in range(*i.indices(len(self.items)))]
+    if i < 0: 
+      i += len(self.items)
+    if not 0 <= i < len(self.items): 
+      raise IndexError("NewestFirst index out of range")
+    return self.items[-1-i]
+
+  def __add__(self, other): 
+    return self.latest() + list(other)
+
+  def __radd__(self, other): 
+    return list(other) + self.latest()
+
+
 class AssociativeMemory: 
   def __init__(self, f_saved): 
     self.id_to_node = dict()
 
-    self.seq_event = []
-    self.seq_thought = []
-    self.seq_chat = []
+    # Newest first (see NewestFirst), as are the keyword postings below. 
+    self.seq_event = NewestFirst()
+    self.seq_thought = NewestFirst()
+    self.seq_chat = NewestFirst()
 
     self.kw_to_event = dict()
     self.kw_to_thought = dict()
@@ -62,45 +190,46 @@ class AssociativeMemory:
     self.kw_strength_event = dict()
     self.kw_strength_thought = dict()
 
-    self.embeddings = json.load(open(f_saved + "/embeddings.json"))
+    # For each retention value asked about, how many times each SPO summary 
+    # occurs among the latest <retention> events; kept up to date as events 
+    # are added (see latest_event_summaries). 
+    self.recent_spo = dict()
+
+    # Node embeddings as rows of one contiguous float32 matrix, with their
+    # norms, so relevance to a focal point is a single matrix-vector 
+    # product. <node_index> maps node_id to its row and <row_nodes> back. 
+    # Parallel arrays hold what retrieval scores nodes by: node type, 
+    # whether the node is retrievable (not idle), poignancy and last access
+    # time (in microseconds since EPOCH). 
+    self.embedding_matrix = None
+    self.embedding_norms = None
+    self.node_index = dict()
+    self.row_nodes = []
+    self.node_types = None
+    self.node_retrievable = None
+    self.node_poignancy = None
+    self.node_last_accessed = None
+    # Optional approximate nearest-neighbour index over the embedding rows.
+    self.ann_index = IVFIndex() if memory_ann_index else None
+
+    # Embeddings are either a dictionary loaded from embeddings.json or, 
+    # with EMBEDDING_STORE set to float32/float16, a memory-mapped binary
+    # store (migrated from embeddings.json on first load). 
+    if embedding_store == "json": 
+      self.embeddings = json.load(open(f_saved + "/embeddings.json"))
+    else: 
+      self.embeddings = EmbeddingStore(f_saved, embedding_store)
+
+    # Changes since the last save, as journal records (see save()). None 
+    # while the memory is being loaded. 
+    self.journal = None
+    self.journal_folder = f_saved
+    self.journal_records = 0
 
     nodes_load = json.load(open(f_saved + "/nodes.json"))
     for count in range(len(nodes_load.keys())): 
       node_id = f"node_{str(count+1)}"
-      node_details = nodes_load[node_id]
-
-      node_count = node_details["node_count"]
-      type_count = node_details["type_count"]
-      node_type = node_details["type"]
-      depth = node_details["depth"]
-
-      created = datetime.datetime.strptime(node_details["created"], 
-                                           '%Y-%m-%d %H:%M:%S')
-      expiration = None
-      if node_details["expiration"]: 
-        expiration = datetime.datetime.strptime(node_details["expiration"],
-                                                '%Y-%m-%d %H:%M:%S')
-
-      s = node_details["subject"]
-      p = node_details["predicate"]
-      o = node_details["object"]
-
-      description = node_details["description"]
-      embedding_pair = (node_details["embedding_key"], 
-                        self.embeddings[node_details["embedding_key"]])
-      poignancy =node_details["poignancy"]
-      keywords = set(node_details["keywords"])
-      filling = node_details["filling"]
-      
-      if node_type == "event": 
-        self.add_event(created, expiration, s, p, o, 
-                   description, keywords, poignancy, embedding_pair, filling)
-      elif node_type == "chat": 
-        self.add_chat(created, expiration, s, p, o, 
-                   description, keywords, poignancy, embedding_pair, filling)
-      elif node_type == "thought": 
-        self.add_thought(created, expiration, s, p, o, 
-                   description, keywords, poignancy, embedding_pair, filling)
+      self._add_node_dict(nodes_load[node_id])
 
     kw_strength_load = json.load(open(f_saved + "/kw_strength.json"))
     if kw_strength_load["kw_strength_event"]: 
@@ -108,34 +237,123 @@ class AssociativeMemory:
     if kw_strength_load["kw_strength_thought"]: 
       self.kw_strength_thought = kw_strength_load["kw_strength_thought"]
 
+    self._replay_journal(f_saved)
+    if memory_journal: 
+      self.journal = []
+
+
+  def _node_dict(self, node): 
+    """The nodes.json (and journal) record of <node>."""
+    r = dict()
+    r["node_count"] = node.node_count
+    r["type_count"] = node.type_count
+    r["type"] = node.type
+    r["depth"] = node.depth
+
+    r["created"] = node.created.strftime('%Y-%m-%d %H:%M:%S')
+    r["expiration"] = None
+    if node.expiration: 
+      r["expiration"] = node.expiration.strftime('%Y-%m-%d %H:%M:%S')
+    r["last_accessed"] = node.last_accessed.isoformat()
+
+    r["subject"] = node.subject
+    r["predicate"] = node.predicate
+    r["object"] = node.object
+
+    r["description"] = node.description
+    r["embedding_key"] = node.embedding_key
+    r["poignancy"] = node.poignancy
+    r["keywords"] = list(node.keywords)
+    r["filling"] = node.filling
+    return r
+
+
+  def _add_node_dict(self, node_details, embedding=None): 
+    """Adds a node from its _node_dict record (as loaded from disk)."""
+    node_type = node_details["type"]
+
+    created = datetime.datetime.strptime(node_details["created"], 
+                                         '%Y-%m-%d %H:%M:%S')
+    expiration = None
+    if node_details["expiration"]: 
+      expiration = datetime.datetime.strptime(node_details["expiration"],
+                                              '%Y-%m-%d %H:%M:%S')
+
+    s = node_details["subject"]
+    p = node_details["predicate"]
+    o = node_details["object"]
+
+    description = node_details["description"]
+    if embedding is None: 
+      embedding = self.embeddings[node_details["embedding_key"]]
+    embedding_pair = (node_details["embedding_key"], embedding)
+    poignancy =node_details["poignancy"]
+    keywords = set(node_details["keywords"])
+    filling = node_details["filling"]
+    
+    if node_type == "event": 
+      node = self.add_event(created, expiration, s, p, o, 
+                 description, keywords, poignancy, embedding_pair, filling)
+    elif node_type == "chat": 
+      node = self.add_chat(created, expiration, s, p, o, 
+                 description, keywords, poignancy, embedding_pair, filling)
+    elif node_type == "thought": 
+      node = self.add_thought(created, expiration, s, p, o, 
+                 description, keywords, poignancy, embedding_pair, filling)
+
+    # Snapshots written before last_accessed was saved start at created. 
+    if node_details.get("last_accessed"): 
+      self._set_last_accessed(
+        [node], datetime.datetime.fromisoformat(node_details["last_accessed"]))
+    return node
+
+
+  def _replay_journal(self, folder): 
+    """
+    Applies the records of <folder>/journal.jsonl on top of the snapshot.
+    A partly written last record (from an interrupted save) is ignored. 
+    """
+    self.journal_records = 0
+    journal_path = folder + "/journal.jsonl"
+    if not os.path.exists(journal_path): 
+      return
+    with open(journal_path, "r") as f: 
+      for line in f: 
+        try: 
+          record = json.loads(line)
+        except json.JSONDecodeError: 
+          break
+        if record["op"] == "node": 
+          node = self._add_node_dict(record, record.get("embedding"))
+          if node.node_id != record["node_id"]: 
+            raise ValueError(f"Journal of {folder} is out of order at "
+                             f"{record['node_id']}")
+        elif record["op"] == "access": 
+          self._set_last_accessed(
+            [self.id_to_node[i] for i in record["node_ids"]], 
+            datetime.datetime.fromisoformat(record["time"]))
+        self.journal_records += 1
+
     
   def save(self, out_json): 
+    """
+    Saves the memory to the <out_json> folder. With MEMORY_JOURNAL enabled,
+    a save to the folder the memory is in sync with only appends the 
+    changes since the last save to journal.jsonl; the snapshot (nodes.json,
+    kw_strength.json and the embeddings) is rewritten, and the journal 
+    emptied, when saving elsewhere or once the journal has more records 
+    than the snapshot has nodes. 
+    """
+    if (self.journal is not None 
+        and os.path.abspath(out_json) == os.path.abspath(self.journal_folder)
+        and self.journal_records + len(self.journal) <= len(self.id_to_node)): 
+      self._append_journal(out_json)
+      return
+
     r = dict()
     for count in range(len(self.id_to_node.keys()), 0, -1): 
       node_id = f"node_{str(count)}"
-      node = self.id_to_node[node_id]
-
-      r[node_id] = dict()
-      r[node_id]["node_count"] = node.node_count
-      r[node_id]["type_count"] = node.type_count
-      r[node_id]["type"] = node.type
-      r[node_id]["depth"] = node.depth
-
-      r[node_id]["created"] = node.created.strftime('%Y-%m-%d %H:%M:%S')
-      r[node_id]["expiration"] = None
-      if node.expiration: 
-        r[node_id]["expiration"] = (node.expiration
-                                        .strftime('%Y-%m-%d %H:%M:%S'))
-
-      r[node_id]["subject"] = node.subject
-      r[node_id]["predicate"] = node.predicate
-      r[node_id]["object"] = node.object
-
-      r[node_id]["description"] = node.description
-      r[node_id]["embedding_key"] = node.embedding_key
-      r[node_id]["poignancy"] = node.poignancy
-      r[node_id]["keywords"] = list(node.keywords)
-      r[node_id]["filling"] = node.filling
+      r[node_id] = self._node_dict(self.id_to_node[node_id])
 
     with open(out_json+"/nodes.json", "w") as outfile:
       json.dump(r, outfile)
@@ -146,8 +364,29 @@ class AssociativeMemory:
     with open(out_json+"/kw_strength.json", "w") as outfile:
       json.dump(r, outfile)
 
-    with open(out_json+"/embeddings.json", "w") as outfile:
-      json.dump(self.embeddings, outfile)
+    if isinstance(self.embeddings, EmbeddingStore): 
+      self.embeddings.save(out_json)
+    else: 
+      with open(out_json+"/embeddings.json", "w") as outfile:
+        json.dump(self.embeddings, outfile)
+
+    # The snapshot now holds everything the journal did. 
+    if os.path.exists(out_json + "/journal.jsonl"): 
+      os.remove(out_json + "/journal.jsonl")
+    self.journal_folder = out_json
+    self.journal_records = 0
+    if self.journal is not None: 
+      self.journal = []
+
+
+  def _append_journal(self, out_json): 
+    if isinstance(self.embeddings, EmbeddingStore): 
+      self.embeddings.save(out_json)
+    with open(out_json + "/journal.jsonl", "a") as outfile: 
+      for record in self.journal: 
+        outfile.write(json.dumps(record) + "\n")
+    self.journal_records += len(self.journal)
+    self.journal = []
 
 
   def add_event(self, created, expiration, s, p, o, 
@@ -174,13 +413,20 @@ class AssociativeMemory:
                        poignancy, keywords, filling)
 
     # Creating various dictionary cache for fast access. 
-    self.seq_event[0:0] = [node]
+    self.seq_event.append(node)
+    for retention, counts in self.recent_spo.items(): 
+      counts[node.spo_summary()] += 1
+      # The event that just fell out of the window. 
+      if len(self.seq_event) > retention: 
+        spo = self.seq_event[retention].spo_summary()
+        counts[spo] -= 1
+        if not counts[spo]: 
+          del counts[spo]
     keywords = [i.lower() for i in keywords]
     for kw in keywords: 
-      if kw in self.kw_to_event: 
-        self.kw_to_event[kw][0:0] = [node]
-      else: 
-        self.kw_to_event[kw] = [node]
+      if kw not in self.kw_to_event: 
+        self.kw_to_event[kw] = NewestFirst()
+      self.kw_to_event[kw].append(node)
     self.id_to_node[node_id] = node 
 
     # Adding in the kw_strength
@@ -192,6 +438,7 @@ class AssociativeMemory:
           self.kw_strength_event[kw] = 1
 
     self.embeddings[embedding_pair[0]] = embedding_pair[1]
+    self._add_node_row(node, embedding_pair[1])
 
     return node
 
@@ -218,13 +465,12 @@ class AssociativeMemory:
                        description, embedding_pair[0], poignancy, keywords, filling)
 
     # Creating various dictionary cache for fast access. 
-    self.seq_thought[0:0] = [node]
+    self.seq_thought.append(node)
     keywords = [i.lower() for i in keywords]
     for kw in keywords: 
-      if kw in self.kw_to_thought: 
-        self.kw_to_thought[kw][0:0] = [node]
-      else: 
-        self.kw_to_thought[kw] = [node]
+      if kw not in self.kw_to_thought: 
+        self.kw_to_thought[kw] = NewestFirst()
+      self.kw_to_thought[kw].append(node)
     self.id_to_node[node_id] = node 
 
     # Adding in the kw_strength
@@ -236,6 +482,7 @@ class AssociativeMemory:
           self.kw_strength_thought[kw] = 1
 
     self.embeddings[embedding_pair[0]] = embedding_pair[1]
+    self._add_node_row(node, embedding_pair[1])
 
     return node
 
@@ -257,25 +504,138 @@ class AssociativeMemory:
                        description, embedding_pair[0], poignancy, keywords, filling)
 
     # Creating various dictionary cache for fast access. 
-    self.seq_chat[0:0] = [node]
+    self.seq_chat.append(node)
     keywords = [i.lower() for i in keywords]
     for kw in keywords: 
-      if kw in self.kw_to_chat: 
-        self.kw_to_chat[kw][0:0] = [node]
-      else: 
-        self.kw_to_chat[kw] = [node]
+      if kw not in self.kw_to_chat: 
+        self.kw_to_chat[kw] = NewestFirst()
+      self.kw_to_chat[kw].append(node)
     self.id_to_node[node_id] = node 
 
     self.embeddings[embedding_pair[0]] = embedding_pair[1]
+    self._add_node_row(node, embedding_pair[1])
         
     return node
 
 
+  def _grow_rows(self, capacity): 
+    def grow(array, shape): 
+      grown = np.empty(shape, dtype=array.dtype)
+      grown[:len(array)] = array
+      return grown
+
+    dim = self.embedding_matrix.shape[1]
+    self.embedding_matrix = grow(self.embedding_matrix, (capacity, dim))
+    self.embedding_norms = grow(self.embedding_norms, capacity)
+    self.node_types = grow(self.node_types, capacity)
+    self.node_retrievable = grow(self.node_retrievable, capacity)
+    self.node_poignancy = grow(self.node_poignancy, capacity)
+    self.node_last_accessed = grow(self.node_last_accessed, capacity)
+
+
+  def _add_node_row(self, node, embedding): 
+    row = len(self.row_nodes)
+    vector = np.asarray(embedding, dtype=np.float32)
+    if self.embedding_matrix is None: 
+      self.embedding_matrix = np.empty((EMBEDDING_CHUNK_ROWS, len(vector)), 
+                                       dtype=np.float32)
+      self.embedding_norms = np.empty(EMBEDDING_CHUNK_ROWS, dtype=np.float32)
+      self.node_types = np.empty(EMBEDDING_CHUNK_ROWS, dtype=np.int8)
+      self.node_retrievable = np.empty(EMBEDDING_CHUNK_ROWS, dtype=bool)
+      self.node_poignancy = np.empty(EMBEDDING_CHUNK_ROWS, dtype=np.float64)
+      self.node_last_accessed = np.empty(EMBEDDING_CHUNK_ROWS, dtype=np.int64)
+    elif row == len(self.embedding_matrix): 
+      self._grow_rows(row + max(row, EMBEDDING_CHUNK_ROWS))
+
+    self.embedding_matrix[row] = vector
+    self.embedding_norms[row] = np.linalg.norm(vector)
+    self.node_types[row] = NODE_TYPES.index(node.type)
+    self.node_retrievable[row] = "idle" not in node.embedding_key
+    self.node_poignancy[row] = node.poignancy
+    self.node_last_accessed[row] = node._last_accessed
+    self.node_index[node.node_id] = row
+    self.row_nodes += [node]
+    if self.ann_index is not None: 
+      self.ann_index.add(row, self.embedding_matrix, self.embedding_norms)
+
+    if self.journal is not None: 
+      record = dict(op="node", node_id=node.node_id, **self._node_dict(node))
+      # The binary embedding store saves its own new rows. 
+      if not isinstance(self.embeddings, EmbeddingStore): 
+        record["embedding"] = list(embedding)
+      self.journal += [record]
+
+
+  def touch(self, nodes, curr_time): 
+    """Sets the last_accessed time of <nodes> to <curr_time>."""
+    self._set_last_accessed(nodes, curr_time)
+    if self.journal is not None and nodes: 
+      self.journal += [{"op": "access", 
+                        "node_ids": [node.node_id for node in nodes], 
+                        "time": curr_time.isoformat()}]
+
+
+  def _set_last_accessed(self, nodes, curr_time): 
+    curr_us = to_microseconds(curr_time)
+    for node in nodes: 
+      node._last_accessed = curr_us
+    rows = [self.node_index[node.node_id] for node in nodes]
+    self.node_last_accessed[rows] = curr_us
+
+
+  def retrieval_rows(self): 
+    """
+    Rows of the retrievable (non-idle) events and thoughts, newest event 
+    first, then newest thought first -- the order of 
+    seq_event + seq_thought. 
+    """
+    n_rows = len(self.row_nodes)
+    if not n_rows: 
+      return np.empty(0, dtype=np.int64)
+    retrievable = self.node_retrievable[:n_rows]
+    types = self.node_types[:n_rows]
+    events = np.flatnonzero(retrievable & (types == NODE_TYPES.index("event")))
+    thoughts = np.flatnonzero(retrievable 
+                              & (types == NODE_TYPES.index("thought")))
+    return np.concatenate([events[::-1], thoughts[::-1]])
+
+
+  def row_relevance(self, rows, focal_embedding): 
+    """
+    Cosine similarity between <focal_embedding> and the embeddings of 
+    <rows>, as a float32 array. 
+    """
+    n_rows = len(self.row_nodes)
+    focal = np.asarray(focal_embedding, dtype=np.float32)
+    similarities = (self.embedding_matrix[:n_rows] @ focal 
+                    / (self.embedding_norms[:n_rows] * np.linalg.norm(focal)))
+    return similarities[rows]
+
+
+  def relevance(self, nodes, focal_embedding): 
+    """
+    Cosine similarity between <focal_embedding> and the embedding of each of
+    <nodes>, as a float32 array in the order of <nodes>. 
+    """
+    if not nodes: 
+      return np.empty(0, dtype=np.float32)
+    return self.row_relevance([self.node_index[node.node_id] for node in nodes],
+                              focal_embedding)
+
+
   def get_summarized_latest_events(self, retention): 
-    ret_set = set()
-    for e_node in self.seq_event[:retention]: 
-      ret_set.add(e_node.spo_summary())
-    return ret_set
+    return set(self.latest_event_summaries(retention))
+
+
+  def latest_event_summaries(self, retention): 
+    """
+    The SPO summaries of the latest <retention> events, as a live view that
+    follows later add_event calls; membership tests are O(1). 
+    """
+    if retention not in self.recent_spo: 
+      self.recent_spo[retention] = collections.Counter(
+        e_node.spo_summary() for e_node in self.seq_event.latest(retention))
+    return self.recent_spo[retention].keys()
 
 
   def get_str_seq_events(self): 
@@ -0,0 +1,196 @@
+"""
+File: embedding_store.py
+Description: Binary on-disk store for the embeddings of an associative
+memory, used in place of embeddings.json. The vectors live in a raw float32
+(or float16) matrix that is opened with numpy.memmap, next to a key file with
+one JSON-encoded key per line (the key of row i on line i). Saving appends
+the new rows to both files in place instead of rewriting them. A folder that
+only has embeddings.json is migrated on first load, and migrated again
+(keeping the rows saved since) if embeddings.json changes afterwards.
+
+Files in the memory folder:
+  embeddings_meta.json   {"dim": 1536, "dtype": "float32",
+                          "source": [mtime_ns, size] of embeddings.json}
+  embeddings.bin         rows x dim matrix, row-major
+  embeddings_keys.jsonl  one key per row
+"""
+
+import collections.abc
+import json
+import os
+import shutil
+
+import numpy as np
+
+META_FILE = "embeddings_meta.json"
+DATA_FILE = "embeddings.bin"
+KEYS_FILE = "embeddings_keys.jsonl"
+JSON_FILE = "embeddings.json"
+
+DTYPES = ["float32", "float16"]
+
+
+def has_binary_store(folder):
+    return os.path.exists(os.path.join(folder, META_FILE))
+
+
+def json_signature(folder):
+    """[mtime_ns, size] of the embeddings.json in <folder>, or None."""
+    try:
+        stat = os.stat(os.path.join(folder, JSON_FILE))
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def is_stale(folder):
+    """
+    Whether the embeddings.json in <folder> has changed since the binary
+    store there was written.
+    """
+    source = json_signature(folder)
+    if source is None:
+        return False
+    with open(os.path.join(folder, META_FILE), "r") as f:
+        return json.load(f).get("source") != source
+
+
+def write_meta(folder, dim, dtype):
+    with open(os.path.join(folder, META_FILE), "w") as f:
+        json.dump({"dim": dim, "dtype": dtype, "source": json_signature(folder)}, f)
+
+
+def write_binary_store(folder, embeddings, dtype="float32"):
+    """Writes <embeddings> (key -> vector) to <folder> in the binary layout."""
+    keys = list(embeddings.keys())
+    dim = len(embeddings[keys[0]]) if keys else None
+    with open(os.path.join(folder, DATA_FILE), "wb") as f:
+        for key in keys:
+            f.write(np.asarray(embeddings[key], dtype=dtype).tobytes())
+    with open(os.path.join(folder, KEYS_FILE), "w") as f:
+        for key in keys:
+            f.write(json.dumps(key) + "\n")
+    write_meta(folder, dim, dtype)
+
+
+class EmbeddingStore(collections.abc.MutableMapping):
+    """
+    Dict-like view of a binary embedding store (key -> list of floats, like
+    the dictionary loaded from embeddings.json). Reads come from the memmap;
+    new or changed vectors are kept in memory until save().
+    """
+
+    def __init__(self, folder, dtype="float32"):
+        if not has_binary_store(folder) or is_stale(folder):
+            embeddings = dict()
+            if has_binary_store(folder):
+                # Keep the rows saved to the binary store; embeddings.json
+                # wins for the keys it has.
+                self._open(folder)
+                embeddings = {key: self[key] for key in self.index}
+                self.matrix = None
+            json_path = os.path.join(folder, JSON_FILE)
+            if os.path.exists(json_path):
+                with open(json_path, "r") as f:
+                    embeddings.update(json.load(f))
+            write_binary_store(folder, embeddings, dtype)
+        self._open(folder)
+
+    def _open(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, META_FILE), "r") as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        self.dtype = np.dtype(meta["dtype"])
+
+        with open(os.path.join(folder, KEYS_FILE), "r") as f:
+            keys = [json.loads(line) for line in f if line.strip()]
+        # Rows are written before their keys, so a save that was cut short
+        # leaves at most some unreferenced rows behind.
+        rows = len(keys)
+        if self.dim:
+            data_rows = os.path.getsize(os.path.join(folder, DATA_FILE)) // (
+                self.dim * self.dtype.itemsize
+            )
+            rows = min(rows, data_rows)
+        self.index = {key: row for row, key in enumerate(keys[:rows])}
+        self.rows = rows
+
+        self.matrix = None
+        if rows:
+            self.matrix = np.memmap(
+                os.path.join(folder, DATA_FILE),
+                dtype=self.dtype,
+                mode="r",
+                shape=(rows, self.dim),
+            )
+        self.pending = dict()
+
+    def __getitem__(self, key):
+        if key in self.pending:
+            return self.pending[key]
+        return self.matrix[self.index[key]].astype(np.float32).tolist()
+
+    def __setitem__(self, key, value):
+        row = self.index.get(key)
+        if row is not None and np.array_equal(
+            self.matrix[row], np.asarray(value, dtype=self.dtype)
+        ):
+            self.pending.pop(key, None)
+            return
+        self.pending[key] = value
+
+    def __delitem__(self, key):
+        raise TypeError("Embeddings cannot be removed from an EmbeddingStore")
+
+    def __contains__(self, key):
+        return key in self.pending or key in self.index
+
+    def __iter__(self):
+        yield from self.index
+        for key in self.pending:
+            if key not in self.index:
+                yield key
+
+    def __len__(self):
+        return len(self.index) + sum(1 for key in self.pending if key not in self.index)
+
+    def save(self, folder):
+        """
+        Writes the pending vectors to <folder>. New keys are appended to the
+        data and key files; changed vectors are overwritten in place. Saving
+        to another folder first copies the store's files there.
+        """
+        if os.path.abspath(folder) != os.path.abspath(self.folder):
+            os.makedirs(folder, exist_ok=True)
+            for name in [DATA_FILE, KEYS_FILE]:
+                shutil.copyfile(os.path.join(self.folder, name), os.path.join(folder, name))
+            write_meta(folder, self.dim, self.dtype.name)
+
+        if self.dim is None and self.pending:
+            self.dim = len(next(iter(self.pending.values())))
+            write_meta(folder, self.dim, self.dtype.name)
+
+        data_path = os.path.join(folder, DATA_FILE)
+        changed = {key: value for key, value in self.pending.items() if key in self.index}
+        if changed:
+            matrix = np.memmap(data_path, dtype=self.dtype, mode="r+", shape=(self.rows, self.dim))
+            for key, value in changed.items():
+                matrix[self.index[key]] = np.asarray(value, dtype=self.dtype)
+            matrix.flush()
+            del matrix
+
+        new_keys = [key for key in self.pending if key not in self.index]
+        if new_keys:
+            # Truncate any rows left behind by an interrupted save, so the
+            # data and key files stay aligned.
+            with open(data_path, "r+b") as f:
+                f.truncate(self.rows * self.dim * self.dtype.itemsize)
+                f.seek(0, os.SEEK_END)
+                for key in new_keys:
+                    f.write(np.asarray(self.pending[key], dtype=self.dtype).tobytes())
+            with open(os.path.join(folder, KEYS_FILE), "a") as f:
+                for key in new_keys:
+                    f.write(json.dumps(key) + "\n")
+
+        self._open(folder)
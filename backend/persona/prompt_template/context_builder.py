@@ -0,0 +1,95 @@
+"""
+File: context_builder.py
+Description: Token-budgeted assembly of the retrieved-statements section of
+prompts. Retrieved memories are added in order of retrieval score until the
+prompt's token budget is spent, so prompt size stops growing with the size of
+a persona's memory. Token counts use the same local estimate as the rate
+limiters, and every cut is recorded.
+"""
+
+import threading
+
+from backend.utils import *
+from backend.persona.prompt_template.rate_limiter import estimate_tokens
+
+# Token budget of the retrieved-statements section, per prompt. Prompts not
+# listed are not truncated.
+DEFAULT_CONTEXT_BUDGETS = {
+    "iterative_convo_v1.txt": 1000,
+    "insight_and_evidence_v1.txt": 1000,
+    "revise_identity": 2000,
+}
+
+
+def rank_scores(retrieved):
+    """
+    Stand-in scores for the output of new_retrieve when the retrieval scores
+    were not kept: each node scores minus its rank under its focal point.
+    RETURNS:
+      A list of scores in the order of the flattened <retrieved> values.
+    """
+    return [-rank for nodes in retrieved.values() for rank in range(len(nodes))]
+
+
+class PromptContextBuilder:
+    def __init__(self, budgets=None):
+        self.budgets = dict(DEFAULT_CONTEXT_BUDGETS)
+        self.budgets.update(prompt_context_budgets if budgets is None else budgets)
+        self._lock = threading.Lock()
+        self.prompts = dict()
+
+    def select(self, name, lines, scores):
+        """
+        Picks which of <lines> (the statements of prompt <name>) fit its token
+        budget, highest <scores> first; a line that does not fit is skipped
+        and smaller, lower-scored lines may still be added.
+        RETURNS:
+          The indices of the kept lines, in their original order.
+        """
+        tokens = [estimate_tokens(line) for line in lines]
+        budget = self.budgets.get(name)
+        if budget is None or sum(tokens) <= budget:
+            kept = list(range(len(lines)))
+        else:
+            kept = []
+            remaining = budget
+            for i in sorted(range(len(lines)), key=lambda i: -scores[i]):
+                if tokens[i] <= remaining:
+                    kept += [i]
+                    remaining -= tokens[i]
+            kept.sort()
+        self._record(name, tokens, kept)
+        return kept
+
+    def _record(self, name, tokens, kept):
+        dropped = len(tokens) - len(kept)
+        with self._lock:
+            entry = self.prompts.setdefault(
+                name,
+                {
+                    "calls": 0,
+                    "truncated_calls": 0,
+                    "lines_in": 0,
+                    "lines_dropped": 0,
+                    "tokens_in": 0,
+                    "tokens_dropped": 0,
+                },
+            )
+            entry["calls"] += 1
+            entry["truncated_calls"] += 1 if dropped else 0
+            entry["lines_in"] += len(tokens)
+            entry["lines_dropped"] += dropped
+            entry["tokens_in"] += sum(tokens)
+            entry["tokens_dropped"] += sum(tokens) - sum(tokens[i] for i in kept)
+        if debug and dropped:
+            print(f"Context of {name} truncated: dropped {dropped} of {len(tokens)} statements")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "budgets": dict(self.budgets),
+                "prompts": {name: dict(entry) for name, entry in self.prompts.items()},
+            }
+
+
+prompt_context = PromptContextBuilder()
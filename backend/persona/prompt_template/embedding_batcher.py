@@ -0,0 +1,94 @@
+"""
+File: embedding_batcher.py
+Description: Micro-batching collector for embedding requests. Single-text
+requests that arrive within a short window are merged into one provider call,
+and identical texts waiting in the same window share one slot in the batch.
+"""
+
+import asyncio
+
+from backend.utils import *
+
+
+class EmbeddingBatcher:
+    """
+    Collects concurrent single-text embedding requests on the LLM loop and
+    sends them as one batched request per model.
+
+    <embed_fn> is an async function taking (texts, model) and returning the
+    list of embeddings in the same order. A batch is flushed <window> seconds
+    after its first request arrives, or as soon as it reaches <max_batch>
+    distinct texts.
+    """
+
+    def __init__(self, embed_fn, window=embedding_batch_window, max_batch=embedding_max_batch):
+        self.embed_fn = embed_fn
+        self.window = window
+        self.max_batch = max_batch
+
+        # model -> {text: future}
+        self._pending = dict()
+        # model -> asyncio.TimerHandle
+        self._timers = dict()
+
+        self.requests = 0
+        self.coalesced = 0
+        self.batches = 0
+
+    async def embed(self, text, model):
+        """Returns the embedding of <text>. Must run on the LLM loop."""
+        self.requests += 1
+        if self.window <= 0:
+            self.batches += 1
+            return (await self.embed_fn([text], model))[0]
+
+        loop = asyncio.get_running_loop()
+        batch = self._pending.setdefault(model, dict())
+        if text in batch:
+            self.coalesced += 1
+            future = batch[text]
+        else:
+            future = loop.create_future()
+            batch[text] = future
+            if len(batch) >= self.max_batch:
+                self._flush(model)
+            elif model not in self._timers:
+                self._timers[model] = loop.call_later(self.window, self._flush, model)
+
+        # Shielded so that one cancelled caller does not cancel the shared
+        # result for the other callers waiting on the same text.
+        return await asyncio.shield(future)
+
+    def _flush(self, model):
+        timer = self._timers.pop(model, None)
+        if timer:
+            timer.cancel()
+        batch = self._pending.pop(model, None)
+        if batch:
+            self.batches += 1
+            asyncio.ensure_future(self._send(model, batch))
+
+    async def _send(self, model, batch):
+        texts = list(batch.keys())
+        try:
+            embeddings = await self.embed_fn(texts, model)
+            if len(embeddings) != len(texts):
+                raise ValueError(
+                    f"Embedding request for {len(texts)} texts returned "
+                    f"{len(embeddings)} embeddings"
+                )
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for text, embedding in zip(texts, embeddings):
+            if not batch[text].done():
+                batch[text].set_result(embedding)
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+        }
@@ -0,0 +1,243 @@
+"""
+File: endpoint_pool.py
+Description: Pools of OpenAI-compatible endpoints per provider, with health
+scoring and hedged requests. A request goes to the healthiest endpoint; if it
+has not answered once the endpoint's recent latency percentile has passed, a
+duplicate is sent to the next endpoint, the first answer wins and the other
+request is cancelled. A provider with a single endpoint (the default) sends
+every request straight through.
+"""
+
+import asyncio
+import collections
+import os
+import time
+
+from backend.utils import *
+from backend.persona.prompt_template.llm_client import *
+
+# Latencies kept per endpoint for the hedge percentile.
+LATENCY_WINDOW = 200
+# Below this many samples the hedge waits <llm_hedge_max_delay>.
+MIN_LATENCY_SAMPLES = 20
+# Weight of the newest request in the latency and error averages.
+EWMA_ALPHA = 0.2
+# Consecutive failures after which an endpoint is ranked last for a while.
+FAILURE_THRESHOLD = 3
+FAILURE_COOLDOWN = 30
+
+
+class LLMEndpoint:
+    """One base_url/api_key pair and its health."""
+
+    def __init__(self, name, base_url, api_key):
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.latency_ewma = None
+        self.error_ewma = 0.0
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.wins = 0
+
+    @property
+    def client(self):
+        return llm_pool.client_for(self.base_url, self.api_key)
+
+    def on_success(self, latency):
+        self.latencies.append(latency)
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma += EWMA_ALPHA * (latency - self.latency_ewma)
+        self.error_ewma *= 1 - EWMA_ALPHA
+        self.consecutive_failures = 0
+
+    def on_failure(self):
+        self.errors += 1
+        self.error_ewma += EWMA_ALPHA * (1 - self.error_ewma)
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= FAILURE_THRESHOLD:
+            self.down_until = time.monotonic() + FAILURE_COOLDOWN
+
+    def health_score(self):
+        """Lower is better: expected latency inflated by the error rate."""
+        if time.monotonic() < self.down_until:
+            return float("inf")
+        latency = self.latency_ewma if self.latency_ewma is not None else 0.0
+        return latency * (1 + 4 * self.error_ewma) + self.error_ewma
+
+    def latency_percentile(self, percentile):
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        latencies = sorted(self.latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+        return round(latencies[index], 4)
+
+    def stats(self):
+        return {
+            "base_url": self.base_url,
+            "health_score": round(self.health_score(), 4),
+            "latency_ewma": round(self.latency_ewma, 4) if self.latency_ewma else None,
+            "latency_p50": self.latency_percentile(50),
+            "latency_p95": self.latency_percentile(95),
+            "error_rate": round(self.error_ewma, 4),
+            "requests": self.requests,
+            "errors": self.errors,
+            "wins": self.wins,
+            "cancelled": self.cancelled,
+        }
+
+
+class EndpointPool:
+    """The endpoints of one provider, tried healthiest first."""
+
+    def __init__(
+        self,
+        provider,
+        endpoints,
+        hedge_percentile=llm_hedge_percentile,
+        hedge_min_delay=llm_hedge_min_delay,
+        hedge_max_delay=llm_hedge_max_delay,
+    ):
+        self.provider = provider
+        self.endpoints = endpoints
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    def ranked(self):
+        return sorted(self.endpoints, key=lambda e: e.health_score())
+
+    def hedge_delay(self, endpoint):
+        """How long to wait for <endpoint> before sending a hedged duplicate."""
+        delay = endpoint.latency_percentile(self.hedge_percentile)
+        if delay is None:
+            return self.hedge_max_delay
+        return min(self.hedge_max_delay, max(self.hedge_min_delay, delay))
+
+    async def _send(self, endpoint, request, acquire=None):
+        endpoint.requests += 1
+        try:
+            # Time spent waiting for the endpoint's rate limiter is not
+            # latency of the endpoint.
+            if acquire is not None:
+                await acquire(endpoint)
+            start = time.perf_counter()
+            result = await request(endpoint)
+        except asyncio.CancelledError:
+            endpoint.cancelled += 1
+            raise
+        except Exception:
+            endpoint.on_failure()
+            raise
+        endpoint.on_success(time.perf_counter() - start)
+        return result
+
+    async def request(self, request, acquire=None):
+        """
+        Sends <request> (a coroutine function taking an LLMEndpoint) to the
+        healthiest endpoint, hedging to the next one if it is slow and failing
+        over to it if it errors first. <acquire> (a coroutine function taking
+        an LLMEndpoint), if given, is awaited before each attempt and is not
+        counted as endpoint latency. Raises the primary's error if no endpoint
+        succeeds. Must run on the LLM loop.
+        """
+        ranked = self.ranked()
+        primary = ranked[0]
+        if len(ranked) == 1:
+            result = await self._send(primary, request, acquire)
+            primary.wins += 1
+            return result
+
+        tasks = {asyncio.ensure_future(self._send(primary, request, acquire)): primary}
+        done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay(primary))
+        first = next(iter(tasks))
+        failed_over = bool(done) and first.exception() is not None
+        if not done or failed_over:
+            secondary = ranked[1]
+            if failed_over:
+                self.failovers += 1
+            else:
+                self.hedged += 1
+            tasks[asyncio.ensure_future(self._send(secondary, request, acquire))] = secondary
+
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        winner = tasks[task]
+                        winner.wins += 1
+                        if winner is not primary and not failed_over:
+                            self.hedge_wins += 1
+                        return task.result()
+            # Every endpoint failed; report the primary's error.
+            return first.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        return {
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "endpoints": {endpoint.name: endpoint.stats() for endpoint in self.endpoints},
+        }
+
+
+def _default_endpoints(provider):
+    if provider == "openrouter":
+        return [{"name": "openrouter", "base_url": openrouter_base_url, "api_key": openrouter_api_key}]
+    elif provider == "openai":
+        return [{"name": "openai", "base_url": openai_base_url, "api_key": openai_api_key}]
+    raise ValueError(f"Unknown LLM provider: {provider}")
+
+
+class EndpointPoolRegistry:
+    """
+    One EndpointPool per provider. The endpoints of a provider come from
+    LLM_ENDPOINTS, e.g.
+      {"openrouter": [
+        {"name": "openrouter", "base_url": "https://openrouter.ai/api/v1",
+         "api_key_env": "OPENROUTER_API_KEY"},
+        {"name": "backup", "base_url": "https://...", "api_key": "..."}]}
+    and default to the provider's single configured endpoint.
+    """
+
+    def __init__(self, endpoints=None):
+        self.endpoints = llm_endpoints if endpoints is None else endpoints
+        self.pools = dict()
+
+    def get(self, provider):
+        if provider not in self.pools:
+            configs = self.endpoints.get(provider) or _default_endpoints(provider)
+            self.pools[provider] = EndpointPool(
+                provider,
+                [
+                    LLMEndpoint(
+                        config.get("name", f"{provider}-{i}"),
+                        config["base_url"],
+                        config.get("api_key") or os.environ.get(config.get("api_key_env", "")),
+                    )
+                    for i, config in enumerate(configs)
+                ],
+            )
+        return self.pools[provider]
+
+    def stats(self):
+        return {provider: pool.stats() for provider, pool in self.pools.items()}
+
+
+endpoint_pools = EndpointPoolRegistry()
@@ -5,6 +5,7 @@ File: gpt_structure.py
 Description: Wrapper functions for calling OpenAI APIs.
 """
 
+import asyncio
 import json
 import random
 import openai
@@ -16,40 +17,156 @@ import os
 sys.path.append(os.path.join(os.path.dirname(__file__), "../../../"))
 from backend.utils import *
 
-# Create separate clients for OpenRouter and OpenAI
-openrouter_client = openai.OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=openrouter_api_key,
-)
+from backend.persona.prompt_template.llm_client import *
+from backend.persona.prompt_template.endpoint_pool import *
+from backend.persona.prompt_template.llm_cache import *
+from backend.persona.prompt_template.embedding_batcher import *
+from backend.persona.prompt_template.rate_limiter import *
+from backend.persona.prompt_template.llm_recorder import *
+from backend.persona.prompt_template.single_flight import *
+from backend.persona.prompt_template.retry_policy import *
+from backend.persona.prompt_template.prompt_templates import *
+from backend.persona.prompt_template.prompt_metrics import *
+from backend.persona.prompt_template.model_router import *
+
+# All requests go through the pooled async clients in llm_client.py: one
+# keep-alive pool per endpoint, shared by every caller. Each provider
+# ("openrouter" for chat, "openai" for the legacy completions and embeddings
+# endpoints) has a pool of endpoints with hedging in endpoint_pool.py. The
+# sync functions below are thin wrappers that block on the async variants.
+# Pacing comes from the adaptive per-model rate limiters in rate_limiter.py;
+# transport errors and rate limits are retried with backoff, behind a
+# per-model circuit breaker, by retry_policy.py.
+
+
+# Model of the "default" routing tier. Requests made on behalf of a prompt
+# template use the model of the template's tier instead (model_router.py).
+chat_model = model_router.default.model
+
+
+def _cache_lookup(prompt_template, model, prompt, params=None):
+    """
+    Looks up a previously validated response in the on-disk LLM cache.
+    RETURNS:
+      (cache_key, cached_response). cache_key is None when <prompt_template>
+      is not opted into caching; cached_response is None on a miss.
+    """
+    # Recorded runs bypass the cache so the recording holds every request
+    # and replay does not depend on what the cache held at record time.
+    if llm_recorder.mode != "off" or not llm_cache.accepts(prompt_template):
+        return None, None
+    cache_key = llm_cache.make_key(model, prompt, params)
+    return cache_key, llm_cache.get(cache_key, prompt_template)
+
+
+def _parse_json_output(gpt_response):
+    """Extracts the "output" field from a JSON-formatted chat response."""
+    gpt_response = gpt_response.strip()
+    end_index = gpt_response.rfind("}") + 1
+    return json.loads(gpt_response[:end_index])["output"]
 
-# Keep OpenAI client for embeddings (more reliable and cost-effective)
-openai_client = openai.OpenAI(api_key=openai_api_key)
 
+async def _rate_limited(provider, model, est_tokens, request):
+    """
+    Sends <request> (a coroutine function taking an AsyncOpenAI client) to
+    the endpoint pool of <provider>, which may hedge it across endpoints.
+    Every attempt waits until the rate limiter of its endpoint/<model> and a
+    request slot allow it, and feeds the outcome back into the limiter. Raises on any API error;
+    must run on the LLM loop.
+    """
 
-def temp_sleep(seconds=0.1):
-    time.sleep(seconds)
+    # Both waits happen in acquire(), before the endpoint pool starts timing
+    # the attempt; send() releases the request slot taken there.
+    async def acquire(endpoint):
+        await rate_limits.get(endpoint.name, model).acquire(est_tokens)
+        await llm_pool.slot().acquire()
 
+    async def send(endpoint):
+        limiter = rate_limits.get(endpoint.name, model)
+        try:
+            response = await request(endpoint.client)
+        except openai.RateLimitError as e:
+            limiter.on_rate_limited(get_retry_after(e))
+            raise
+        finally:
+            llm_pool.slot().release()
+        usage = getattr(response, "usage", None)
+        limiter.on_success(est_tokens, getattr(usage, "total_tokens", None))
+        return response
 
-def ChatGPT_single_request(prompt):
-    temp_sleep()
+    return await endpoint_pools.get(provider).request(send, acquire)
 
-    try:
-        completion = openrouter_client.chat.completions.create(
-            model="meta-llama/llama-3.3-8b-instruct:free",
+
+async def _chat_completion(prompt, route=None, call=None):
+    """
+    Single-turn chat completion with the model, timeout and max_tokens of
+    <route> (a ModelRoute; the default tier if None). Identical prompts
+    already in flight share one request. Retries and token usage are reported
+    to <call> (a PromptCall), if given. Raises an LLMError once retries are
+    exhausted; must run on the LLM loop.
+    """
+    route = route or model_router.default
+    return await single_flight.do(
+        "chat",
+        (route.model, route.max_tokens, prompt),
+        lambda: call_with_retry(
+            route.model,
+            lambda: _send_chat_completion(prompt, route, call),
+            on_retry=call.on_retry if call else None,
+        ),
+    )
+
+
+async def _send_chat_completion(prompt, route, call=None):
+    """
+    Sends a single-turn chat completion through the OpenRouter endpoint pool.
+    Raises on any API error; must run on the LLM loop.
+    """
+    model = route.model
+    record_key = llm_recorder.make_key("chat", model, prompt)
+    if llm_recorder.replaying:
+        return llm_recorder.replay(record_key)
+
+    options = dict()
+    if route.max_tokens is not None:
+        options["max_tokens"] = route.max_tokens
+    if route.timeout is not None:
+        options["timeout"] = route.timeout
+    completion = await _rate_limited(
+        "openrouter",
+        model,
+        estimate_tokens(prompt) + (route.max_tokens or 0),
+        lambda client: client.chat.completions.create(
+            model=model,
             messages=[{"role": "user", "content": prompt}],
-        )
-        return completion.choices[0].message.content
+            **options,
+        ),
+    )
+    if call is not None:
+        call.on_usage(model, getattr(completion, "usage", None))
+    content = completion.choices[0].message.content
+    llm_recorder.record(record_key, content)
+    return content
+
+
+async def ChatGPT_single_request_async(prompt):
+    try:
+        return await llm_pool.await_on_loop(_chat_completion(prompt))
     except Exception as e:
         print(f"ChatGPT_single_request ERROR: {e}")
         return "ChatGPT ERROR"
 
 
+def ChatGPT_single_request(prompt):
+    return run_llm(ChatGPT_single_request_async(prompt))
+
+
 # ============================================================================
 # #####################[SECTION 1: CHATGPT-3 STRUCTURE] ######################
 # ============================================================================
 
 
-def GPT4_request(prompt):
+async def GPT4_request_async(prompt):
     """
     Given a prompt and a dictionary of GPT parameters, make a request to OpenAI
     server and returns the response.
@@ -61,21 +178,19 @@ def GPT4_request(prompt):
     RETURNS:
       a str of GPT-3's response.
     """
-    temp_sleep()
-
     try:
-        completion = openrouter_client.chat.completions.create(
-            model="meta-llama/llama-3.3-8b-instruct:free",
-            messages=[{"role": "user", "content": prompt}],
-        )
-        return completion.choices[0].message.content
+        return await llm_pool.await_on_loop(_chat_completion(prompt))
 
     except Exception as e:
         print(f"GPT4_request ERROR: {e}")
         return "ChatGPT ERROR"
 
 
-def ChatGPT_request(prompt):
+def GPT4_request(prompt):
+    return run_llm(GPT4_request_async(prompt))
+
+
+async def ChatGPT_request_async(prompt):
     """
     Given a prompt and a dictionary of GPT parameters, make a request to OpenAI
     server and returns the response.
@@ -87,19 +202,18 @@ def ChatGPT_request(prompt):
     RETURNS:
       a str of GPT-3's response.
     """
-    # temp_sleep()
     try:
-        completion = openrouter_client.chat.completions.create(
-            model="meta-llama/llama-3.3-8b-instruct:free",
-            messages=[{"role": "user", "content": prompt}],
-        )
-        return completion.choices[0].message.content
+        return await llm_pool.await_on_loop(_chat_completion(prompt))
 
     except Exception as e:
         print(f"ChatGPT_request ERROR: {e}")
         return "ChatGPT ERROR"
 
 
+def ChatGPT_request(prompt):
+    return run_llm(ChatGPT_request_async(prompt))
+
+
 def GPT4_safe_generate_response(
     prompt,
     example_output,
@@ -109,6 +223,7 @@ def GPT4_safe_generate_response(
     func_validate=None,
     func_clean_up=None,
     verbose=False,
+    prompt_template=None,
 ):
     prompt = 'GPT-3 Prompt:\n"""\n' + prompt + '\n"""\n'
     prompt += (
@@ -121,16 +236,37 @@ def GPT4_safe_generate_response(
         print("CHAT GPT PROMPT")
         print(prompt)
 
+    route = model_router.route(prompt_template)
+    call = prompt_metrics.start(prompt_template)
+    cache_key, cached = _cache_lookup(prompt_template, route.model, prompt, route.cache_params())
+    if cached is not None:
+        try:
+            curr_gpt_response = _parse_json_output(cached)
+            if func_validate(curr_gpt_response, prompt=prompt):
+                call.finish("cached")
+                return func_clean_up(curr_gpt_response, prompt=prompt)
+        except Exception:
+            pass
+
     for i in range(repeat):
+        try:
+            raw_gpt_response = run_llm(_chat_completion(prompt, route, call))
+        except LLMError as e:
+            # Transport errors and rate limits were already retried with
+            # backoff; fail fast instead of burning the remaining repeats.
+            print(f"GPT4_safe_generate_response ERROR: {e}")
+            call.finish("fail_safe")
+            return fail_safe_response
 
         try:
-            curr_gpt_response = GPT4_request(prompt).strip()
-            end_index = curr_gpt_response.rfind("}") + 1
-            curr_gpt_response = curr_gpt_response[:end_index]
-            curr_gpt_response = json.loads(curr_gpt_response)["output"]
+            curr_gpt_response = _parse_json_output(raw_gpt_response)
 
             if func_validate(curr_gpt_response, prompt=prompt):
-                return func_clean_up(curr_gpt_response, prompt=prompt)
+                output = func_clean_up(curr_gpt_response, prompt=prompt)
+                if cache_key:
+                    llm_cache.put(cache_key, raw_gpt_response, route.model, prompt_template)
+                call.finish("ok")
+                return output
 
             if verbose:
                 print("---- repeat count: \n", i, curr_gpt_response)
@@ -139,13 +275,14 @@ def GPT4_safe_generate_response(
 
         except Exception as e:
             if verbose:
-                print(f"GPT4_safe_generate_response attempt {i} failed: {e}")
-            pass
+                print(f"GPT4_safe_generate_response attempt {i} invalid: {e}")
+        call.on_validation_failure()
 
+    call.finish("failed")
     return False
 
 
-def ChatGPT_safe_generate_response(
+async def ChatGPT_safe_generate_response_async(
     prompt,
     example_output,
     special_instruction,
@@ -154,6 +291,7 @@ def ChatGPT_safe_generate_response(
     func_validate=None,
     func_clean_up=None,
     verbose=False,
+    prompt_template=None,
 ):
     # prompt = 'GPT-3 Prompt:\n"""\n' + prompt + '\n"""\n'
     prompt = '"""\n' + prompt + '\n"""\n'
@@ -167,20 +305,47 @@ def ChatGPT_safe_generate_response(
         print("CHAT GPT PROMPT")
         print(prompt)
 
+    route = model_router.route(prompt_template)
+    call = prompt_metrics.start(prompt_template)
+    # This runs on the LLM loop, so the cache's SQLite I/O goes to a worker
+    # thread instead of blocking every request in flight.
+    cache_key, cached = await asyncio.to_thread(
+        _cache_lookup, prompt_template, route.model, prompt, route.cache_params()
+    )
+    if cached is not None:
+        try:
+            curr_gpt_response = _parse_json_output(cached)
+            if func_validate(curr_gpt_response, prompt=prompt):
+                call.finish("cached")
+                return func_clean_up(curr_gpt_response, prompt=prompt)
+        except Exception:
+            pass
+
     for i in range(repeat):
+        try:
+            raw_gpt_response = await llm_pool.await_on_loop(_chat_completion(prompt, route, call))
+        except LLMError as e:
+            # Transport errors and rate limits were already retried with
+            # backoff; fail fast instead of burning the remaining repeats.
+            print(f"ChatGPT_safe_generate_response ERROR: {e}")
+            call.finish("fail_safe")
+            return fail_safe_response
 
         try:
-            curr_gpt_response = ChatGPT_request(prompt).strip()
-            end_index = curr_gpt_response.rfind("}") + 1
-            curr_gpt_response = curr_gpt_response[:end_index]
-            curr_gpt_response = json.loads(curr_gpt_response)["output"]
+            curr_gpt_response = _parse_json_output(raw_gpt_response)
 
             # print ("---ashdfaf")
             # print (curr_gpt_response)
             # print ("000asdfhia")
 
             if func_validate(curr_gpt_response, prompt=prompt):
-                return func_clean_up(curr_gpt_response, prompt=prompt)
+                output = func_clean_up(curr_gpt_response, prompt=prompt)
+                if cache_key:
+                    await asyncio.to_thread(
+                        llm_cache.put, cache_key, raw_gpt_response, route.model, prompt_template
+                    )
+                call.finish("ok")
+                return output
 
             if verbose:
                 print("---- repeat count: \n", i, curr_gpt_response)
@@ -189,12 +354,39 @@ def ChatGPT_safe_generate_response(
 
         except Exception as e:
             if verbose:
-                print(f"ChatGPT_safe_generate_response attempt {i} failed: {e}")
-            pass
+                print(f"ChatGPT_safe_generate_response attempt {i} invalid: {e}")
+        call.on_validation_failure()
 
+    call.finish("failed")
     return False
 
 
+def ChatGPT_safe_generate_response(
+    prompt,
+    example_output,
+    special_instruction,
+    repeat=3,
+    fail_safe_response="error",
+    func_validate=None,
+    func_clean_up=None,
+    verbose=False,
+    prompt_template=None,
+):
+    return run_llm(
+        ChatGPT_safe_generate_response_async(
+            prompt,
+            example_output,
+            special_instruction,
+            repeat,
+            fail_safe_response,
+            func_validate,
+            func_clean_up,
+            verbose,
+            prompt_template,
+        )
+    )
+
+
 def ChatGPT_safe_generate_response_OLD(
     prompt,
     repeat=3,
@@ -202,16 +394,37 @@ def ChatGPT_safe_generate_response_OLD(
     func_validate=None,
     func_clean_up=None,
     verbose=False,
+    prompt_template=None,
 ):
     if verbose:
         print("CHAT GPT PROMPT")
         print(prompt)
 
+    route = model_router.route(prompt_template)
+    call = prompt_metrics.start(prompt_template)
+    cache_key, cached = _cache_lookup(prompt_template, route.model, prompt, route.cache_params())
+    if cached is not None:
+        try:
+            if func_validate(cached, prompt=prompt):
+                call.finish("cached")
+                return func_clean_up(cached, prompt=prompt)
+        except Exception:
+            pass
+
     for i in range(repeat):
         try:
-            curr_gpt_response = ChatGPT_request(prompt).strip()
+            curr_gpt_response = run_llm(_chat_completion(prompt, route, call)).strip()
+        except LLMError as e:
+            print(f"ChatGPT_safe_generate_response_OLD ERROR: {e}")
+            break
+
+        try:
             if func_validate(curr_gpt_response, prompt=prompt):
-                return func_clean_up(curr_gpt_response, prompt=prompt)
+                output = func_clean_up(curr_gpt_response, prompt=prompt)
+                if cache_key:
+                    llm_cache.put(cache_key, curr_gpt_response, route.model, prompt_template)
+                call.finish("ok")
+                return output
             if verbose:
                 print(f"---- repeat count: {i}")
                 print(curr_gpt_response)
@@ -219,9 +432,10 @@ def ChatGPT_safe_generate_response_OLD(
 
         except Exception as e:
             if verbose:
-                print(f"ChatGPT_safe_generate_response_OLD attempt {i} failed: {e}")
-            pass
+                print(f"ChatGPT_safe_generate_response_OLD attempt {i} invalid: {e}")
+        call.on_validation_failure()
     print("FAIL SAFE TRIGGERED")
+    call.finish("fail_safe")
     return fail_safe_response
 
 
@@ -230,22 +444,41 @@ def ChatGPT_safe_generate_response_OLD(
 # ============================================================================
 
 
-def GPT_request(prompt, gpt_parameter):
+async def _text_completion(prompt, gpt_parameter, call=None, timeout=None):
     """
-    Given a prompt and a dictionary of GPT parameters, make a request to OpenAI
-    server and returns the response.
-    ARGS:
-      prompt: a str prompt
-      gpt_parameter: a python dictionary with the keys indicating the names of
-                     the parameter and the values indicating the parameter
-                     values.
-    RETURNS:
-      a str of GPT-3's response.
+    Legacy completions request, optionally with a request <timeout> in
+    seconds. Identical requests already in flight share one request. Retries
+    and token usage are reported to <call> (a PromptCall), if given. Raises
+    an LLMError once retries are exhausted; must run on the LLM loop.
     """
-    temp_sleep()
-    try:
-        # Use the legacy completions endpoint for older GPT-3 style requests
-        response = openai_client.completions.create(
+    return await single_flight.do(
+        "completion",
+        (prompt, json.dumps(gpt_parameter, sort_keys=True)),
+        lambda: call_with_retry(
+            gpt_parameter["engine"],
+            lambda: _send_text_completion(prompt, gpt_parameter, call, timeout),
+            on_retry=call.on_retry if call else None,
+        ),
+    )
+
+
+async def _send_text_completion(prompt, gpt_parameter, call=None, timeout=None):
+    """
+    Sends a legacy completions request through the OpenAI endpoint pool.
+    Raises on any API error; must run on the LLM loop.
+    """
+    record_key = llm_recorder.make_key("completion", prompt, gpt_parameter)
+    if llm_recorder.replaying:
+        return llm_recorder.replay(record_key)
+
+    options = dict()
+    if timeout is not None:
+        options["timeout"] = timeout
+    response = await _rate_limited(
+        "openai",
+        gpt_parameter["engine"],
+        estimate_tokens(prompt) + gpt_parameter["max_tokens"],
+        lambda client: client.completions.create(
             model=gpt_parameter["engine"],
             prompt=prompt,
             temperature=gpt_parameter["temperature"],
@@ -255,11 +488,41 @@ def GPT_request(prompt, gpt_parameter):
             presence_penalty=gpt_parameter["presence_penalty"],
             stream=gpt_parameter["stream"],
             stop=gpt_parameter["stop"],
-        )
-        return response.choices[0].text
-    except Exception as e:
-        print(f"GPT_request ERROR: {e}")
-        return "TOKEN LIMIT EXCEEDED"
+            **options,
+        ),
+    )
+    if call is not None:
+        call.on_usage(gpt_parameter["engine"], getattr(response, "usage", None))
+    text = response.choices[0].text
+    llm_recorder.record(record_key, text)
+    return text
+
+
+async def GPT_request_async(prompt, gpt_parameter, call=None, timeout=None):
+    """
+    Given a prompt and a dictionary of GPT parameters, make a request to OpenAI
+    server and returns the response.
+    ARGS:
+      prompt: a str prompt
+      gpt_parameter: a python dictionary with the keys indicating the names of
+                     the parameter and the values indicating the parameter
+                     values.
+      call: optional PromptCall that retries and token usage are reported to.
+      timeout: optional request timeout in seconds.
+    RETURNS:
+      a str of GPT-3's response.
+    RAISES:
+      LLMError (LLMTransportError, LLMRateLimitError, LLMRequestError or
+      CircuitOpenError) if no response could be obtained.
+    """
+    # Use the legacy completions endpoint for older GPT-3 style requests
+    return await llm_pool.await_on_loop(
+        _text_completion(prompt, gpt_parameter, call, timeout)
+    )
+
+
+def GPT_request(prompt, gpt_parameter, call=None, timeout=None):
+    return run_llm(GPT_request_async(prompt, gpt_parameter, call, timeout))
 
 
 def generate_prompt(curr_input, prompt_lib_file):
@@ -280,14 +543,8 @@ def generate_prompt(curr_input, prompt_lib_file):
         curr_input = [curr_input]
     curr_input = [str(i) for i in curr_input]
 
-    f = open(prompt_lib_file, "r")
-    prompt = f.read()
-    f.close()
-    for count, i in enumerate(curr_input):
-        prompt = prompt.replace(f"!<INPUT {count}>!", i)
-    if "<commentblockmarker>###</commentblockmarker>" in prompt:
-        prompt = prompt.split("<commentblockmarker>###</commentblockmarker>")[1]
-    return prompt.strip()
+    # Templates are read and compiled once; see prompt_templates.py.
+    return prompt_templates.get(prompt_lib_file).render(curr_input)
 
 
 def safe_generate_response(
@@ -298,37 +555,175 @@ def safe_generate_response(
     func_validate=None,
     func_clean_up=None,
     verbose=False,
+    prompt_template=None,
 ):
     if verbose:
         print(prompt)
 
+    route = model_router.route(prompt_template)
+    gpt_parameter = route.completion_parameters(gpt_parameter)
+    call = prompt_metrics.start(prompt_template)
+    cache_key, cached = _cache_lookup(
+        prompt_template, gpt_parameter["engine"], prompt, gpt_parameter
+    )
+    if cached is not None:
+        try:
+            if func_validate(cached, prompt=prompt):
+                call.finish("cached")
+                return func_clean_up(cached, prompt=prompt)
+        except Exception:
+            pass
+
     for i in range(repeat):
-        curr_gpt_response = GPT_request(prompt, gpt_parameter)
+        try:
+            curr_gpt_response = GPT_request(prompt, gpt_parameter, call, route.timeout)
+        except LLMError as e:
+            # Transport errors and rate limits were already retried with
+            # backoff; fail fast instead of burning the remaining repeats.
+            print(f"safe_generate_response ERROR: {e}")
+            break
         if func_validate(curr_gpt_response, prompt=prompt):
-            return func_clean_up(curr_gpt_response, prompt=prompt)
+            output = func_clean_up(curr_gpt_response, prompt=prompt)
+            if cache_key:
+                llm_cache.put(
+                    cache_key, curr_gpt_response, gpt_parameter["engine"], prompt_template
+                )
+            call.finish("ok")
+            return output
+        call.on_validation_failure()
         if verbose:
             print("---- repeat count: ", i, curr_gpt_response)
             print(curr_gpt_response)
             print("~~~~")
+    call.finish("fail_safe")
     return fail_safe_response
 
 
-def get_embedding(text, model="text-embedding-ada-002"):
+async def _embed(texts, model):
     """
-    Get embedding using OpenAI's embedding API (more reliable than OpenRouter for embeddings)
+    Embeds a list of texts in one request. Raises an LLMError once retries
+    are exhausted; must run on the LLM loop.
     """
+    return await call_with_retry(model, lambda: _send_embed(texts, model))
+
+
+async def _send_embed(texts, model):
+    """
+    Embeds a list of texts in one request through the OpenAI endpoint pool.
+    Raises on any API error; must run on the LLM loop.
+    """
+    # Embeddings are recorded per text, so replay does not depend on how
+    # requests happened to be batched during the recording.
+    record_keys = [llm_recorder.make_key("embedding", model, i) for i in texts]
+    if llm_recorder.replaying:
+        return [llm_recorder.replay_embedding(i) for i in record_keys]
+
+    response = await _rate_limited(
+        "openai",
+        model,
+        estimate_tokens(texts),
+        lambda client: client.embeddings.create(input=texts, model=model),
+    )
+    embeddings = [row.embedding for row in response.data]
+    for record_key, embedding in zip(record_keys, embeddings):
+        llm_recorder.record_embedding(record_key, embedding)
+    return embeddings
+
+
+embedding_batcher = EmbeddingBatcher(_embed)
+
+
+def _clean_embedding_input(text):
     text = text.replace("\n", " ")
     if not text:
         text = "this is blank"
+    return text
+
+
+async def get_embedding_async(text, model="text-embedding-ada-002", known=None):
+    """
+    Get embedding using OpenAI's embedding API (more reliable than OpenRouter for embeddings)
+
+    Concurrent calls are merged into one provider request by the micro-batching
+    collector, and a text that is already in flight is not sent again. If
+    <text>, cleaned as it would be sent, is already a key of <known> (e.g.,
+    the persona's a_mem.embeddings), that embedding is returned without a
+    request.
+    """
+    text = _clean_embedding_input(text)
+    if known is not None and text in known:
+        return known[text]
+
+    async def request():
+        if llm_recorder.replaying:
+            # Nothing to gain from batching when there is no network.
+            return (await _embed([text], model))[0]
+        return await embedding_batcher.embed(text, model)
+
     try:
-        response = openai_client.embeddings.create(input=[text], model=model)
-        return response.data[0].embedding
+        return await llm_pool.await_on_loop(
+            single_flight.do("embedding", (model, text), request)
+        )
     except Exception as e:
         print(f"Embedding ERROR: {e}")
         # Return a dummy embedding vector if the API call fails
         return [0.0] * 1536  # text-embedding-ada-002 returns 1536 dimensions
 
 
+def get_embedding(text, model="text-embedding-ada-002", known=None):
+    return run_llm(get_embedding_async(text, model, known))
+
+
+async def get_embeddings_async(texts, model="text-embedding-ada-002", known=None):
+    """
+    Embeds a list of texts with as few provider requests as possible.
+
+    Texts are cleaned as in get_embedding_async. Texts that are already keys
+    of <known> (e.g., the persona's a_mem.embeddings) are answered from it,
+    and duplicates within <texts> are sent once. The rest go out in chunks of at most <embedding_max_batch>
+    texts, which are sent concurrently.
+    RETURNS:
+      a list of embeddings in the same order as <texts>.
+    """
+    texts = [_clean_embedding_input(text) for text in texts]
+    out = dict()
+    to_send = []
+    for text in texts:
+        if text in out:
+            continue
+        if known is not None and text in known:
+            out[text] = known[text]
+        else:
+            out[text] = None
+            to_send += [text]
+
+    async def embed_chunk(chunk):
+        try:
+            return await llm_pool.await_on_loop(
+                _embed(chunk, model)
+            )
+        except Exception as e:
+            print(f"Embedding ERROR: {e}")
+            return [[0.0] * 1536 for i in chunk]
+
+    chunks = [
+        to_send[i : i + embedding_max_batch]
+        for i in range(0, len(to_send), embedding_max_batch)
+    ]
+    results = await asyncio.gather(*[embed_chunk(chunk) for chunk in chunks])
+    for chunk, embeddings in zip(chunks, results):
+        for text, embedding in zip(chunk, embeddings):
+            out[text] = embedding
+
+    return [out[text] for text in texts]
+
+
+def get_embeddings(texts, model="text-embedding-ada-002", known=None):
+    if not texts:
+        return []
+    return run_llm(get_embeddings_async(texts, model, known))
+
+
 if __name__ == "__main__":
     gpt_parameter = {
         "engine": "text-davinci-003",
@@ -0,0 +1,192 @@
+"""
+File: llm_cache.py
+Description: Persistent, content-addressed cache of validated LLM responses.
+Entries are keyed by the model, the full rendered prompt and the sampling
+parameters, and live in a single SQLite file so they survive restarts and
+repeated simulation days.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from backend.utils import *
+
+
+class LLMResponseCache:
+    """
+    SQLite-backed response cache with TTL expiry and size-based LRU eviction.
+
+    Only prompts rendered from an opted-in template (see <templates>) are
+    cached; everything else is passed through untouched. Hit and miss counts
+    are kept both globally and per template.
+    """
+
+    def __init__(
+        self,
+        path=llm_cache_path,
+        ttl=llm_cache_ttl,
+        max_entries=llm_cache_max_entries,
+        max_bytes=llm_cache_max_bytes,
+        templates=llm_cache_templates,
+        enabled=llm_cache_enabled,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.templates = set(templates)
+        self.enabled = enabled
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.template_stats = dict()
+
+        self._lock = threading.Lock()
+        self._conn = None
+        self._n_entries = 0
+        self._n_bytes = 0
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " model TEXT,"
+                " template TEXT,"
+                " response TEXT,"
+                " size INTEGER,"
+                " created REAL,"
+                " last_access REAL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_access"
+                " ON responses (last_access)"
+            )
+            conn.commit()
+            n_entries, n_bytes = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            self._n_entries = n_entries
+            self._n_bytes = n_bytes
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def make_key(model, prompt, params=None):
+        """
+        Content address of a request: sha256 over the model, the full rendered
+        prompt, and the sampling parameters.
+        """
+        raw = json.dumps([model, prompt, params or {}], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def accepts(self, prompt_template):
+        """True if responses for <prompt_template> should be cached."""
+        if not self.enabled or not prompt_template:
+            return False
+        return os.path.basename(prompt_template) in self.templates
+
+    def _count(self, prompt_template, field):
+        name = os.path.basename(prompt_template or "")
+        stats = self.template_stats.setdefault(name, {"hits": 0, "misses": 0})
+        stats[field] += 1
+
+    def get(self, key, prompt_template=None):
+        """
+        Returns the cached response for <key>, or None on a miss. Expired
+        entries are dropped on read.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT response, size, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row and self.ttl and now - row[2] > self.ttl:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                conn.commit()
+                self._n_entries -= 1
+                self._n_bytes -= row[1]
+                row = None
+
+            if row is None:
+                self.misses += 1
+                self._count(prompt_template, "misses")
+                return None
+
+            conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (now, key)
+            )
+            conn.commit()
+            self.hits += 1
+            self._count(prompt_template, "hits")
+            return row[0]
+
+    def put(self, key, response, model=None, prompt_template=None):
+        """Stores <response> under <key> and evicts LRU entries if needed."""
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            conn = self._connect()
+            old = conn.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, prompt_template, response, size, now, now),
+            )
+            if old:
+                self._n_bytes -= old[0]
+            else:
+                self._n_entries += 1
+            self._n_bytes += size
+            self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn):
+        while self._n_entries > self.max_entries or self._n_bytes > self.max_bytes:
+            # Drop the least recently used tenth (at least one row) at a time.
+            batch = max(1, self._n_entries // 10)
+            rows = conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT ?",
+                (batch,),
+            ).fetchall()
+            if not rows:
+                break
+            conn.executemany(
+                "DELETE FROM responses WHERE key = ?", [(k,) for k, _ in rows]
+            )
+            self._n_entries -= len(rows)
+            self._n_bytes -= sum(size for _, size in rows)
+            self.evictions += len(rows)
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+            self._n_entries = 0
+            self._n_bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": self._n_entries,
+            "bytes": self._n_bytes,
+            "templates": {k: dict(v) for k, v in self.template_stats.items()},
+        }
+
+
+llm_cache = LLMResponseCache()
@@ -0,0 +1,173 @@
+"""
+File: llm_client.py
+Description: Asyncio-native client layer behind gpt_structure.py. Every LLM
+and embedding request runs on one background event loop, so all callers --
+sync cognitive modules running in worker threads as well as async handlers --
+share a single keep-alive connection pool per endpoint and a single
+concurrency limit.
+"""
+
+import asyncio
+import threading
+
+import httpx
+import openai
+
+from backend.utils import *
+
+
+class LLMClientPool:
+    """
+    Owns the background event loop that all LLM traffic runs on, the pooled
+    AsyncOpenAI clients (one per endpoint), and the semaphore that bounds how
+    many requests are in flight at once.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=llm_max_concurrency,
+        max_connections=llm_max_connections,
+        max_keepalive_connections=llm_max_keepalive_connections,
+        keepalive_expiry=llm_keepalive_expiry,
+    ):
+        self.max_concurrency = max_concurrency
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+        self._clients = dict()
+
+    # ------------------------------------------------------------------
+    # Event loop
+    # ------------------------------------------------------------------
+
+    @property
+    def loop(self):
+        """The background event loop; started on first use."""
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    self._start_loop()
+        return self._loop
+
+    def _start_loop(self):
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            started.set()
+            loop.run_forever()
+
+        thread = threading.Thread(target=run, name="llm-client-loop", daemon=True)
+        thread.start()
+        started.wait()
+        self._thread = thread
+        self._loop = loop
+
+    def in_loop_thread(self):
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, coro):
+        """
+        Schedules <coro> on the LLM loop from any thread and returns a
+        concurrent.futures.Future for its result.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro):
+        """
+        Runs <coro> on the LLM loop and blocks the calling thread until it
+        finishes. Must not be called from the LLM loop itself.
+        """
+        if self.in_loop_thread():
+            coro.close()
+            raise RuntimeError(
+                "Blocking LLM call made from the LLM event loop; "
+                "await the *_async variant instead."
+            )
+        return self.submit(coro).result()
+
+    async def await_on_loop(self, coro):
+        """
+        Awaits <coro> on the LLM loop from any event loop. Lets async code
+        running on another loop (e.g., the FastAPI server loop) use the shared
+        pool without binding it to its own loop.
+        """
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            return await coro
+        return await asyncio.wrap_future(self.submit(coro))
+
+    # ------------------------------------------------------------------
+    # Clients and concurrency
+    # ------------------------------------------------------------------
+
+    def client_for(self, base_url, api_key):
+        """
+        Returns the pooled AsyncOpenAI client of one endpoint (see
+        endpoint_pool.py). Clients are created lazily so a missing key only
+        fails the requests that need it.
+        """
+        key = (base_url, api_key)
+        if key not in self._clients:
+            with self._lock:
+                if key not in self._clients:
+                    self._clients[key] = self._create_client(base_url, api_key)
+        return self._clients[key]
+
+    def _create_client(self, base_url, api_key):
+        http_client = openai.DefaultAsyncHttpxClient(limits=self.limits)
+        # The SDK's own retries are turned off so that 429s reach the rate
+        # limiters in rate_limiter.py instead of being retried blindly.
+        return openai.AsyncOpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            http_client=http_client,
+            max_retries=0,
+        )
+
+    def slot(self):
+        """
+        Async context manager (an asyncio.Semaphore, so acquire()/release()
+        work too) that holds one of the <max_concurrency> request slots. Only
+        usable from the LLM loop.
+        """
+        return self._semaphore
+
+
+llm_pool = LLMClientPool()
+
+
+def run_llm(coro):
+    """
+    Runs a coroutine on the shared LLM loop and returns its result. This is
+    how the blocking wrappers in gpt_structure.py reach the async layer.
+    """
+    return llm_pool.run(coro)
+
+
+def run_llm_concurrently(*coros):
+    """
+    Runs several coroutines on the shared LLM loop at the same time and
+    returns their results in order. Use this to overlap independent prompts
+    from sync code, e.g.:
+      pron, event = run_llm_concurrently(
+        ChatGPT_safe_generate_response_async(...),
+        get_embedding_async(...))
+    """
+
+    async def gather():
+        return await asyncio.gather(*coros)
+
+    return llm_pool.run(gather())
@@ -0,0 +1,142 @@
+"""
+File: llm_recorder.py
+Description: Record/replay of LLM and embedding traffic. In record mode every
+response that comes back from a provider is appended to a compact JSON-lines
+file; in replay mode responses are served back from that file by request hash
+with no network access, so a recorded Persona.move trajectory can be rerun at
+CPU speed.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import threading
+from array import array
+
+from backend.utils import *
+
+
+class ReplayMissError(LookupError):
+    """Raised in replay mode for a request that was never recorded."""
+
+
+class LLMRecorder:
+    """
+    Append-only recording of provider responses, keyed by request hash.
+
+    <mode> is "off", "record" or "replay". The same request may be recorded
+    several times with different responses (sampled prompts, retries); on
+    replay they are served back in recorded order, and the last one is
+    repeated once they run out.
+
+    File format: one JSON object per line, {"k": <key>, "v": <text>} for
+    completions and {"k": <key>, "e": <base64 float32>} for embeddings.
+    """
+
+    def __init__(self, path=llm_record_path, mode=llm_record_mode):
+        self.path = path
+        self.mode = mode
+
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._entries = None
+        self._cursor = dict()
+
+    @property
+    def recording(self):
+        return self.mode == "record"
+
+    @property
+    def replaying(self):
+        return self.mode == "replay"
+
+    @staticmethod
+    def make_key(*request):
+        """Hash of everything that identifies a request (kind, model, input, params)."""
+        raw = json.dumps(request, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+    # ------------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------------
+
+    def _append(self, entry):
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+            self.recorded += 1
+
+    def record(self, key, text):
+        if self.recording:
+            self._append({"k": key, "v": text})
+
+    def record_embedding(self, key, embedding):
+        if self.recording:
+            packed = base64.b64encode(array("f", embedding).tobytes()).decode("ascii")
+            self._append({"k": key, "e": packed})
+
+    # ------------------------------------------------------------------
+    # Replay
+    # ------------------------------------------------------------------
+
+    def _load(self):
+        entries = dict()
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A run killed mid-write can leave a partial last line.
+                        continue
+                    entries.setdefault(entry["k"], []).append(entry)
+        self._entries = entries
+
+    def _next(self, key):
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            entries = self._entries.get(key)
+            if not entries:
+                self.misses += 1
+                raise ReplayMissError(f"No recorded response for request {key}")
+            i = self._cursor.get(key, 0)
+            self._cursor[key] = i + 1
+            self.replayed += 1
+            return entries[min(i, len(entries) - 1)]
+
+    def replay(self, key):
+        return self._next(key)["v"]
+
+    def replay_embedding(self, key):
+        embedding = array("f")
+        embedding.frombytes(base64.b64decode(self._next(key)["e"]))
+        return embedding.tolist()
+
+    def rewind(self):
+        """Starts serving every request from its first recorded response again."""
+        with self._lock:
+            self._cursor = dict()
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "path": self.path,
+            "recorded": self.recorded,
+            "replayed": self.replayed,
+            "misses": self.misses,
+        }
+
+
+llm_recorder = LLMRecorder()
@@ -0,0 +1,140 @@
+"""
+File: model_router.py
+Description: Routing table from prompt template to model tier. Each tier
+names a chat model plus its own request timeout and max_tokens, so cheap,
+fast models can serve the high-volume scoring prompts while larger models
+handle planning and conversation. The table is read from the environment
+(LLM_ROUTING, or a JSON file named by LLM_ROUTING_FILE) on top of the
+defaults below.
+"""
+
+import json
+import os
+
+from backend.utils import *
+
+DEFAULT_CHAT_MODEL = "meta-llama/llama-3.3-8b-instruct:free"
+
+# Every tier starts out on the same model; point them at different models
+# through LLM_ROUTING / LLM_ROUTING_FILE. A timeout or max_tokens of None
+# leaves the provider default.
+DEFAULT_ROUTING = {
+    "tiers": {
+        "small": {"model": DEFAULT_CHAT_MODEL, "timeout": None, "max_tokens": None},
+        "default": {"model": DEFAULT_CHAT_MODEL, "timeout": None, "max_tokens": None},
+        "large": {"model": DEFAULT_CHAT_MODEL, "timeout": None, "max_tokens": None},
+    },
+    # Template file name -> tier. Templates not listed use "default".
+    "templates": {
+        "poignancy_event_v1.txt": "small",
+        "poignancy_thought_v1.txt": "small",
+        "poignancy_chat_v1.txt": "small",
+        "generate_pronunciatio_v1.txt": "small",
+        "generate_obj_event_v1.txt": "small",
+        "generate_event_triple_v1.txt": "small",
+        "decide_to_talk_v2.txt": "small",
+        "decide_to_react_v1.txt": "small",
+        "wake_up_hour_v1.txt": "small",
+        "daily_planning_v6.txt": "large",
+        "generate_hourly_schedule_v2.txt": "large",
+        "task_decomp_v3.txt": "large",
+        "new_decomp_schedule_v1.txt": "large",
+        "action_fused_v1.txt": "large",
+        "iterative_convo_v1.txt": "large",
+        "agent_chat_v1.txt": "large",
+        "insight_and_evidence_v1.txt": "large",
+    },
+}
+
+
+class ModelRoute:
+    def __init__(self, tier, model, timeout=None, max_tokens=None):
+        self.tier = tier
+        self.model = model
+        self.timeout = timeout
+        self.max_tokens = max_tokens
+
+    def completion_parameters(self, gpt_parameter):
+        """
+        Applies this route to the gpt_parameter of a legacy completions
+        request. The engine is kept (the legacy endpoint has its own models)
+        and the tier's max_tokens caps the request's; the timeout is passed
+        separately.
+        """
+        if self.max_tokens is None or gpt_parameter["max_tokens"] <= self.max_tokens:
+            return gpt_parameter
+        return dict(gpt_parameter, max_tokens=self.max_tokens)
+
+    def cache_params(self):
+        """
+        The request parameters of this route that change a chat response,
+        for its LLM cache key (None when there are none, so cache entries
+        written before routing stay valid).
+        """
+        if self.max_tokens is None:
+            return None
+        return {"max_tokens": self.max_tokens}
+
+    def stats(self):
+        return {
+            "tier": self.tier,
+            "model": self.model,
+            "timeout": self.timeout,
+            "max_tokens": self.max_tokens,
+        }
+
+
+class ModelRouter:
+    def __init__(self, routing=None):
+        routing = routing or load_routing()
+        self.tiers = {
+            tier: ModelRoute(tier, **settings) for tier, settings in routing["tiers"].items()
+        }
+        self.templates = dict(routing["templates"])
+        for template, tier in self.templates.items():
+            if tier not in self.tiers:
+                raise ValueError(f"Unknown model tier {tier} for template {template}")
+
+    @property
+    def default(self):
+        return self.tiers["default"]
+
+    def route(self, prompt_template):
+        """The ModelRoute for <prompt_template> (a path or file name)."""
+        if not prompt_template:
+            return self.default
+        tier = self.templates.get(os.path.basename(prompt_template), "default")
+        return self.tiers[tier]
+
+    def stats(self):
+        return {
+            "tiers": {tier: route.stats() for tier, route in self.tiers.items()},
+            "templates": dict(self.templates),
+        }
+
+
+def load_routing():
+    """
+    DEFAULT_ROUTING, updated first by the JSON file named in LLM_ROUTING_FILE
+    and then by the JSON in LLM_ROUTING. Both take the same shape as
+    DEFAULT_ROUTING; tiers are updated key by key, e.g.
+      {"tiers": {"small": {"model": "openai/gpt-4o-mini"}},
+       "templates": {"summarize_conversation_v1.txt": "small"}}
+    """
+    routing = {
+        "tiers": {tier: dict(settings) for tier, settings in DEFAULT_ROUTING["tiers"].items()},
+        "templates": dict(DEFAULT_ROUTING["templates"]),
+    }
+    overrides = []
+    if llm_routing_file:
+        with open(llm_routing_file, "r") as f:
+            overrides += [json.load(f)]
+    overrides += [llm_routing]
+    for override in overrides:
+        for tier, settings in override.get("tiers", {}).items():
+            routing["tiers"].setdefault(tier, {"model": DEFAULT_CHAT_MODEL}).update(settings)
+        routing["templates"].update(override.get("templates", {}))
+    return routing
+
+
+model_router = ModelRouter()
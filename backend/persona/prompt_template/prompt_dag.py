@@ -0,0 +1,143 @@
+"""
+File: prompt_dag.py
+Description: Dependency-aware execution of the prompt calls of one cognitive
+step. Each node is a blocking run_gpt_prompt_* style call; nodes whose
+dependencies are done run at the same time in worker threads, and their LLM
+requests still share the global concurrency limit of llm_pool. Every run
+reports its critical-path latency, i.e. the lower bound on its wall time.
+"""
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from backend.utils import *
+
+
+class PromptDAG:
+    """
+    A small DAG of prompt calls, e.g.:
+      dag = PromptDAG("determine_action")
+      dag.add("sector", lambda: generate_action_sector(act_desp, persona, maze))
+      dag.add("arena", lambda sector: generate_action_arena(..., sector),
+              deps=["sector"])
+      results = dag.run()
+
+    A node's function is called with the results of its <deps>, in order.
+    Nodes must be added after their dependencies.
+    """
+
+    def __init__(self, name, max_workers=llm_max_concurrency):
+        self.name = name
+        self.max_workers = max_workers
+        self.nodes = dict()
+        self.report = None
+
+    def add(self, name, func, deps=()):
+        for dep in deps:
+            if dep not in self.nodes:
+                raise ValueError(f"{self.name}: unknown dependency {dep} of {name}")
+        self.nodes[name] = (func, list(deps))
+
+    def _timed(self, func, args):
+        start = time.perf_counter()
+        result = func(*args)
+        return result, start, time.perf_counter()
+
+    def run(self):
+        """
+        Runs every node once its dependencies are done and returns a
+        dictionary of node name to result. The first exception raised by a
+        node is re-raised once the running nodes finish; nodes that have not
+        started yet are skipped.
+        """
+        results = dict()
+        timings = dict()
+        pending = dict(self.nodes)
+        running = dict()
+        start = time.perf_counter()
+
+        workers = max(1, min(self.max_workers, len(self.nodes)))
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=f"prompt-dag-{self.name}"
+        ) as executor:
+            while pending or running:
+                for name, (func, deps) in list(pending.items()):
+                    if all(dep in results for dep in deps):
+                        args = [results[dep] for dep in deps]
+                        running[executor.submit(self._timed, func, args)] = name
+                        del pending[name]
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    # Raises the node's exception; the executor's exit waits
+                    # for the other running nodes.
+                    results[name], node_start, node_end = future.result()
+                    timings[name] = (node_start - start, node_end - start)
+
+        self.report = self._make_report(timings, time.perf_counter() - start)
+        prompt_dag_stats.record(self.report)
+        if debug:
+            print(
+                f"PROMPT DAG <{self.name}>: wall {self.report['wall_sec']}s, "
+                f"critical path {self.report['critical_path_sec']}s "
+                f"({' -> '.join(self.report['critical_path'])}), "
+                f"serial {self.report['serial_sec']}s"
+            )
+        return results
+
+    def _make_report(self, timings, wall):
+        # Longest chain of node durations through the dependency edges.
+        # Nodes were added after their dependencies, so insertion order is a
+        # topological order.
+        durations = {name: end - start for name, (start, end) in timings.items()}
+        path_length = dict()
+        path_prev = dict()
+        for name, (func, deps) in self.nodes.items():
+            prev = max(deps, key=lambda dep: path_length[dep], default=None)
+            path_prev[name] = prev
+            path_length[name] = durations[name] + (path_length[prev] if prev else 0)
+
+        last = max(path_length, key=path_length.get, default=None)
+        critical_path = []
+        while last is not None:
+            critical_path.insert(0, last)
+            last = path_prev[last]
+
+        return {
+            "name": self.name,
+            "wall_sec": round(wall, 4),
+            "serial_sec": round(sum(durations.values()), 4),
+            "critical_path_sec": round(
+                path_length[critical_path[-1]] if critical_path else 0, 4
+            ),
+            "critical_path": critical_path,
+            "nodes": {name: round(sec, 4) for name, sec in durations.items()},
+        }
+
+
+class PromptDAGStats:
+    """Cumulative and most recent run reports, per DAG name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = dict()
+
+    def record(self, report):
+        with self._lock:
+            entry = self.runs.setdefault(
+                report["name"],
+                {"runs": 0, "wall_sec": 0.0, "serial_sec": 0.0, "critical_path_sec": 0.0},
+            )
+            entry["runs"] += 1
+            for key in ["wall_sec", "serial_sec", "critical_path_sec"]:
+                entry[key] = round(entry[key] + report[key], 4)
+            entry["last"] = report
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(entry) for name, entry in self.runs.items()}
+
+
+prompt_dag_stats = PromptDAGStats()
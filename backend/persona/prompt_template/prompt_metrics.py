@@ -0,0 +1,157 @@
+"""
+File: prompt_metrics.py
+Description: Per-template metrics of the safe_generate_response family.
+Each call into a prompt template records its outcome, provider retries,
+validation failures, latency and token usage, so it is possible to see which
+run_gpt_prompt_* functions dominate a step's wall time and token spend.
+"""
+
+import threading
+import time
+
+from backend.utils import *
+
+# Upper bounds (seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float("inf")]
+
+OUTCOMES = ["ok", "cached", "fail_safe", "failed"]
+
+# Counters reported per step by PromptMetrics.step_summary.
+SUMMARY_KEYS = [
+    "retries",
+    "validation_failures",
+    "fail_safe",
+    "prompt_tokens",
+    "completion_tokens",
+    "latency_sec_total",
+]
+
+
+def _bucket_label(bound):
+    return "+inf" if bound == float("inf") else f"<={bound}"
+
+
+class PromptCall:
+    """
+    One call of a safe_generate_response function for one template. Created
+    by PromptMetrics.start and closed with finish().
+    """
+
+    def __init__(self, registry, template):
+        self.registry = registry
+        self.template = template
+        self.start = time.perf_counter()
+        self.retries = 0
+        self.validation_failures = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+
+    def on_retry(self):
+        """Called by call_with_retry before a provider request is retried."""
+        self.retries += 1
+
+    def on_validation_failure(self):
+        self.validation_failures += 1
+
+    def on_usage(self, model, usage):
+        """Adds the token usage of one provider response (may be None)."""
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        price = llm_token_prices.get(model)
+        if price:
+            self.cost += (
+                prompt_tokens * price.get("prompt", 0)
+                + completion_tokens * price.get("completion", 0)
+            ) / 1000
+
+    def finish(self, outcome):
+        """<outcome> is one of OUTCOMES."""
+        self.registry.record(self, outcome, time.perf_counter() - self.start)
+
+
+class PromptMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.templates = dict()
+
+    def start(self, template):
+        return PromptCall(self, template or "<unnamed>")
+
+    def _new_entry(self):
+        entry = {
+            "calls": 0,
+            "retries": 0,
+            "validation_failures": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cost_usd": 0.0,
+            "latency_sec_total": 0.0,
+            "latency_histogram": {_bucket_label(b): 0 for b in LATENCY_BUCKETS},
+        }
+        for outcome in OUTCOMES:
+            entry[outcome] = 0
+        return entry
+
+    def record(self, call, outcome, latency):
+        with self._lock:
+            entry = self.templates.get(call.template)
+            if entry is None:
+                entry = self.templates[call.template] = self._new_entry()
+            entry["calls"] += 1
+            entry[outcome] += 1
+            entry["retries"] += call.retries
+            entry["validation_failures"] += call.validation_failures
+            entry["prompt_tokens"] += call.prompt_tokens
+            entry["completion_tokens"] += call.completion_tokens
+            entry["cost_usd"] += call.cost
+            entry["latency_sec_total"] += latency
+            for bound in LATENCY_BUCKETS:
+                if latency <= bound:
+                    entry["latency_histogram"][_bucket_label(bound)] += 1
+                    break
+
+    def snapshot(self):
+        """A deep copy of the per-template counters."""
+        with self._lock:
+            return {
+                template: dict(entry, latency_histogram=dict(entry["latency_histogram"]))
+                for template, entry in self.templates.items()
+            }
+
+    def stats(self):
+        snapshot = self.snapshot()
+        for entry in snapshot.values():
+            entry["latency_sec_mean"] = round(entry["latency_sec_total"] / entry["calls"], 4)
+            entry["latency_sec_total"] = round(entry["latency_sec_total"], 4)
+            entry["cost_usd"] = round(entry["cost_usd"], 6)
+        return snapshot
+
+    def step_summary(self, before):
+        """
+        Per-template totals accumulated since <before> (a snapshot()), most
+        expensive template first. Attached to the per-step websocket meta.
+        """
+        summary = dict()
+        for template, entry in self.snapshot().items():
+            prev = before.get(template)
+            calls = entry["calls"] - (prev["calls"] if prev else 0)
+            if not calls:
+                continue
+            delta = {key: entry[key] - (prev[key] if prev else 0) for key in SUMMARY_KEYS}
+            summary[template] = {
+                "calls": calls,
+                "retries": delta["retries"],
+                "validation_failures": delta["validation_failures"],
+                "fail_safe": delta["fail_safe"],
+                "tokens": delta["prompt_tokens"] + delta["completion_tokens"],
+                "latency_sec": round(delta["latency_sec_total"], 3),
+            }
+        return dict(sorted(summary.items(), key=lambda i: -i[1]["latency_sec"]))
+
+
+prompt_metrics = PromptMetrics()
@@ -0,0 +1,104 @@
+"""
+File: prompt_templates.py
+Description: In-memory cache of compiled prompt templates behind
+generate_prompt. Each template file is read once, its comment block is
+dropped, and the prompt is pre-split into literal segments and !<INPUT n>!
+slots so rendering is a single join.
+"""
+
+import os
+import re
+import threading
+
+from backend.utils import *
+
+COMMENT_BLOCK_MARKER = "<commentblockmarker>###</commentblockmarker>"
+SLOT_PATTERN = re.compile(r"!<INPUT (\d+)>!")
+
+# Template paths in run_gpt_prompt.py are relative to backend/.
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PROMPT_TEMPLATE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class CompiledTemplate:
+    """
+    A prompt template split into alternating literal segments and slot
+    indices: segments[0], slots[0], segments[1], slots[1], ..., segments[-1].
+    """
+
+    def __init__(self, text):
+        # Placeholders in the comment block are never rendered, so only the
+        # prompt after the marker is compiled.
+        if COMMENT_BLOCK_MARKER in text:
+            text = text.split(COMMENT_BLOCK_MARKER)[1]
+        parts = SLOT_PATTERN.split(text)
+        self.segments = parts[0::2]
+        self.slots = [int(i) for i in parts[1::2]]
+
+    def render(self, curr_input):
+        """
+        Fills slot n with curr_input[n]. Slots without a matching input are
+        left as their !<INPUT n>! placeholder, as str.replace would.
+        """
+        n_inputs = len(curr_input)
+        out = [self.segments[0]]
+        for slot, segment in zip(self.slots, self.segments[1:]):
+            out += [curr_input[slot] if slot < n_inputs else f"!<INPUT {slot}>!", segment]
+        return "".join(out).strip()
+
+
+class PromptTemplateCache:
+    """
+    Compiled templates keyed by the path they are requested with. With
+    <hot_reload> on, a template is recompiled when its file's mtime changes,
+    so prompt edits show up without restarting the server.
+    """
+
+    def __init__(self, hot_reload=prompt_template_hot_reload):
+        self.hot_reload = hot_reload
+        self._lock = threading.Lock()
+        self._templates = dict()
+
+    @staticmethod
+    def resolve(path):
+        """Finds <path> relative to the working directory or else backend/."""
+        if os.path.isabs(path) or os.path.exists(path):
+            return path
+        return os.path.join(BACKEND_DIR, path)
+
+    def _load(self, path):
+        resolved = self.resolve(path)
+        mtime = os.path.getmtime(resolved)
+        with open(resolved, "r") as f:
+            template = CompiledTemplate(f.read())
+        self._templates[path] = (template, resolved, mtime)
+        return template
+
+    def get(self, path):
+        entry = self._templates.get(path)
+        if entry is not None:
+            template, resolved, mtime = entry
+            if not self.hot_reload or os.path.getmtime(resolved) == mtime:
+                return template
+        with self._lock:
+            return self._load(path)
+
+    def preload(self, template_dir=PROMPT_TEMPLATE_DIR):
+        """
+        Compiles every .txt template under <template_dir> up front, keyed the
+        way run_gpt_prompt.py refers to them ("persona/prompt_template/...").
+        Returns the number of templates loaded.
+        """
+        count = 0
+        for root, _, files in os.walk(template_dir):
+            for file_name in sorted(files):
+                if not file_name.endswith(".txt"):
+                    continue
+                path = os.path.relpath(os.path.join(root, file_name), BACKEND_DIR)
+                with self._lock:
+                    self._load(path.replace(os.sep, "/"))
+                count += 1
+        return count
+
+
+prompt_templates = PromptTemplateCache()
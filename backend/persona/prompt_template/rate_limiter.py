@@ -0,0 +1,201 @@
+"""
+File: rate_limiter.py
+Description: Adaptive token-bucket rate limiting for LLM and embedding
+requests. Each provider/model pair gets a requests-per-second bucket and a
+tokens-per-minute bucket. The request rate is halved when the provider answers
+429 (honouring Retry-After) and ramps back up while responses are healthy.
+"""
+
+import asyncio
+import time
+
+from backend.utils import *
+
+
+class TokenBucket:
+    """
+    Classic token bucket: holds at most <capacity> tokens and refills at
+    <rate> tokens per second. The level may go negative when a request turns
+    out to cost more than was reserved for it; later requests then wait.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until <amount> tokens are available (0 if they are now)."""
+        # A single request larger than the whole bucket only waits for a full
+        # bucket; otherwise it could never be sent.
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= amount
+
+
+class AdaptiveRateLimiter:
+    """
+    Rate limiter for one provider/model pair. Must be used from the LLM loop.
+
+    <rps> is the ceiling for requests per second and <tpm> the ceiling for
+    tokens per minute (0 disables the token bucket). The current request rate
+    starts at the ceiling; every throttled response multiplies it by
+    <backoff_factor> and every successful one adds <ramp_up> of the ceiling
+    back, never dropping below <min_rps>.
+    """
+
+    def __init__(
+        self,
+        name,
+        rps=llm_rate_limit_rps,
+        tpm=llm_rate_limit_tpm,
+        min_rps=llm_rate_limit_min_rps,
+        backoff_factor=0.5,
+        ramp_up=0.1,
+    ):
+        self.name = name
+        self.max_rps = rps
+        self.min_rps = min(min_rps, rps)
+        self.backoff_factor = backoff_factor
+        self.ramp_up = ramp_up
+
+        self.requests = TokenBucket(rps, max(1.0, rps))
+        self.tokens = TokenBucket(tpm / 60.0, tpm) if tpm else None
+
+        self.blocked_until = 0.0
+        self.n_requests = 0
+        self.n_throttled = 0
+        self.total_wait = 0.0
+        self._lock = None
+
+    @property
+    def rate(self):
+        """The current request rate (requests per second)."""
+        return self.requests.rate
+
+    async def acquire(self, est_tokens=0):
+        """
+        Waits until one request of about <est_tokens> tokens may be sent.
+        Callers queue in arrival order.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        start = time.monotonic()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.requests.refill(now)
+                wait = max(self.blocked_until - now, self.requests.wait_time(1))
+                if self.tokens:
+                    self.tokens.refill(now)
+                    wait = max(wait, self.tokens.wait_time(est_tokens))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+
+            self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(est_tokens)
+        self.n_requests += 1
+        self.total_wait += time.monotonic() - start
+
+    def on_success(self, est_tokens=0, used_tokens=None):
+        """
+        Records a healthy response. <used_tokens> (from the response usage)
+        corrects the token bucket for what <est_tokens> reserved.
+        """
+        if self.tokens and used_tokens is not None:
+            self.tokens.take(used_tokens - est_tokens)
+        self.requests.rate = min(
+            self.max_rps, self.requests.rate + self.max_rps * self.ramp_up
+        )
+
+    def on_rate_limited(self, retry_after=None):
+        """
+        Records a 429. New requests are held back for <retry_after> seconds
+        (or one interval at the reduced rate if the provider gave none).
+        """
+        self.n_throttled += 1
+        self.requests.rate = max(
+            self.min_rps, self.requests.rate * self.backoff_factor
+        )
+        self.requests.level = min(self.requests.level, 0.0)
+        if retry_after is None:
+            retry_after = 1.0 / self.requests.rate
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    def stats(self):
+        return {
+            "rate_rps": round(self.requests.rate, 3),
+            "max_rps": self.max_rps,
+            "tpm": self.tokens.capacity if self.tokens else None,
+            "requests": self.n_requests,
+            "throttled": self.n_throttled,
+            "avg_wait": self.total_wait / self.n_requests if self.n_requests else 0.0,
+            "blocked_for": max(0.0, self.blocked_until - time.monotonic()),
+        }
+
+
+class RateLimiterRegistry:
+    """
+    Hands out one AdaptiveRateLimiter per provider/model pair. Limits come
+    from <overrides>, looked up by "provider/model" and then by "provider",
+    falling back to the global defaults in utils.py.
+    """
+
+    def __init__(self, overrides=llm_rate_limits):
+        self.overrides = overrides
+        self.limiters = dict()
+
+    def get(self, provider, model):
+        key = f"{provider}/{model}"
+        if key not in self.limiters:
+            limits = self.overrides.get(key, self.overrides.get(provider, {}))
+            self.limiters[key] = AdaptiveRateLimiter(
+                key,
+                rps=limits.get("rps", llm_rate_limit_rps),
+                tpm=limits.get("tpm", llm_rate_limit_tpm),
+            )
+        return self.limiters[key]
+
+    def stats(self):
+        return {key: limiter.stats() for key, limiter in self.limiters.items()}
+
+
+def estimate_tokens(text):
+    """Rough token count of <text> (about four characters per token)."""
+    if isinstance(text, list):
+        return sum(estimate_tokens(i) for i in text)
+    return len(text) // 4 + 1
+
+
+def get_retry_after(error):
+    """
+    Seconds the provider asked us to wait in a 429 response, read from the
+    retry-after-ms or Retry-After header. None if there was no usable header.
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        # Retry-After may also be an HTTP date; fall back to our own backoff.
+        pass
+    return None
+
+
+rate_limits = RateLimiterRegistry()
@@ -0,0 +1,181 @@
+"""
+File: retry_policy.py
+Description: Retry engine for LLM and embedding requests. Provider errors are
+classified into transport errors, rate limits and bad requests; the first two
+are retried with exponential backoff and full jitter, and repeated transport
+failures open a per-model circuit breaker so callers fail fast to their
+fail-safe values during provider outages.
+"""
+
+import asyncio
+import random
+import time
+
+import openai
+
+from backend.utils import *
+
+
+class LLMError(Exception):
+    """Base class of every error raised by the request layer."""
+
+
+class LLMTransportError(LLMError):
+    """Connection problems, timeouts, 5xx and malformed responses. Retryable."""
+
+
+class LLMRateLimitError(LLMError):
+    """HTTP 429 from the provider. Retryable."""
+
+
+class LLMRequestError(LLMError):
+    """The request itself was rejected (4xx other than 429). Not retryable."""
+
+
+class CircuitOpenError(LLMError):
+    """The model's circuit breaker is open; the request was not sent."""
+
+
+def classify_error(e):
+    """Maps an exception raised while sending a request to an LLMError class."""
+    if isinstance(e, LLMError):
+        return type(e)
+    if isinstance(e, openai.RateLimitError):
+        return LLMRateLimitError
+    if isinstance(e, (openai.APIConnectionError, openai.InternalServerError)):
+        return LLMTransportError
+    if isinstance(e, openai.APIStatusError):
+        if e.status_code >= 500:
+            return LLMTransportError
+        return LLMRequestError
+    if isinstance(e, LookupError):
+        # e.g., a request missing from a replay recording.
+        return LLMRequestError
+    # Anything else (timeouts, responses without choices, ...) is treated as
+    # a transient provider problem.
+    return LLMTransportError
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: before retry n (0-based) we sleep a
+    uniformly random time in [0, min(max_delay, base_delay * 2**n)].
+    """
+
+    def __init__(
+        self,
+        max_attempts=llm_retry_attempts,
+        base_delay=llm_retry_base_delay,
+        max_delay=llm_retry_max_delay,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+class CircuitBreaker:
+    """
+    Per-model circuit breaker. Opens after <failure_threshold> consecutive
+    transport failures; while open every request fails immediately. After
+    <reset_timeout> seconds one probe request is let through (half-open): its
+    success closes the breaker, its failure opens it again.
+    """
+
+    def __init__(
+        self,
+        name,
+        failure_threshold=llm_breaker_threshold,
+        reset_timeout=llm_breaker_reset_timeout,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+
+    def check(self):
+        """Raises CircuitOpenError if a request to this model may not be sent."""
+        if self.state == "closed":
+            return
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            return
+        self.rejected += 1
+        raise CircuitOpenError(f"Circuit breaker for {self.name} is {self.state}")
+
+    def on_success(self):
+        self.state = "closed"
+        self.failures = 0
+
+    def on_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+class CircuitBreakerRegistry:
+    def __init__(self):
+        self.breakers = dict()
+
+    def get(self, model):
+        if model not in self.breakers:
+            self.breakers[model] = CircuitBreaker(model)
+        return self.breakers[model]
+
+    def stats(self):
+        return {model: breaker.stats() for model, breaker in self.breakers.items()}
+
+
+async def call_with_retry(model, request, policy=None, on_retry=None):
+    """
+    Sends <request> (a zero-argument coroutine function) to <model>, retrying
+    transport errors and rate limits according to <policy>. <on_retry>, if
+    given, is called before every retry. Raises an LLMError subclass once the
+    request cannot succeed. Must run on the LLM loop.
+    """
+    policy = policy or default_retry_policy
+    breaker = circuit_breakers.get(model)
+    for attempt in range(policy.max_attempts):
+        breaker.check()
+        try:
+            result = await request()
+        except Exception as e:
+            error_class = classify_error(e)
+            if error_class is LLMTransportError:
+                breaker.on_failure()
+            else:
+                # The provider answered (429 or 4xx), so it is reachable.
+                breaker.on_success()
+            retryable = error_class in (LLMTransportError, LLMRateLimitError)
+            if not retryable or attempt == policy.max_attempts - 1:
+                raise error_class(f"{model}: {e}") from e
+            # Rate limits additionally wait out the rate limiter's block
+            # before the retry is sent.
+            if on_retry is not None:
+                on_retry()
+            await asyncio.sleep(policy.backoff(attempt))
+            continue
+        breaker.on_success()
+        return result
+
+
+default_retry_policy = RetryPolicy()
+circuit_breakers = CircuitBreakerRegistry()
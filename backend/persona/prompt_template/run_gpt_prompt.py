@@ -15,6 +15,7 @@ sys.path.append('../../')
 from backend.global_methods import *
 from backend.persona.prompt_template.gpt_structure import *
 from backend.persona.prompt_template.print_prompt import *
+from backend.persona.prompt_template.context_builder import *
 
 def get_random_alphanumeric(i=6, j=6): 
   """
@@ -75,7 +76,8 @@ def run_gpt_prompt_wake_up_hour(persona, test_input=None, verbose=False):
   fail_safe = get_fail_safe()
 
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_template=prompt_template)
   
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -147,7 +149,8 @@ def run_gpt_prompt_daily_plan(persona,
   fail_safe = get_fail_safe()
 
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_template=prompt_template)
   output = ([f"wake up and complete the morning routine at {wake_up_hour}:00 am"]
               + output)
 
@@ -279,7 +282,8 @@ def run_gpt_prompt_generate_hourly_schedule(persona,
   fail_safe = get_fail_safe()
   
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_template=prompt_template)
   
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -437,7 +441,8 @@ def run_gpt_prompt_task_decomp(persona,
   print ("?????")
   print (prompt)
   output = safe_generate_response(prompt, gpt_param, 5, get_fail_safe(),
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_template=prompt_template)
 
   # TODO THERE WAS A BUG HERE... 
   # This is for preventing overflows...
@@ -611,7 +616,8 @@ def run_gpt_prompt_action_sector(action_description,
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_template=prompt_template)
   y = f"{maze.access_tile(persona.scratch.curr_tile)['world']}"
   x = [i.strip() for i in persona.s_mem.get_str_accessible_sectors(y).split(",")]
   if output not in x: 
@@ -708,7 +714,8 @@ def run_gpt_prompt_action_arena(action_description,
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_template=prompt_template)
   print (output)
   # y = f"{act_world}:{act_sector}"
   # x = [i.strip() for i in persona.s_mem.get_str_accessible_sector_arenas(y).split(",")]
@@ -767,7 +774,8 @@ def run_gpt_prompt_action_game_object(action_description,
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_template=prompt_template)
 
   x = [i.strip() for i in persona.s_mem.get_str_accessible_arena_game_objects(temp_address).split(",")]
   if output not in x: 
@@ -835,7 +843,8 @@ def run_gpt_prompt_pronunciatio(action_description, persona, verbose=False):
   special_instruction = "The value for the output must ONLY contain the emojis." ########
   fail_safe = get_fail_safe()
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_template=prompt_template)
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
   # ChatGPT Plugin ===========================================================
@@ -941,7 +950,8 @@ def run_gpt_prompt_event_triple(action_description, persona, verbose=False):
   prompt = generate_prompt(prompt_input, prompt_template)
   fail_safe = get_fail_safe(persona) ########
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_template=prompt_template)
   output = (persona.name, output[0], output[1])
 
   if debug or verbose: 
@@ -1011,7 +1021,8 @@ def run_gpt_prompt_act_obj_desc(act_game_object, act_desp, persona, verbose=Fals
   special_instruction = "The output should ONLY contain the phrase that should go in <fill in>." ########
   fail_safe = get_fail_safe(act_game_object) ########
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_template=prompt_template)
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
   # ChatGPT Plugin ===========================================================
@@ -1074,7 +1085,8 @@ def run_gpt_prompt_act_obj_event_triple(act_game_object, act_obj_desc, persona,
   prompt = generate_prompt(prompt_input, prompt_template)
   fail_safe = get_fail_safe(act_game_object)
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_template=prompt_template)
   output = (act_game_object, output[0], output[1])
 
   if debug or verbose: 
@@ -1087,6 +1099,164 @@ def run_gpt_prompt_act_obj_event_triple(act_game_object, act_obj_desc, persona,
 
 
 
+def run_gpt_prompt_action_fused(action_description, persona, maze, verbose=False):
+  """
+  Resolves the location, emoji, event triple and object state of a new action
+  in one structured JSON response, instead of the eight separate prompts
+  _determine_action would otherwise make. 
+
+  Every field is validated on its own: the location against the persona's
+  spatial memory and <maze.address_tiles>, the rest against the same rules
+  as the single-field prompts. Fields that depend on an invalid field (e.g.,
+  the arena of an invalid sector, or the object state of an invalid object)
+  are dropped too. 
+
+  OUTPUT: 
+    a dictionary with the keys "sector", "arena", "game_object", 
+    "pronunciatio", "event", "act_obj_desc", "act_obj_pronunciatio" and 
+    "act_obj_event". Fields that did not validate are None; the caller falls
+    back to the per-field prompts for those. 
+  """
+  act_world = maze.access_tile(persona.scratch.curr_tile)["world"]
+
+  def get_accessible_sectors(): 
+    # Same filtering as run_gpt_prompt_action_sector (MAR 11 TEMP). 
+    sectors = []
+    for i in persona.s_mem.tree[act_world].keys(): 
+      if "'s house" in i and persona.scratch.last_name not in i: 
+        continue
+      sectors += [i]
+    return sectors
+
+  def get_accessible_arenas(sector): 
+    # Same filtering as run_gpt_prompt_action_arena (MAR 11 TEMP). 
+    arenas = []
+    for i in persona.s_mem.tree[act_world][sector].keys(): 
+      if "'s room" in i and persona.scratch.last_name not in i: 
+        continue
+      arenas += [i]
+    return arenas
+
+  def create_prompt_input(action_description, persona): 
+    locations = []
+    for sector in get_accessible_sectors(): 
+      arenas = []
+      for arena in get_accessible_arenas(sector): 
+        objects = ", ".join(persona.s_mem.tree[act_world][sector][arena])
+        arenas += [f"{arena} [{objects}]"]
+      locations += [f"{sector}: {'; '.join(arenas)}"]
+
+    daily_plan_req = persona.scratch.get_str_daily_plan_req()
+
+    action_description_1 = action_description
+    action_description_2 = action_description
+    if "(" in action_description: 
+      action_description_1 = action_description.split("(")[0].strip()
+      action_description_2 = action_description.split("(")[-1][:-1]
+
+    prompt_input = [persona.scratch.get_str_name(), 
+                    persona.scratch.living_area.split(":")[1],
+                    maze.access_tile(persona.scratch.curr_tile)["sector"],
+                    daily_plan_req,
+                    "\n".join(locations),
+                    persona.scratch.get_str_name(),
+                    action_description_1,
+                    action_description_2,
+                    persona.scratch.get_str_name(),
+                    persona.scratch.get_str_name()]
+    return prompt_input
+
+  def clean_emoji(value): 
+    if not isinstance(value, str) or not value.strip(): 
+      return None
+    return value.strip()[:3]
+
+  def clean_event(value): 
+    if not isinstance(value, list) or len(value) != 2: 
+      return None
+    value = [str(i).strip() for i in value]
+    if not all(value): 
+      return None
+    return value
+
+  def validate_fields(fields): 
+    output = dict.fromkeys(["sector", "arena", "game_object", "pronunciatio", 
+                            "event", "act_obj_desc", "act_obj_pronunciatio", 
+                            "act_obj_event"])
+
+    pron = clean_emoji(fields.get("pronunciatio"))
+    event = clean_event(fields.get("event"))
+    output["pronunciatio"] = pron
+    if event: 
+      output["event"] = (persona.name, event[0], event[1])
+
+    sector = fields.get("sector")
+    if (sector not in get_accessible_sectors()
+        or f"{act_world}:{sector}" not in maze.address_tiles): 
+      return output
+    output["sector"] = sector
+
+    arena = fields.get("arena")
+    arena_address = f"{act_world}:{sector}:{arena}"
+    if (arena not in get_accessible_arenas(sector)
+        or arena_address not in maze.address_tiles): 
+      return output
+    output["arena"] = arena
+
+    game_objects = persona.s_mem.tree[act_world][sector][arena]
+    if not game_objects: 
+      # Mirrors generate_action_game_object for arenas without objects. 
+      output["game_object"] = "<random>"
+      return output
+    game_object = fields.get("game_object")
+    if (game_object not in game_objects
+        or f"{arena_address}:{game_object}" not in maze.address_tiles): 
+      return output
+    output["game_object"] = game_object
+
+    # The object state only makes sense for the object chosen above. 
+    obj_desc = fields.get("object_state")
+    if isinstance(obj_desc, str) and obj_desc.strip(): 
+      obj_desc = obj_desc.strip()
+      if obj_desc[-1] == ".": obj_desc = obj_desc[:-1]
+      output["act_obj_desc"] = obj_desc
+      output["act_obj_pronunciatio"] = clean_emoji(
+                                         fields.get("object_pronunciatio"))
+      obj_event = clean_event(fields.get("object_event"))
+      if obj_event: 
+        output["act_obj_event"] = (game_object, obj_event[0], obj_event[1])
+    return output
+
+  def __chat_func_clean_up(gpt_response, prompt=""): 
+    return validate_fields(extract_first_json_dict(gpt_response))
+
+  def __chat_func_validate(gpt_response, prompt=""): 
+    return isinstance(extract_first_json_dict(gpt_response), dict)
+
+  def get_fail_safe(): 
+    return validate_fields(dict())
+
+  gpt_param = {"engine": "text-davinci-003", "max_tokens": 200, 
+               "temperature": 0, "top_p": 1, "stream": False,
+               "frequency_penalty": 0, "presence_penalty": 0, "stop": None}
+  prompt_template = "persona/prompt_template/v3_ChatGPT/action_fused_v1.txt"
+  prompt_input = create_prompt_input(action_description, persona)
+  prompt = generate_prompt(prompt_input, prompt_template)
+  fail_safe = get_fail_safe()
+  output = ChatGPT_safe_generate_response_OLD(prompt, 3, fail_safe,
+                        __chat_func_validate, __chat_func_clean_up, verbose,
+                        prompt_template=prompt_template)
+
+  if debug or verbose: 
+    print_run_prompts(prompt_template, persona, gpt_param, 
+                      prompt_input, prompt, output)
+
+  return output, [output, prompt, gpt_param, prompt_input, fail_safe]
+
+
+
+
+
 def run_gpt_prompt_new_decomp_schedule(persona, 
                                        main_act_dur, 
                                        truncated_act_dur, 
@@ -1221,7 +1391,8 @@ def run_gpt_prompt_new_decomp_schedule(persona,
   prompt = generate_prompt(prompt_input, prompt_template)
   fail_safe = get_fail_safe(main_act_dur, truncated_act_dur)
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_template=prompt_template)
   
   # print ("* * * * output")
   # print (output)
@@ -1330,7 +1501,8 @@ def run_gpt_prompt_decide_to_talk(persona, target_persona, retrieved,test_input=
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_template=prompt_template)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -1428,7 +1600,8 @@ def run_gpt_prompt_decide_to_react(persona, target_persona, retrieved,test_input
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_template=prompt_template)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -1571,7 +1744,8 @@ def run_gpt_prompt_create_conversation(persona, target_persona, curr_loc,
 
   fail_safe = get_fail_safe(persona, target_persona)
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_template=prompt_template)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -1636,7 +1810,8 @@ def run_gpt_prompt_summarize_conversation(persona, conversation, test_input=None
   special_instruction = "The output must continue the sentence above by filling in the <fill in> tag. Don't start with 'this is a conversation about...' Just finish the sentence but do not miss any important details (including who are chatting)." ########
   fail_safe = get_fail_safe() ########
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_template=prompt_template)
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
   # ChatGPT Plugin ===========================================================
@@ -1705,7 +1880,8 @@ def run_gpt_prompt_extract_keywords(persona, description, test_input=None, verbo
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_template=prompt_template)
 
 
   if debug or verbose: 
@@ -1750,7 +1926,8 @@ def run_gpt_prompt_keyword_to_thoughts(persona, keyword, concept_summary, test_i
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_template=prompt_template)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -1808,7 +1985,8 @@ def run_gpt_prompt_convo_to_thoughts(persona,
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_template=prompt_template)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -1889,7 +2067,8 @@ def run_gpt_prompt_event_poignancy(persona, event_description, test_input=None,
   special_instruction = "The output should ONLY contain ONE integer value on the scale of 1 to 10." ########
   fail_safe = get_fail_safe() ########
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_template=prompt_template)
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
   # ChatGPT Plugin ===========================================================
@@ -1960,7 +2139,8 @@ def run_gpt_prompt_thought_poignancy(persona, event_description, test_input=None
   special_instruction = "The output should ONLY contain ONE integer value on the scale of 1 to 10." ########
   fail_safe = get_fail_safe() ########
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_template=prompt_template)
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
   # ChatGPT Plugin ===========================================================
@@ -2032,7 +2212,8 @@ def run_gpt_prompt_chat_poignancy(persona, event_description, test_input=None, v
   special_instruction = "The output should ONLY contain ONE integer value on the scale of 1 to 10." ########
   fail_safe = get_fail_safe() ########
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_template=prompt_template)
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
   # ChatGPT Plugin ===========================================================
@@ -2108,7 +2289,8 @@ def run_gpt_prompt_focal_pt(persona, statements, n, test_input=None, verbose=Fal
   special_instruction = "Output must be a list of str." ########
   fail_safe = get_fail_safe(n) ########
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_template=prompt_template)
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
   # ChatGPT Plugin ===========================================================
@@ -2127,7 +2309,8 @@ def run_gpt_prompt_focal_pt(persona, statements, n, test_input=None, verbose=Fal
 
   fail_safe = get_fail_safe(n)
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_template=prompt_template)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -2178,7 +2361,8 @@ def run_gpt_prompt_insight_and_guidance(persona, statements, n, test_input=None,
 
   fail_safe = get_fail_safe(n)
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_template=prompt_template)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -2235,7 +2419,8 @@ def run_gpt_prompt_agent_chat_summarize_ideas(persona, target_persona, statement
   special_instruction = 'The output should be a string that responds to the question.' ########
   fail_safe = get_fail_safe() ########
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_template=prompt_template)
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
   # ChatGPT Plugin ===========================================================
@@ -2303,7 +2488,8 @@ def run_gpt_prompt_agent_chat_summarize_relationship(persona, target_persona, st
   special_instruction = 'The output should be a string that responds to the question.' ########
   fail_safe = get_fail_safe() ########
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_template=prompt_template)
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
   # ChatGPT Plugin ===========================================================
@@ -2431,7 +2617,8 @@ def run_gpt_prompt_agent_chat(maze, persona, target_persona,
   special_instruction = 'The output should be a list of list where the inner lists are in the form of ["<Name>", "<Utterance>"].' ########
   fail_safe = get_fail_safe() ########
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_template=prompt_template)
   # print ("HERE END JULY 23 -- ----- ") ########
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
@@ -2512,7 +2699,8 @@ def run_gpt_prompt_summarize_ideas(persona, statements, question, test_input=Non
   special_instruction = 'The output should be a string that responds to the question.' ########
   fail_safe = get_fail_safe() ########
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_template=prompt_template)
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
   # ChatGPT Plugin ===========================================================
@@ -2602,7 +2790,8 @@ def run_gpt_prompt_generate_next_convo_line(persona, interlocutor_desc, prev_con
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_template=prompt_template)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -2642,7 +2831,8 @@ def run_gpt_prompt_generate_whisper_inner_thought(persona, whisper, test_input=N
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_template=prompt_template)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -2679,7 +2869,8 @@ def run_gpt_prompt_planning_thought_on_convo(persona, all_utt, test_input=None,
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_template=prompt_template)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -2731,7 +2922,8 @@ def run_gpt_prompt_memo_on_convo(persona, all_utt, test_input=None, verbose=Fals
   special_instruction = 'The output should ONLY contain a string that summarizes anything interesting that the agent may have noticed' ########
   fail_safe = get_fail_safe() ########
   output = ChatGPT_safe_generate_response(prompt, example_output, special_instruction, 3, fail_safe,
-                                          __chat_func_validate, __chat_func_clean_up, True)
+                                          __chat_func_validate, __chat_func_clean_up, True,
+                                          prompt_template=prompt_template)
   if output != False: 
     return output, [output, prompt, gpt_param, prompt_input, fail_safe]
   # ChatGPT Plugin ===========================================================
@@ -2745,7 +2937,8 @@ def run_gpt_prompt_memo_on_convo(persona, all_utt, test_input=None, verbose=Fals
 
   fail_safe = get_fail_safe()
   output = safe_generate_response(prompt, gpt_param, 5, fail_safe,
-                                   __func_validate, __func_clean_up)
+                                   __func_validate, __func_clean_up,
+                                   prompt_template=prompt_template)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -2787,7 +2980,8 @@ def run_gpt_generate_safety_score(persona, comment, test_input=None, verbose=Fal
   print (prompt)
   fail_safe = get_fail_safe() 
   output = ChatGPT_safe_generate_response_OLD(prompt, 3, fail_safe,
-                        __chat_func_validate, __chat_func_clean_up, verbose)
+                        __chat_func_validate, __chat_func_clean_up, verbose,
+                        prompt_template=prompt_template)
   print (output)
   
   gpt_param = {"engine": "text-davinci-003", "max_tokens": 50, 
@@ -2818,7 +3012,7 @@ def extract_first_json_dict(data_str):
         return None
 
 
-def run_gpt_generate_iterative_chat_utt(maze, init_persona, target_persona, retrieved, curr_context, curr_chat, test_input=None, verbose=False): 
+def run_gpt_generate_iterative_chat_utt(maze, init_persona, target_persona, retrieved, curr_context, curr_chat, test_input=None, verbose=False, scores=None): 
   def create_prompt_input(maze, init_persona, target_persona, retrieved, curr_context, curr_chat, test_input=None):
     persona = init_persona
     prev_convo_insert = "\n"
@@ -2839,10 +3033,19 @@ def run_gpt_generate_iterative_chat_utt(maze, init_persona, target_persona, retr
     curr_arena= f"{maze.access_tile(persona.scratch.curr_tile)['arena']}"
     curr_location = f"{curr_arena} in {curr_sector}"
 
-    retrieved_str = ""
+    # <scores> is the score dictionary filled by new_retrieve; without it,
+    # nodes are ranked by their position under each focal point. 
+    lines = []
     for key, vals in retrieved.items(): 
       for v in vals: 
-        retrieved_str += f"- {v.description}\n"
+        lines += [f"- {v.description}\n"]
+    if scores is None: 
+      line_scores = rank_scores(retrieved)
+    else: 
+      line_scores = [scores[key][v.node_id] 
+                     for key, vals in retrieved.items() for v in vals]
+    kept = prompt_context.select("iterative_convo_v1.txt", lines, line_scores)
+    retrieved_str = "".join(lines[i] for i in kept)
 
 
     convo_str = ""
@@ -2902,7 +3105,8 @@ def run_gpt_generate_iterative_chat_utt(maze, init_persona, target_persona, retr
   print (prompt)
   fail_safe = get_fail_safe() 
   output = ChatGPT_safe_generate_response_OLD(prompt, 3, fail_safe,
-                        __chat_func_validate, __chat_func_clean_up, verbose)
+                        __chat_func_validate, __chat_func_clean_up, verbose,
+                        prompt_template=prompt_template)
   print (output)
   
   gpt_param = {"engine": "text-davinci-003", "max_tokens": 50, 
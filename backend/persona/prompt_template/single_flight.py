@@ -0,0 +1,65 @@
+"""
+File: single_flight.py
+Description: Single-flight deduplication of identical in-flight requests.
+When a request is already being sent, identical requests that arrive before
+it finishes wait for its result instead of going to the provider again.
+"""
+
+import asyncio
+
+
+class SingleFlight:
+    """
+    Tracks in-flight requests by key on the LLM loop. Counts, per request
+    kind, how many calls were made and how many duplicates were saved.
+    """
+
+    def __init__(self):
+        self._inflight = dict()
+        self.calls = dict()
+        self.saved = dict()
+
+    async def do(self, kind, key, request):
+        """
+        Returns the result of <request> (a zero-argument coroutine function).
+        If a request with the same <kind> and <key> is already in flight, its
+        result (or exception) is shared instead. Must run on the LLM loop.
+        """
+        self.calls[kind] = self.calls.get(kind, 0) + 1
+        key = (kind, key)
+        future = self._inflight.get(key)
+        if future is not None:
+            self.saved[kind] = self.saved.get(kind, 0) + 1
+            # Shielded so a cancelled follower does not cancel the leader.
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await request()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Marks the exception as retrieved when nobody else was waiting.
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
+
+    def stats(self):
+        return {
+            kind: {
+                "calls": calls,
+                "saved": self.saved.get(kind, 0),
+                "in_flight": sum(1 for k in self._inflight if k[0] == kind),
+            }
+            for kind, calls in self.calls.items()
+        }
+
+
+single_flight = SingleFlight()
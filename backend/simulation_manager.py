@@ -121,8 +121,8 @@ class SimulationManager:
             # Reinitialize persona
             self._initialize_persona()
 
-    def process_agent_decision(self, env_data):
-        """Process agent cognitive loop and return movement decision"""
+    def process_agent_decision(self, env_data, curr_time=None):
+        """Process agent cognitive loop at curr_time (default: now) and return movement decision"""
         print(f"🔄 Starting cognitive loop for Michael Scott...")
         
         # Ensure we always have a valid position
@@ -150,7 +150,7 @@ class SimulationManager:
             # Get current position from environment data
             agent_data = env_data.get("Michael Scott", {})
             curr_tile = (agent_data.get("x", current_position[0]), agent_data.get("y", current_position[1]))
-            curr_time = datetime.datetime.now()
+            curr_time = curr_time or datetime.datetime.now()
             
             print(f"🎯 Input to persona.move(): curr_tile={curr_tile}, curr_time={curr_time}")
             
@@ -1,5 +1,6 @@
 # backend/utils.py
 
+import json
 import os
 from dotenv import load_dotenv
 
@@ -24,5 +25,168 @@ fs_temp_storage = "../frontend/temp_storage"
 
 collision_block_id = "1"
 
+# LLM client pool
+# <llm_max_concurrency> caps how many LLM and embedding requests can be in
+# flight at once, across all personas and cognitive modules.
+llm_max_concurrency = int(os.environ.get("LLM_MAX_CONCURRENCY", 8))
+# Keep-alive connection pool shared by every request to the same provider.
+llm_max_connections = int(os.environ.get("LLM_MAX_CONNECTIONS", 20))
+llm_max_keepalive_connections = int(os.environ.get("LLM_MAX_KEEPALIVE_CONNECTIONS", 10))
+llm_keepalive_expiry = float(os.environ.get("LLM_KEEPALIVE_EXPIRY", 30))
+
 # Verbose
 debug = True
+
+# LLM response cache
+# Validated responses for opted-in prompt templates are stored on disk, keyed
+# by model, full rendered prompt and sampling parameters.
+llm_cache_enabled = os.environ.get("LLM_CACHE", "1") == "1"
+llm_cache_path = os.environ.get(
+    "LLM_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "simulation", "llm_cache.sqlite3"),
+)
+llm_cache_ttl = float(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 60 * 60))
+llm_cache_max_entries = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 50000))
+llm_cache_max_bytes = int(os.environ.get("LLM_CACHE_MAX_MB", 256)) * 1024 * 1024
+# Templates whose outputs only depend on the rendered prompt. Only these are
+# cached; sampling-heavy prompts (plans, conversations) are left out.
+llm_cache_templates = [
+    i.strip()
+    for i in os.environ.get(
+        "LLM_CACHE_TEMPLATES",
+        "poignancy_event_v1.txt,poignancy_thought_v1.txt,poignancy_chat_v1.txt,"
+        "generate_pronunciatio_v1.txt,generate_event_triple_v1.txt,"
+        "generate_obj_event_v1.txt,action_location_sector_v1.txt,"
+        "action_location_object_vMar11.txt,action_object_v2.txt",
+    ).split(",")
+    if i.strip()
+]
+
+# Embedding batching
+# Single-text embedding requests arriving within <embedding_batch_window>
+# seconds of each other are merged into one provider call of at most
+# <embedding_max_batch> texts. A window of 0 sends every request on its own.
+embedding_batch_window = float(os.environ.get("EMBEDDING_BATCH_WINDOW", 0.01))
+embedding_max_batch = int(os.environ.get("EMBEDDING_MAX_BATCH", 64))
+
+# LLM rate limiting
+# Every provider/model pair gets a requests-per-second and a tokens-per-minute
+# bucket (a tpm of 0 disables the token bucket). The request rate is halved
+# on HTTP 429, never below <llm_rate_limit_min_rps>, and ramps back up to the
+# ceiling while responses are healthy. Per-model ceilings can be set in
+# LLM_RATE_LIMITS as JSON keyed by "provider/model" or "provider", e.g.
+#   {"openai/text-embedding-ada-002": {"rps": 50, "tpm": 1000000}}
+llm_rate_limit_rps = float(os.environ.get("LLM_RATE_LIMIT_RPS", 5))
+llm_rate_limit_tpm = int(os.environ.get("LLM_RATE_LIMIT_TPM", 0))
+llm_rate_limit_min_rps = float(os.environ.get("LLM_RATE_LIMIT_MIN_RPS", 0.2))
+llm_rate_limits = json.loads(os.environ.get("LLM_RATE_LIMITS", "{}"))
+
+# LLM endpoints
+# Point these at the local stand-in server (llm_stub_server.py) to run the
+# cognitive loop offline, e.g. OPENROUTER_BASE_URL=http://127.0.0.1:8001/v1
+openrouter_base_url = os.environ.get("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+openai_base_url = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1")
+
+# LLM record/replay
+# "record" appends every provider response to <llm_record_path>; "replay"
+# serves responses back from it by request hash without touching the network.
+llm_record_mode = os.environ.get("LLM_RECORD_MODE", "off")
+llm_record_path = os.environ.get(
+    "LLM_RECORD_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "simulation", "llm_recording.jsonl"),
+)
+
+# LLM retries
+# Transport errors and rate limits are retried up to <llm_retry_attempts>
+# times with exponential backoff and full jitter. After
+# <llm_breaker_threshold> consecutive transport failures a model's circuit
+# breaker opens and its requests fail fast for <llm_breaker_reset_timeout>
+# seconds.
+llm_retry_attempts = int(os.environ.get("LLM_RETRY_ATTEMPTS", 4))
+llm_retry_base_delay = float(os.environ.get("LLM_RETRY_BASE_DELAY", 0.5))
+llm_retry_max_delay = float(os.environ.get("LLM_RETRY_MAX_DELAY", 8))
+llm_breaker_threshold = int(os.environ.get("LLM_BREAKER_THRESHOLD", 5))
+llm_breaker_reset_timeout = float(os.environ.get("LLM_BREAKER_RESET_TIMEOUT", 30))
+
+# Fused action resolution
+# When enabled, _determine_action resolves the location, emoji, event triple
+# and object state of a new action with one JSON prompt and only falls back
+# to the per-field prompts for fields that fail validation.
+fused_action_resolution = os.environ.get("FUSED_ACTION_RESOLUTION", "0") == "1"
+
+# Prompt templates
+# Templates are compiled once and kept in memory. Set
+# PROMPT_TEMPLATE_HOT_RELOAD=1 while editing prompts to recompile a template
+# whenever its file changes.
+prompt_template_hot_reload = os.environ.get("PROMPT_TEMPLATE_HOT_RELOAD", "0") == "1"
+
+# LLM token prices
+# JSON of USD per 1k tokens per model, used for the cost column of the prompt
+# metrics, e.g. {"openai/gpt-4o-mini": {"prompt": 0.00015, "completion": 0.0006}}
+llm_token_prices = json.loads(os.environ.get("LLM_TOKEN_PRICES", "{}"))
+
+# Model routing
+# Maps prompt templates to model tiers (model, timeout, max_tokens); see
+# persona/prompt_template/model_router.py for the defaults and the format.
+llm_routing_file = os.environ.get("LLM_ROUTING_FILE")
+llm_routing = json.loads(os.environ.get("LLM_ROUTING", "{}"))
+
+# Local poignancy scorer
+# When enabled, new memories are scored from their <k> nearest neighbours in
+# the persona's memory if those agree closely enough; the rest (and a
+# <audit_rate> sample of the confident cases) go to the poignancy prompt.
+poignancy_local_scorer = os.environ.get("POIGNANCY_LOCAL_SCORER", "0") == "1"
+poignancy_local_k = int(os.environ.get("POIGNANCY_LOCAL_K", 5))
+poignancy_local_min_similarity = float(os.environ.get("POIGNANCY_LOCAL_MIN_SIMILARITY", 0.9))
+poignancy_local_max_spread = int(os.environ.get("POIGNANCY_LOCAL_MAX_SPREAD", 2))
+poignancy_local_audit_rate = float(os.environ.get("POIGNANCY_LOCAL_AUDIT_RATE", 0.1))
+
+# Semantic memo
+# When enabled, the emoji and event-triple prompts of an action are looked up
+# per world by exact description and then by embedding nearest neighbour
+# (cosine similarity of at least <semantic_memo_threshold>) before the
+# prompt is run.
+semantic_memo_enabled = os.environ.get("SEMANTIC_MEMO", "0") == "1"
+semantic_memo_threshold = float(os.environ.get("SEMANTIC_MEMO_THRESHOLD", 0.95))
+
+# LLM endpoint pools
+# JSON of provider ("openrouter", "openai") -> list of OpenAI-compatible
+# endpoints ({"name", "base_url", "api_key" or "api_key_env"}). Requests go to
+# the healthiest endpoint; once it has taken longer than its
+# <llm_hedge_percentile> latency (clamped to the min/max delay), a duplicate
+# goes to the next endpoint and the first answer wins. Providers without an
+# entry use their single *_BASE_URL endpoint and are never hedged.
+llm_endpoints = json.loads(os.environ.get("LLM_ENDPOINTS", "{}"))
+llm_hedge_percentile = float(os.environ.get("LLM_HEDGE_PERCENTILE", 95))
+llm_hedge_min_delay = float(os.environ.get("LLM_HEDGE_MIN_DELAY", 0.5))
+llm_hedge_max_delay = float(os.environ.get("LLM_HEDGE_MAX_DELAY", 10))
+
+# Prompt context budgets
+# JSON of prompt (template file name, or "revise_identity") -> token budget
+# of its retrieved-statements section, on top of the defaults in
+# persona/prompt_template/context_builder.py.
+prompt_context_budgets = json.loads(os.environ.get("PROMPT_CONTEXT_BUDGETS", "{}"))
+
+# Memory ANN index
+# When enabled, each persona's associative memory keeps an IVF index over its
+# node embeddings once it has <memory_ann_min_rows> nodes, and retrieval
+# computes exact relevance only for the nodes in the <memory_ann_probes>
+# clusters nearest the focal point. A <memory_ann_audit_rate> share of
+# retrievals is also run exactly to measure recall and speedup.
+memory_ann_index = os.environ.get("MEMORY_ANN_INDEX", "0") == "1"
+memory_ann_min_rows = int(os.environ.get("MEMORY_ANN_MIN_ROWS", 4096))
+memory_ann_probes = int(os.environ.get("MEMORY_ANN_PROBES", 8))
+memory_ann_audit_rate = float(os.environ.get("MEMORY_ANN_AUDIT_RATE", 0.02))
+
+# Embedding storage
+# "json" keeps each memory's embeddings in embeddings.json. "float32" or
+# "float16" keep them in a memory-mapped binary matrix that saves append to;
+# an existing embeddings.json is migrated on first load.
+embedding_store = os.environ.get("EMBEDDING_STORE", "json")
+
+# Memory journal
+# When enabled, saving an associative memory to the folder it was loaded
+# from (or last saved to) appends the new nodes and last-access changes to
+# journal.jsonl instead of rewriting nodes.json, kw_strength.json and the
+# embeddings. Loading replays the journal on top of that snapshot.
+memory_journal = os.environ.get("MEMORY_JOURNAL", "0") == "1"